@@ -14,6 +14,10 @@ references = ""
 confidence = 6
 my_initials = "NMT"
 expert_rank = 6
+# Task ID of a compiled range to update with the compile daemon
+# (compile-daemon.py) once the opinions are saved, or None to skip
+task_id = None
+compile_daemon = "http://localhost:8765"
 
 #-------------------------- DO NOT CHANGE BELOW HERE --------------------------
 import pandas as pd
@@ -78,3 +82,21 @@ mc.refresh()
 
 # Done
 print("Opinions were saved.")
+
+# Update the compiled range for the selected units
+if task_id is not None:
+    import json
+    import urllib.request
+    request = urllib.request.Request(compile_daemon + "/recompile",
+                                     data=json.dumps({"gap_id": species_code,
+                                                      "task_id": task_id,
+                                                      "hucs": list(hucs)}).encode(),
+                                     headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(request) as response:
+            result = json.loads(response.read())
+        for layer in mc.layers():
+            layer.triggerRepaint()
+        print("Updated {0} units of the range in {1:.2f} seconds.".format(len(result["hucs"]), result["runtime"]))
+    except Exception as e:
+        print("The range was not updated: {0}".format(e))
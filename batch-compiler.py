@@ -0,0 +1,150 @@
+"""
+Compiles ranges for many species of a task in the parameters database.  Each
+species is compiled with range_compiler.compile_range() in a worker process
+that is reused for later species, and several species are compiled at once.  The overlap cache and spatial metadata
+template are kept next to the grid database, so they are shared by every
+species and stay warm between runs.  Each species gets its own task database
+and a log file in the working directory.
+
+Arguments are the same as for range-compiler.py, except that a list of
+species (or "all" for every species with the task in the parameters
+database) replaces the task name and species code, the occurrence record
+database paths can contain "{species}" to be filled in with each species
+code, and the last argument is the number of species to compile at once.
+Add --resume to continue interrupted compilations, or --new-records to only
+add records that are new since the ranges were compiled.
+"""
+import sys
+import os
+# Spawned workers import this file again with the flags stripped, so they are
+# handed to compile_species() rather than read from here.
+resume = "--resume" in sys.argv
+new_records = "--new-records" in sys.argv
+sys.argv = [x for x in sys.argv if x not in ("--resume", "--new-records")]
+#-----------------------  Species and variables  ------------------------------
+task_id = sys.argv[1]
+species = sys.argv[2]  # comma separated GAP species codes or "all"
+seasons = sys.argv[3]
+author = sys.argv[4]
+
+#---------------------------  Paths to use  -----------------------------------
+workDir = sys.argv[5]  # path to the working directory
+# Occurrence record databases, "{species}" is replaced with the species code
+ww_output = sys.argv[6]
+codeDir = sys.argv[7]
+gapproductionDir = sys.argv[8]
+wrangler_path = sys.argv[9]
+grid_db = sys.argv[10]
+parameters_db = "REPLACETHIS/Vert/DBase/range-parameters.sqlite"
+
+# Number of species to compile at once.  The cores are split among them.
+n_species = int(sys.argv[11])
+# ****************************************************************************
+import sqlite3
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from range_compiler import CompileConfig, compile_range, add_new_records
+
+# ----------------------------------------------------------- Compile species
+def compile_species(gap_id, n_workers, resume=False, new_records=False):
+    """
+    Compiles the range of a species and saves its output to a log file in the
+    working directory.
+
+    PARAMETERS
+    ----------
+    gap_id : string
+        The GAP code of the species
+    n_workers : integer
+        Number of worker processes for the species' compilation
+    resume : boolean
+        Whether to continue an interrupted compilation (--resume)
+    new_records : boolean
+        Whether to only add records that are new since the range was
+        compiled (--new-records)
+
+    RETURNS
+    -------
+    gap_id : string
+    returncode : integer
+        0 if the compilation succeeded, 1 if it raised an exception
+    runtime : timedelta
+    """
+    import traceback
+    time1 = datetime.now()
+    config = CompileConfig(task_name=gap_id, gap_id=gap_id, task_id=task_id,
+                           seasons=seasons.split(","), author=author,
+                           workDir=workDir,
+                           ww_output=tuple(ww_output.replace("{species}", gap_id).split(",")),
+                           codeDir=codeDir, gapproductionDir=gapproductionDir,
+                           wrangler_path=wrangler_path, grid_db=grid_db,
+                           parameters_db=parameters_db, n_workers=n_workers,
+                           resume=resume)
+
+    # Point stdout and stderr at the log file, including for the worker
+    # processes that the compilation starts.
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved = os.dup(1), os.dup(2)
+    returncode = 0
+    with open(os.path.join(workDir, gap_id + task_id + ".log"), "w") as log:
+        os.dup2(log.fileno(), 1)
+        os.dup2(log.fileno(), 2)
+        try:
+            if new_records:
+                add_new_records(config)
+            else:
+                compile_range(config)
+        except Exception:
+            traceback.print_exc()
+            returncode = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os.dup2(saved[0], 1)
+            os.dup2(saved[1], 2)
+            os.close(saved[0])
+            os.close(saved[1])
+    return gap_id, returncode, datetime.now() - time1
+
+
+if __name__ == "__main__":
+    timestamp0 = datetime.now()
+
+    # Get the species to compile from the tasks table
+    conn = sqlite3.connect(parameters_db)
+    species_ids = [x[0] for x in conn.execute("""SELECT species_id FROM tasks
+                                                 WHERE task_id = ?;""",
+                                              (task_id,)).fetchall()]
+    conn.close()
+    if species != "all":
+        requested = [x.strip() for x in species.split(",")]
+        missing = [x for x in requested if x not in species_ids]
+        if missing:
+            print("No {0} task for: {1}".format(task_id, ", ".join(missing)))
+        species_ids = [x for x in requested if x in species_ids]
+
+    # Split the cores among the species that are compiled at once
+    n_workers = max(1, os.cpu_count() // n_species)
+    print("Compiling {0} species, {1} at a time with {2} workers each".format(len(species_ids), n_species, n_workers))
+
+    # Species are compiled in worker processes that stay up between species,
+    # so the interpreter and imports are only paid for once per worker.
+    # Spawned workers don't inherit threads or connections from this process.
+    failed = []
+    with ProcessPoolExecutor(max_workers=n_species,
+                             mp_context=mp.get_context("spawn")) as executor:
+        futures = [executor.submit(compile_species, gap_id, n_workers,
+                                   resume=resume, new_records=new_records)
+                   for gap_id in species_ids]
+        for future in as_completed(futures):
+            gap_id, returncode, runtime = future.result()
+            print("{0}: {1} ({2})".format(gap_id, "done" if returncode == 0 else "FAILED", runtime))
+            if returncode != 0:
+                failed.append(gap_id)
+
+    runtime = datetime.now() - timestamp0
+    print("Compiled {0} species in {1} ({2:.1f} species/hour)".format(len(species_ids) - len(failed), runtime, (len(species_ids) - len(failed)) / max(runtime.total_seconds() / 3600, 1e-9)))
+    if failed:
+        print("Failed: " + ", ".join(failed))
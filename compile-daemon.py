@@ -0,0 +1,20 @@
+"""
+Runs the compile daemon (see range_compiler/daemon.py), which applies edited
+opinions to compiled ranges for a few subregions at a time, e.g. right after
+register_opinion.py in QGIS.
+
+Arguments: author, working directory, code directory, gapproduction
+directory, wrangler directory, grid database, and optionally the port
+(default 8765).
+"""
+import sys
+from range_compiler.daemon import serve
+
+if __name__ == "__main__":
+    defaults = {"author": sys.argv[1],
+                "workDir": sys.argv[2],
+                "codeDir": sys.argv[3],
+                "gapproductionDir": sys.argv[4],
+                "wrangler_path": sys.argv[5],
+                "grid_db": sys.argv[6]}
+    serve(defaults, port=int(sys.argv[7]) if len(sys.argv) > 7 else 8765)
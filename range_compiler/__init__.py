@@ -0,0 +1,11 @@
+"""
+The USGS Gap Analysis Project Transparent Range Compiler.
+
+Compile a range with compile_range(CompileConfig(...)), and add records that
+are new since then with add_new_records().  Apply edited opinions to a few
+subregions of a compiled range with recompile_hucs().
+"""
+from .compiler import CompileConfig, compile_range, add_new_records, recompile_hucs, import_report
+
+__all__ = ["CompileConfig", "compile_range", "add_new_records",
+           "recompile_hucs", "import_report"]
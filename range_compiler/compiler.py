@@ -0,0 +1,5494 @@
+"""
+Title: The USGS Gap Analysis Project Transparent Range Compiler
+Author: Nathan Tarr; nmtarr@ncsu.edu
+Date: July 1, 2022
+
+Description: Compiles a presence range map using species occurrence records and
+    a polygon grid such as the GAP 12-digit HUCS along with predefined
+    parameters and rules for compilation that are stored in a parameters
+    database.
+
+Notes:
+- Compile a range with compile_range(CompileConfig(...)), or from the command
+    line with "python range-compiler.py".
+- Importing this module has no side effects and worker processes only need
+    functions from it, so it works with the spawn start method (e.g. on
+    Windows, or in notebooks) as long as compile_range() is called under
+    if __name__ == "__main__" in scripts.
+- Heavy dependencies (pandas, geopandas, wrangler_functions, gapproduction)
+    are imported by the stages that use them.  See import_report() for what
+    each one costs.
+- Input must come from the wildlife-wrangler.
+"""
+import os
+import sys
+import sqlite3
+import threading
+from dataclasses import dataclass, field
+from datetime import datetime
+
+code_version = "0.1.3"
+
+periods = ((2001, 2005), (2006, 2010), (2011, 2015), (2016, 2020), (2021, 2025))
+
+# Expert opinions on species' ranges
+opinion_db = "REPLACETHIS/Vert/DBase/range_opinions.sqlite"
+
+# Universal variables
+RangeCodesDict2020 = {"Presence": {1: "Confirmed present",
+                                   2: "Likely present",
+                                   3: "Suspected present",
+                                   4: "Suspected absent",
+                                   5: "Likely absent"},
+                      "Season": {"y": "Year-round",
+                                 "s": "Summer",
+                                 "w": "Winter"}}
+
+RangeCodesDict2001 = {"Presence": {1: "Known/extant",
+                                   2: "Possibly present",
+                                   3: "Potential for presence",
+                                   4: "Extirpated/historical presence",
+                                   5: "Extirpated purposely (applies to introduced species only)",
+                                   6: "Occurs on indicated island chain",
+                                   7: "Unknown"},
+                "Origin": {1: "Native", 2: "Introduced", 3: "Either introduced or native",
+                           4: "Reintroduced", 5: "Either introduced or reintroduced",
+                           6: "Vagrant", 7: "Unknown"},
+                "Reproduction": {1: "Breeding", 2: "Nonbreeding",
+                                 3: "Both breeding and nonbreeding", 7: "Unknown"},
+                 "Season": {1: "Year-round", 2: "Migratory", 3: "Winter", 4: "Summer",
+                            5: "Passage migrant or wanderer", 6: "Seasonal permanence uncertain",
+                            7: "Unknown", 8: "Vagrant"}}
+
+# ---------------------------------------------------- Compilation settings
+@dataclass
+class CompileConfig:
+    """
+    Settings for compiling a range with compile_range().
+
+    ATTRIBUTES
+    ----------
+    task_name : string
+        A short, memorable name to use for file names etc
+    gap_id : string
+        The GAP code of the species
+    task_id : string
+        The task ID from the parameters database
+    seasons : list of season codes like "S", "W", or "Y"
+    author : string
+        Who ran the compilation
+    workDir : string
+        Path to the working directory
+    ww_output : tuple of paths to occurrence record databases in order of
+        precedence.  Records from the first will take precedence if
+        duplicates arise.
+    codeDir : string
+        Path to this code's directory
+    gapproductionDir : string
+        Path to the directory with the gapproduction package
+    wrangler_path : string
+        Path to the directory with wrangler_functions
+    grid_db : string
+        Path to the grid sqlite database
+    parameters_db : string
+        Path to the parameters database
+    intersection_engine : string
+        Engine for intersecting records with the grid: "spatialite" or
+        "strtree".  The "strtree" engine uses vectorized shapely (version 2
+        or later) calls.
+    n_workers : integer
+        Number of worker processes (or threads, for "strtree") used to
+        intersect records with the grid.  Defaults to the CPU count.
+    worker_memory_mb : number
+        Approximate memory ceiling, in megabytes, for the records that each
+        of those workers holds at once.  Records are intersected in batches
+        that fit.
+    periods : tuple of (start year, end year) time periods
+    code_version : string
+    resume : boolean
+        Whether to keep the task database from an earlier run and skip the
+        stages that finished in it with the same inputs (see run_stages()).
+        Otherwise, the task database is rebuilt from scratch.
+    """
+    task_name: str
+    gap_id: str
+    task_id: str
+    seasons: list
+    author: str
+    workDir: str
+    ww_output: tuple
+    codeDir: str
+    gapproductionDir: str
+    wrangler_path: str
+    grid_db: str
+    parameters_db: str = "REPLACETHIS/Vert/DBase/range-parameters.sqlite"
+    intersection_engine: str = "spatialite"
+    n_workers: int = field(default_factory=os.cpu_count)
+    worker_memory_mb: float = 512
+    periods: tuple = periods
+    code_version: str = code_version
+    resume: bool = False
+
+    @property
+    def task_db(self):
+        """Path to the output (task) database."""
+        return self.workDir + "/" + self.gap_id + self.task_id + ".sqlite"
+
+    @property
+    def tmpDir(self):
+        """Temp directory in the working directory."""
+        return self.workDir + "temp/"
+
+    @property
+    def overlap_cache_db(self):
+        """
+        Overlaps of records and the grid are cached next to the grid database
+        and reused by later runs for records whose footprint has not changed.
+        """
+        return os.path.splitext(self.grid_db)[0] + "_overlap_cache.sqlite"
+
+    @property
+    def spatial_template_db(self):
+        """
+        A database with initialized spatial metadata is also kept next to the
+        grid database and copied into the in-memory databases of workers.
+        """
+        return os.path.splitext(self.grid_db)[0] + "_spatial_template.sqlite"
+
+#  ------------------------------------------------------------- Get parameters
+def get_parameters(parameters_db, task_id, gap_id):
+    """
+    Retrieves the compilation parameters from the parameters database
+
+    PARAMETERS
+    ----------
+    parameters_db -- path to the parameters database
+    task_id -- the task ID from the parameters database
+    gap_id -- gap species code. For example, 'bAMROx'
+    """
+    cursor, conn = spatialite(parameters_db)
+    months = cursor.execute("""SELECT months FROM tasks WHERE task_id = ? AND species_id = ?;""", (task_id, gap_id)).fetchone()
+    months = tuple([x.strip().zfill(2) for x in months[0].split(',')])
+    years = cursor.execute("""SELECT years FROM tasks WHERE task_id = ? AND species_id = ?;""", (task_id, gap_id)).fetchone()
+    years = tuple([x.strip() for x in years[0].split(',')])
+    error_tolerance = cursor.execute("""SELECT error_tolerance FROM tasks WHERE task_id = ? AND species_id = ?;""", (task_id, gap_id)).fetchone()
+    creator = cursor.execute("""SELECT creator FROM tasks WHERE task_id = ? AND species_id = ?;""", (task_id, gap_id)).fetchone()
+    extralimital_m = cursor.execute("""SELECT extralimital_cutoff_m FROM tasks WHERE task_id = ? AND species_id = ?;""", (task_id, gap_id)).fetchone()[0]
+    use_GAPv1 = cursor.execute("""SELECT use_GAPv1 FROM tasks WHERE task_id = ? AND species_id = ?;""", (task_id, gap_id)).fetchone()[0]
+    if use_GAPv1 == 'yes':
+        use_GAPv1 = True
+    else:
+        use_GAPv1 = False
+    use_opinions = cursor.execute("""SELECT use_opinion FROM tasks WHERE task_id = ? AND species_id = ?;""", (task_id, gap_id)).fetchone()[0]
+    if use_opinions == 'yes':
+        use_opinions = True
+    else:
+        use_opinions = False
+    use_observations = cursor.execute("""SELECT use_observations FROM tasks WHERE task_id = ? AND species_id = ?;""", (task_id, gap_id)).fetchone()[0]
+    if use_observations == 'yes':
+        use_observations = True
+    else:
+        use_observations = False
+
+    conn.close()
+
+    return (years, months, error_tolerance, creator, extralimital_m, use_GAPv1, 
+           use_observations, use_opinions)
+
+# ----------------------------------------------------- Prep occurrence records
+def wrangler_records(database, wrangler_path):
+    """
+    Gets the species occurrence records (wildlife wrangler output) as rows
+        for the occurrence_records table, with footprint geometries as WKB in
+        EPSG:5070.  Footprints are described once here so that intersections
+        don't have to: their area, centroid (x, y), and, for circular
+        footprints (buffered points), radius so that their overlaps can be
+        computed exactly.  Radius is None for footprints that aren't circles.
+
+    (database, wrangler_path) --> list of tuples
+
+    PARAMETERS
+    ----------
+    database -- path to the wildlife wrangler occurrence records output
+    wrangler_path -- path to the directory with wrangler_functions
+
+    RETURNS
+    -------
+    rows -- list of (taxon_id, record_id, eventDate, weight, weight_notes,
+        source_db, footprint_area, x, y, radius, geometry) tuples
+    """
+    import numpy as np
+    timestamp = datetime.now()
+
+    if wrangler_path not in sys.path:
+        sys.path.append(wrangler_path)
+    import wrangler_functions as wf
+
+    # Get records
+    df = wf.spatial_output(database=database, make_file=False,
+                           mode="footprint", output_file=None, epsg=5070)
+    geometry = df.geometry
+
+    # Describe the footprints.  A circle's area is close to pi r^2 both ways,
+    # squares (4 r^2) and other shapes as wide as they are tall aren't.
+    area = geometry.area.to_numpy()
+    centroids = geometry.centroid
+    bounds = geometry.bounds
+    radius = ((bounds["maxx"] - bounds["minx"]) / 2).to_numpy()
+    circle = ((np.abs((bounds["maxy"] - bounds["miny"]).to_numpy() / 2 - radius) <= 0.01 * radius)
+              & (area >= 0.98 * np.pi * radius * radius)
+              & (area <= 1.02 * np.pi * radius * radius))
+
+    # Missing values become NULL
+    attributes = (df[["taxon_id", "record_id", "eventDate", "weight", "weight_notes"]]
+                  .astype(object))
+    attributes = attributes.where(attributes.notna(), None)
+    source_db = database.split("/")[-1].replace(".sqlite", "")
+
+    rows = [(taxon_id, str(record_id),
+             None if eventDate is None else str(eventDate), weight, weight_notes,
+             source_db, float(a), float(x), float(y),
+             float(r) if c else None, wkb)
+            for (taxon_id, record_id, eventDate, weight, weight_notes), a, x, y, r, c, wkb
+            in zip(attributes.itertuples(index=False, name=None), area,
+                   centroids.x, centroids.y, radius, circle,
+                   geometry.to_wkb())]
+    print("Got {0} occurrence records from {1}: ".format(len(rows), source_db) + str(datetime.now() - timestamp))
+    return rows
+
+# --------------------------------------------- Connect to sqlite w/ spatialite
+def spatialite(db=":memory:", template=None):
+    """
+    Creates a connection and cursor for sqlite db and enables spatialite
+        extension and shapefile functions.  Defaults to in-memory database.
+        If a template is given, its contents (e.g., initialized spatial
+        metadata, see spatial_template()) are copied into db with the sqlite
+        backup API.
+
+    (db) --> cursor, connection
+
+    PARAMETERS
+    ----------
+    db -- path to the db you want to create or connect to.
+    template -- path to a db to copy into db.
+    """
+    import os
+    import sqlite3
+    import platform
+
+    # Environment variables need to be handled
+    if platform.system() == 'Windows':
+        os.environ['PATH'] = os.environ['PATH'] + ';' + 'C:/Spatialite'
+        os.environ['SPATIALITE_SECURITY'] = 'relaxed'# DOES THIS NEED TO BE RUN BEFORE EVERY CONNECTION????? ?NOT WORKING  ???????????
+
+    if platform.system() == 'Darwin':  # DOES THIS NEED TO BE RUN BEFORE EVERY CONNECTION?????????????????
+        #os.putenv('SPATIALITE_SECURITY', 'relaxed')
+        os.environ['SPATIALITE_SECURITY'] = 'relaxed'
+    # Wait for writes by other stages or workers rather than failing
+    connection = sqlite3.connect(db, timeout=600, check_same_thread=False)
+    cursor = connection.cursor()
+    os.putenv('SPATIALITE_SECURITY', 'relaxed')
+    connection.enable_load_extension(True)
+    cursor.execute('SELECT load_extension("mod_spatialite");')
+    if template is not None:
+        source = sqlite3.connect(template)
+        source.backup(connection)
+        source.close()
+    # Use write-ahead log mod to allow parallelism
+    cursor.executescript("""PRAGMA synchronous=OFF;
+                            PRAGMA journal_mode=WAL;""")
+    connection.commit()
+    return cursor, connection
+
+# ------------------------------------------ Template with spatial metadata
+def spatial_template(template_db):
+    """
+    Creates a database with initialized spatial metadata to be copied into
+    new in-memory databases with spatialite(template=template_db).  Copying
+    is much faster than running InitSpatialMetaData(), which fills the
+    spatial_ref_sys table, in every worker.  The template is only created if
+    it doesn't exist yet.
+
+    PARAMETERS
+    ----------
+    template_db : string
+        Path to the template database
+    """
+    import os
+    from datetime import datetime
+    time1 = datetime.now()
+
+    if os.path.exists(template_db):
+        return
+
+    # Build under a name of this process's own and then move it into place,
+    # in case other compilations are making it at the same time
+    tmp_db = "{0}.{1}.tmp".format(template_db, os.getpid())
+    try:
+        cursor, conn = spatialite(tmp_db)
+        cursor.executescript("""SELECT InitSpatialMetaData(1);
+                                PRAGMA journal_mode=DELETE;""")
+        conn.commit()
+        conn.close()
+        os.replace(tmp_db, template_db)
+        print("Created a spatial metadata template: " + str(datetime.now() - time1))
+    except Exception as e:
+        print("!! FAILED to create a spatial metadata template")
+        print(e)
+        return False
+
+#  --------------------------------------------------------- Download GAP range
+def download_GAP_range_CONUS2001v1(gap_id, toDir):
+    """
+    Downloads GAP Range CONUS 2001 v1 file and returns path to the unzipped
+    file.  NOTE: doesn't include extension in returned path so that you can
+    specify if you want csv or shp or xml when you use the path.
+
+    PARAMETERS
+    ----------
+    gap_id -- gap species code. For example, 'bAMROx'
+    toDir -- path to the directory where you want the file to be downloaded.
+
+    RETURNS
+    -------
+    sb_success -- boolean indicating whether the download was successful
+    rng_zip -- path to the unzipped file
+    """
+    import sciencebasepy
+    import zipfile
+    from datetime import datetime
+    time0 = datetime.now()
+
+    # Connect
+    sb = sciencebasepy.SbSession()
+
+    try:
+        # Search for gap range item in ScienceBase
+        gap_id = gap_id[0] + gap_id[1:5].upper() + gap_id[5]
+        item_search = '{0}_CONUS_2001v1 Range Map'.format(gap_id)
+        items = sb.find_items_by_any_text(item_search)
+
+        # Get a public item.  No need to log in.
+        rng =  items['items'][0]['id']
+        item_json = sb.get_item(rng)
+        get_files = sb.get_item_files(item_json, toDir)
+
+        # Unzip
+        rng_zip = toDir + item_json['files'][0]['name']
+        zip_ref = zipfile.ZipFile(rng_zip, 'r')
+        zip_ref.extractall(toDir)
+        zip_ref.close()
+
+        # Return path to range file without extension
+        print("Downloaded GAP 2001v1 range map: " + str(datetime.now() - time0))
+        sb_success = True
+        return sb_success, rng_zip.replace('.zip', '')
+
+    except:
+        sb_success = False
+        print("No data available from ScienceBase")
+        return sb_success, "No Zip"
+
+# ------------------------------------------------------------- Query GAP range
+def get_GAP_range_database_INCOMPLETE(species_code : str, db : str,
+                           toDir : str) -> tuple:
+    '''
+    THIS FUNCTION WILL NOT WORK IN THE COMPILER PROCESS BECAUSE IT MAY PRODUCE
+    2016 RANGE CSV FILE THAT WON'T BE ACCOMODATED.
+
+    ADDITIONAL ISSUES NEED TO BE ADDRESSED BEFORE USING THAT RELATE TO
+    TO PROVENANCE AND THE INCORPORATION OF EDITS TO THE GAP DATABASE THAT WERE
+    MADE OUTSIDE OF THIS FRAMEWORK/PROCESS.
+
+    Reads in a species' range from a GAP database and returns a dataframe.
+
+    PARAMETERS
+    ----------
+    species_code : GAP 6-character species code to get HUC range for
+        Example: 'aBESAx'
+    db : GAP vertebrate database version name
+        Example: 'GapVert_48_2016_test'
+    toDir : path to the directory where you want the file to be downloaded.
+
+    RETURNS
+    -------
+    success : Boolean indicating whether the function ran successfully.
+    out_csv : Path to the output file (csv).
+
+    '''
+    import pandas as pd
+    from gapproduction import database
+    try:
+        year = db[-4:]
+
+        # Connect to the database
+        sppCur, sppConn = database.ConnectDB(db)
+        
+        # Build an SQL statement using a species code
+        # Limit the HUC codes to only CONUS - i.e. < 190000000000                
+        sql = """SELECT t.strHUC12RNG, t.intGapOrigin, t.intGapPres,
+                        t.intGapRepro, t.intGapSeas
+                    FROM dbo.tblRanges as t
+                    WHERE (t.strUC = ?) AND (t.strHUC12RNG < 190000000000)
+                    ;"""
+                    
+        # Set query results as a pandas dataframe
+        df = pd.read_sql(sql, sppConn, params=['mAMMAx'])
+        
+        # Add string version columns of each column with "GAP" in the name
+        #for col in df.columns:
+        #    if "intGAP" in col:
+        #        df["strGAP" + col[6:]] = [str(x) for x in df[col]]
+
+        # Delete cursor and close db connection
+        del sppCur
+        sppConn.close()
+
+        # Save to csv file
+        out_csv = toDir + species_code + f"_CONUS_RANGE_{year}v1.csv"
+        df.to_csv(out_csv, index=False)
+
+        success = True
+        return success, out_csv
+    except:
+        success = False
+        print("!!! Unable to get range from GAP database !!!")
+        return success, "FAILED"
+
+#  ----------------------------------------------- Make database for processing
+def make_range_db(task_db, gap_id, inDir, workDir, grid_db, sb_success,
+                  seasons, parameters_db, use_v1=True,
+                  use_observations=True):
+    """
+    Builds an sqlite database in which to store range information.
+    Creates tables for GAP range (full and presence column only with geometry).
+
+    PARAMETERS
+    ---------
+    task_db -- name of database to create for task
+    gap_id -- gap species code. For example, 'bAMROx'
+    grid_db -- path to GAP's 12 digit hucs in sqlite/spatialite format
+    in -- project's input directory
+    workDir -- output directory for this repo
+    sb_success -- returned variable from 2001 range download function
+    parameters_db -- path to the parameters database
+    use_v1 -- boolean indicating whether to use the 2001 range
+    use_observations -- boolean indicating whether to use the occurrence records
+    use_opinion -- boolean indicating whether to use the expert opinion
+
+    RETURNS
+    -------
+    created -- boolean, False if a presence, season, or last_record table
+        wasn't created
+    """
+    import sqlite3
+    import pandas as pd
+    import os
+    from datetime import datetime
+    time0 = datetime.now()
+
+    with _markers_lock:
+        # Delete db if it exists, but keep the markers of stages that have
+        # finished (see run_stages())
+        markers = []
+        if os.path.exists(task_db):
+            markers = [(name, fingerprint, result)
+                       for name, (fingerprint, result) in stage_markers(task_db).items()]
+            for path in (task_db, task_db + "-wal", task_db + "-shm"):
+                if os.path.exists(path):
+                    os.remove(path)
+
+        # Create the database
+        cursorQ, conn = spatialite(task_db)
+
+        cursorQ.execute('SELECT InitSpatialMetaData(1);')
+        print("Check Spatial MetaData: -------------------")
+        print(cursorQ.execute('SELECT checkSpatialMetaData();').fetchall())
+
+        cursorQ.execute("""CREATE TABLE stage_markers (stage TEXT PRIMARY KEY,
+                                                       fingerprint TEXT,
+                                                       result TEXT,
+                                                       finished TEXT);""")
+        cursorQ.executemany("""INSERT INTO stage_markers VALUES (?, ?, ?, ?);""",
+                            [x + (str(datetime.now()),) for x in markers])
+        conn.commit()
+
+
+    ########################################################## ADD 2001v1 RANGE
+    csvfile = inDir + gap_id + "_CONUS_RANGE_2001v1.csv"
+    if sb_success == True:
+        sp_range = pd.read_csv(csvfile, dtype={'strHUC12RNG':str})
+        sp_range.to_sql('range_2001v1', conn, if_exists='replace', index=False,
+                        index_label="strHUC12RNG")
+        conn.commit() # Commit and close here, reopen connection or else code throws errors.
+        conn.close()
+
+        # Rename columns and drop some too.
+        sql1 = """
+        ALTER TABLE range_2001v1 RENAME TO garbage;
+
+        CREATE TABLE range_2001v1 AS SELECT strHUC12RNG,
+                                    intGapOrigin AS intGAPOrigin,
+                                    intGapPres AS intGAPPresence,
+                                    intGapRepro AS intGAPReproduction,
+                                    intGapSeas AS intGAPSeason,
+                                    Origin AS strGAPOrigin,
+                                    Presence AS strGAPPresence,
+                                    Reproduction AS strGAPReproduction,
+                                    Season AS strGAPSeason
+                            FROM garbage;
+        DROP TABLE garbage;
+
+        /*  Set a primary key -- this is cumbersome code due to sqlite3/pandas limitations.*/
+        PRAGMA foreign_keys=off;
+
+        BEGIN TRANSACTION;
+        ALTER TABLE range_2001v1 RENAME TO garbage2;
+
+        /*create a new table with the same column names and types while
+        defining a primary key for the desired column*/
+        CREATE TABLE range_2001v1 (strHUC12RNG TEXT PRIMARY KEY,
+                                intGAPOrigin INTEGER,
+                                intGAPPresence INTEGER,
+                                intGAPReproduction INTEGER,
+                                intGAPSeason INTEGER,
+                                strGAPOrigin TEXT,
+                                strGAPPresence TEXT,
+                                strGAPReproduction TEXT,
+                                strGAPSeason TEXT);
+
+        INSERT INTO range_2001v1 SELECT * FROM garbage2;
+
+        DROP TABLE garbage2;
+        COMMIT TRANSACTION;
+
+        PRAGMA foreign_keys=on;
+
+        CREATE INDEX idx_range2001_unit ON range_2001v1 (strHUC12RNG);
+        """
+        cursorQ, conn = spatialite(task_db)
+        cursorQ.executescript(sql1)
+
+    else:
+        # Create a data frame that represents an empty range, etc.
+        # Rename columns and drop some too.
+        sql1 = """
+        BEGIN TRANSACTION;
+
+        /*create a new table with the same column names and types while
+        defining a primary key for the desired column*/
+        CREATE TABLE range_2001v1 (strHUC12RNG TEXT PRIMARY KEY,
+                                intGAPOrigin INTEGER,
+                                intGAPPresence INTEGER,
+                                intGAPReproduction INTEGER,
+                                intGAPSeason INTEGER,
+                                strGAPOrigin TEXT,
+                                strGAPPresence TEXT,
+                                strGAPReproduction TEXT,
+                                strGAPSeason TEXT);
+
+        COMMIT TRANSACTION;
+
+        PRAGMA foreign_keys=on;
+
+        CREATE INDEX idx_range2001_unit ON range_2001v1 (strHUC12RNG);
+        """
+        cursorQ.executescript(sql1)
+
+    ######################################################## ADD PRESENCE TABLE
+    sqll = """
+    ATTACH DATABASE '{0}' AS hucs;
+
+    CREATE TABLE presence AS SELECT range_2001v1.strHUC12RNG,
+                                    range_2001v1.intGAPPresence AS presence_2001v1,
+                                    shucs.geom_5070
+                             FROM range_2001v1 LEFT JOIN hucs.huc12rng_gap_polygon as shucs
+                                               ON range_2001v1.strHUC12RNG = shucs.HUC12RNG;
+    """.format(grid_db)
+    try:
+        cursorQ.executescript(sqll)
+    except Exception as e:
+        print(e)
+
+    sql = """
+    /* Set a primary key */
+    BEGIN TRANSACTION;
+    ALTER TABLE presence RENAME TO garbage3;
+
+    /*Create a new table with the same column names and types while
+    defining a primary key for the desired column*/
+    CREATE TABLE presence (strHUC12RNG TEXT PRIMARY KEY,
+                           presence_2001v1 INTEGER,
+                           geom_5070);
+
+    INSERT INTO presence SELECT * FROM garbage3;
+
+    DROP TABLE garbage3;
+    COMMIT TRANSACTION;
+    PRAGMA foreign_keys=on;
+    """
+    try:
+        cursorQ.executescript(sql)
+    except Exception as e:
+        print(e)
+
+    sql="""
+    CREATE INDEX idx_presence_unit ON presence (strHUC12RNG);
+
+    SELECT RecoverGeometryColumn('presence', 'geom_5070', 5070, 'POLYGON',
+                                 'XY');
+    """
+    try:
+        cursorQ.executescript(sql)
+    except Exception as e:
+        print(e)
+    conn.commit()
+
+
+    ########################################################## ADD SUMMER TABLE
+    if "S" in seasons:
+        sqll = """
+        CREATE TABLE summer AS SELECT range_2001v1.strHUC12RNG,
+                                        range_2001v1.intGAPSeason AS summer_2001v1,
+                                        shucs.geom_5070
+                                FROM range_2001v1 LEFT JOIN hucs.huc12rng_gap_polygon as shucs
+                                                ON range_2001v1.strHUC12RNG = shucs.HUC12RNG
+                                WHERE (range_2001v1.strGAPSeason = 'Summer' 
+                                OR range_2001v1.strGAPSeason = 'Year-round')
+                                AND (intGAPPresence NOT IN (4, 5));
+        """.format(grid_db)
+        try:
+            cursorQ.executescript(sqll)
+        except Exception as e:
+            print(e)
+
+        sql = """
+        /* Set a primary key */
+        BEGIN TRANSACTION;
+        ALTER TABLE summer RENAME TO garbage;
+
+        /*Create a new table with the same column names and types while
+        defining a primary key for the desired column*/
+        CREATE TABLE summer (strHUC12RNG TEXT PRIMARY KEY,
+                            summer_2001v1 INTEGER,
+                            geom_5070);
+
+        INSERT INTO summer SELECT * FROM garbage;
+
+        DROP TABLE garbage;
+        COMMIT TRANSACTION;
+        PRAGMA foreign_keys=on;
+        """
+        try:
+            cursorQ.executescript(sql)
+        except Exception as e:
+            print(e)
+
+        sql="""
+        CREATE INDEX idx_summer_unit ON summer (strHUC12RNG);
+
+        SELECT RecoverGeometryColumn('summer', 'geom_5070', 5070, 'POLYGON',
+                                    'XY');
+        """
+        try:
+            cursorQ.executescript(sql)
+        except Exception as e:
+            print(e)
+        conn.commit()
+
+    ########################################################## ADD WINTER TABLE
+    if "W" in seasons:
+        sqll = """
+        CREATE TABLE winter AS SELECT range_2001v1.strHUC12RNG,
+                                        range_2001v1.intGAPSeason AS winter_2001v1,
+                                        shucs.geom_5070
+                                FROM range_2001v1 LEFT JOIN hucs.huc12rng_gap_polygon as shucs
+                                                ON range_2001v1.strHUC12RNG = shucs.HUC12RNG
+                                WHERE (range_2001v1.strGAPSeason = 'Winter'
+                                OR range_2001v1.strGAPSeason = 'Year-round')
+                                AND (intGAPPresence NOT IN (4, 5));
+        """.format(grid_db)
+        try:
+            cursorQ.executescript(sqll)
+        except Exception as e:
+            print(e)
+
+        sql = """
+        /* Set a primary key */
+        BEGIN TRANSACTION;
+        ALTER TABLE winter RENAME TO garbage;
+
+        /*Create a new table with the same column names and types while
+        defining a primary key for the desired column*/
+        CREATE TABLE winter (strHUC12RNG TEXT PRIMARY KEY,
+                            winter_2001v1 INTEGER,
+                            geom_5070);
+
+        INSERT INTO winter SELECT * FROM garbage;
+
+        DROP TABLE garbage;
+        COMMIT TRANSACTION;
+        PRAGMA foreign_keys=on;
+        """
+        try:
+            cursorQ.executescript(sql)
+        except Exception as e:
+            print(e)
+
+        sql="""
+        CREATE INDEX idx_winter_unit ON winter (strHUC12RNG);
+
+        SELECT RecoverGeometryColumn('winter', 'geom_5070', 5070, 'POLYGON',
+                                    'XY');
+        """
+        try:
+            cursorQ.executescript(sql)
+        except Exception as e:
+            print(e)
+        conn.commit()
+
+    ###################################################### ADD YEAR ROUND TABLE
+    if "Y" in seasons:
+        sqll = """
+        CREATE TABLE year_round AS SELECT range_2001v1.strHUC12RNG,
+                                        range_2001v1.intGAPSeason AS year_round_2001v1,
+                                        shucs.geom_5070
+                                FROM range_2001v1 LEFT JOIN hucs.huc12rng_gap_polygon as shucs
+                                                ON range_2001v1.strHUC12RNG = shucs.HUC12RNG
+                                WHERE range_2001v1.strGAPSeason = 'Year-round'
+                                AND intGAPPresence NOT IN (4, 5);
+        """.format(grid_db)
+        try:
+            cursorQ.executescript(sqll)
+        except Exception as e:
+            print(e)
+
+        sql = """
+        /* Set a primary key */
+        BEGIN TRANSACTION;
+        ALTER TABLE year_round RENAME TO garbage;
+
+        /*Create a new table with the same column names and types while
+        defining a primary key for the desired column*/
+        CREATE TABLE year_round (strHUC12RNG TEXT PRIMARY KEY,
+                            year_round_2001v1 INTEGER,
+                            geom_5070);
+
+        INSERT INTO year_round SELECT * FROM garbage;
+
+        DROP TABLE garbage;
+        COMMIT TRANSACTION;
+        PRAGMA foreign_keys=on;
+        """
+        try:
+            cursorQ.executescript(sql)
+        except Exception as e:
+            print(e)
+
+        sql="""
+        CREATE INDEX idx_year_round_unit ON year_round (strHUC12RNG);
+
+        SELECT RecoverGeometryColumn('year_round', 'geom_5070', 5070, 'POLYGON',
+                                    'XY');
+        """
+        try:
+            cursorQ.executescript(sql)
+        except Exception as e:
+            print(e)
+        conn.commit()
+
+    ######################################################### LAST RECORD TABLE
+    if use_observations == True:
+        sql="""
+        CREATE TABLE last_record (strHUC12RNG TEXT,
+                                record_id TEXT,
+                                eventDate TEXT,
+                                weight INT,
+                                proportion_overlap,
+                                age_in_weeks INT,
+                                date_assessed INT,
+                                geom_5070);
+        """
+        try:
+            cursorQ.executescript(sql)
+        except Exception as e:
+            print(e)
+
+    # Errors above are only printed, so make sure the tables are all there
+    tables = ["presence"] + [{"S": "summer", "W": "winter", "Y": "year_round"}[x]
+                             for x in seasons if x in ("S", "W", "Y")]
+    if use_observations == True:
+        tables.append("last_record")
+    existing = [x[0] for x in cursorQ.execute("SELECT name FROM sqlite_master;")]
+    missing = [x for x in tables if x not in existing]
+
+    conn.commit()
+    conn.close()
+    del cursorQ
+
+    if missing:
+        print("!! FAILED to create tables: {0}".format(", ".join(missing)))
+        return False
+    print("Created range database: " + str(datetime.now() - time0))
+    return True
+
+#  ------------------------------------------------------- Compilation info
+def compilation_info(task_db, gap_id, task_id, parameters_db, author,
+                     code_version=code_version):
+    """
+    Create a table documenting author, date, code version, comments.  Build
+    it from the parameters database record.  This is kept apart from
+    make_range_db() so that it can be updated without rebuilding the task
+    database.
+
+    PARAMETERS
+    ---------
+    task_db -- path to the task database
+    gap_id -- gap species code. For example, 'bAMROx'
+    task_id -- the task ID from the parameters database
+    parameters_db -- path to the parameters database
+    author -- who ran the compilation
+    code_version -- version of this code
+    """
+    import pandas as pd
+    conn = sqlite3.connect(task_db, timeout=600)
+    conP = sqlite3.connect(parameters_db)
+
+    # Get parameters from the parameters database
+    pardf = pd.read_sql("""SELECT * FROM tasks 
+                           WHERE task_id = ? AND species_id = ?;""",
+                        conP, params=[task_id, gap_id])
+    conP.close()
+
+    # Add column with who ran the code
+    pardf['who_ran'] = author
+
+    # Add column with code version
+    pardf['code_version'] = code_version
+
+    # Add column with date
+    pardf['run_date'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    # Write to task database
+    pardf.to_sql('compilation_info', conn, if_exists='replace', index=False)
+    conn.commit()
+    conn.close()
+
+#  ------------------------------------------------------------ Insert opinions
+def insert_opinions(species, seasons, years, task_db):
+    """
+    Retrieves opinion data from the range_opinions database and filters records
+    according to the reconciliation criteria and years of interest.
+
+    PARAMETERS
+    ----------
+    species : GAP species code
+    years : tuple of years of interest
+    task_db : path to the range database
+
+    RETURNS
+    -------
+    inserted : boolean, False if the opinions weren't inserted or adjusted
+    """
+    import pandas as pd
+    connection = sqlite3.connect(opinion_db)
+
+    # Define a function for retrieving opinions for a species and season
+    def get_opinions(season, species, years):
+        """Retrieve opinions for a species and season.
+
+        Parameters
+        ----------
+        season : str
+            Season to retrieve opinions for.
+        species : str
+            Species code to retrieve opinions for.
+        years : list
+            List of years to retrieve opinions for.
+
+        Returns
+        -------
+        pd.DataFrame
+            Dataframe of opinions for the specified season, species, and years.
+        """
+        # Connect to the task database
+        connection = sqlite3.connect(opinion_db)
+
+        # Get the opinions for the specified season
+        sql = f"""SELECT * FROM {season} WHERE species_code = '{species}';"""
+        df = (pd.read_sql(sql, connection)
+              [lambda x: x["year"].isin(years) == True])
+        
+        # Cleanup
+        df = cleanup_opinions(df)
+
+        # Add season column
+        df["season"] = season
+
+        return df
+    
+    def cleanup_opinions(df):
+        """Local function that handles duplicates, outdated, and negated
+        opinions for presence or a season individually.  Assesses and judges
+        conflicting opinions within a season or presence."""
+
+        # --------------------------------------------------------- Drop duplicates
+        """Records that are identical to another record should be dropped"""
+        df2 = df.drop_duplicates()
+
+        # ------------------------------------- Drop older entries from each expert
+        """If an expert entered records for the same unit at different times,
+        keep the more recent record and drop the other"""
+        # Set columns to group on
+        df3 = (df2.sort_values(by="entry_time", ascending=False)
+              .groupby(['strHUC12RNG', 'year', 'species_code', 'expert'])
+              .first()
+              .reset_index()
+              )
+        
+        # --------------------------------------------------- Drop negated opinions
+        """If experts with equal rank and confidence have opposing opinions, drop all
+        records in order to leave them out of range compilation.
+        """
+        # Add a column for marking records to omit
+        df3["omit"] = 0.0
+
+        # Find value combinations of records that need to be dropped/omitted.
+        negated = (df3
+                .groupby(['strHUC12RNG', 'year', 'expert_rank', 'confidence'])
+                .count()
+                [lambda x: x["status"] > 1]
+                .reset_index()
+                )
+
+        # Mark records to omit
+        for i in negated.index:
+            s_unit = negated.loc[i, "strHUC12RNG"]
+            year = negated.loc[i, "year"]
+            rank = negated.loc[i, "expert_rank"]
+            confidence = negated.loc[i, "confidence"]
+
+            df7 = (df3[(df3["strHUC12RNG"] == s_unit) & (df3["year"] == year) &
+                    (df3["expert_rank"] == rank) & (df3["confidence"] == confidence)]
+                   .copy())
+            df7["omit"] = 1.0
+            df3.update(df7)
+
+        # Omit
+        df3 = df3[df3["omit"] == 0.0]
+
+        # ------------------------------------ Drop lower expert rank or confidence
+        """Multiple experts submit opinions, keep the one with the highest rank
+        and drop the others.  If rank is tied, keep higher confidence.
+        """
+        df5 = (df3
+                .drop(["omit"], axis=1)
+                .sort_values(by=["expert_rank", "confidence"], ascending=False)
+                .groupby(['strHUC12RNG', 'year', 'species_code'])
+                .first()
+                .reset_index()
+                )
+        return df5
+
+    def adjust_opinions(seasons, task_db):
+        """
+        Adjust the opinion values for presence and range based on assessment across
+        presence and range.  Range could be summer, winter, or year_round.
+
+        The evaluations follow the logic that season-present implies presence-present 
+        and presence-absent implies season-absent, but season-absent does not imply
+        presence-absent. Futhermore, year-round present implies present during
+        summer and winter, but summer or winter present does not imply year-round
+        present.
+
+        Before this code is run, the opinions table has presence and range opinion
+        records concatenated vertically and includes records from any season.
+        This code adds new columns with adjusted opinions and weights to
+        address 4 cases: 
+        1) range is "present" but presence is either "absent" or "present" -> ranks are
+            assessed to pick a winner.
+        2) presence is "absent" and range is NULL -> season becomes "absent"
+        3) presence is NULL and range is "present" -> presence becomes "present"
+        4) presence is "absent" and range is "absent" -> range absent weight 
+            is set to presence absent weight if present absent weight is higher.
+
+        The general steps are to read in the opinions table and expand it as
+        necessary by creating dataframes that can be inferred and then
+        concatenating them.  For example, range-present records for spatial 
+        unit-years without presence records.  Second, we find and assess 
+        combintations of spatial unit-year that meet each of the 4 cases listed
+        above, then update the opinions table with those assessments.  Some 
+        spatial unit-year combinations do not need adjustment, so those are 
+        assigned based on existing values for those records.
+
+        Because the range adjustments are based upon presence, presence must
+        be adjusted first.  During that process, presence records are created
+        for hucs that have range records but no presence records, if the range
+        record is "present".
+        """
+        import sqlite3
+        import pandas as pd
+        from datetime import datetime
+        timestamp = datetime.now()
+
+        # Read in the opinion table
+        connection = sqlite3.connect(task_db, timeout=600)
+        df = pd.read_sql("SELECT * FROM opinions;", con=connection)
+
+        # Convert seasons
+        season_dict = {"Y": "year_round", "S": "summer", "W": "winter",
+                   "P": "presence", "presence": "presence"}
+        seasons = [season_dict[x] for x in seasons]
+        try:
+            seasons.remove("presence")
+        except:
+            pass
+
+        # EXPAND --------------------------------------------------------------
+        try:
+            # Create empty objects as placeholders for concat below
+            range_to_presence = None
+            y_r_to_summer = None
+            y_r_to_winter = None
+
+            # Adjust presence first by adding records for hucs that have range 
+            # records but no presence records, if the range record is 
+            # "present".  
+            #Dataframe of range-present records
+            present = df[df["status"] == 'present'].copy()
+
+            # Dataframe of presence records (present or absent)
+            presence = df[df["season"] == 'presence'].copy()
+
+            # Select records from range-present that are not in presence
+            range_to_presence = (present[~present["strHUC12RNG"]
+                                        .isin(presence["strHUC12RNG"])]
+                                        .copy())
+            
+            # Change the season of the range-present records to presence
+            range_to_presence["season"] = "presence"
+
+            # Create a dataframe of year-round records for both summer and winter
+            # Dataframe of year-round records (present or absent)
+            year_round = df[df["season"] == 'year_round'].copy()
+
+            # year-round to summer
+            y_r_to_summer = year_round.copy()
+            y_r_to_summer["season"] = "summer"
+
+            # year-round to winter
+            y_r_to_winter = year_round.copy()
+            y_r_to_winter["season"] = "winter"
+
+            # Add the new records to the dataframe
+            df = pd.concat([df, range_to_presence, y_r_to_summer, 
+                            y_r_to_winter])  
+        except Exception as e:    
+            print(e)
+
+        # ADJUST --------------------------------------------------------------
+        # Columns for adjusted values will be filled out, go ahead and add them
+        df["status_adjusted"] = pd.NA
+        df["weight_adjusted"] = pd.NA
+
+        adjusted = True
+        for season in seasons:
+            try:
+                # Make new dataframes of all presence records and all range 
+                # records
+                presence = df[df["season"] == 'presence'].copy()
+                range1 = df[df["season"] == season].copy()
+
+                # 1) PRESENCE & RANGE MAY DISAGREE ----------------------------
+                # Handle this by updating adjusted status and weight in df 
+                #     where appropriate.
+                # Dataframe of range-present records
+                range_present = range1[range1["status"] == 'present'].copy()
+
+                # Concatenate the dataframes to be able to compare weights of records
+                concated1 = pd.concat([range_present, presence.copy()])
+
+                # Find winning records (highest weight) among range-present, presence
+                #   records
+                winners = (concated1.sort_values(by=["weight"],
+                                                 ascending=False)
+                           .groupby(['strHUC12RNG', 'year'])
+                           .first()
+                           .reset_index()
+                           .filter(['strHUC12RNG', 'year', 'status', 'weight'])
+                           .fillna(pd.NA)
+                           )
+
+                # Prep column names for join back with first concatenated data frame
+                #   which doesn't include range absent records.
+                winners["status_adjusted"] = winners["status"]
+                winners["weight_adjusted"] = winners["weight"]
+
+                # Drop columns that are not needed
+                winners = winners.drop(['weight', 'status'], axis=1)
+                concated1 = concated1.drop(['status_adjusted', 'weight_adjusted'], 
+                                           axis=1)
+
+                # Update concated1 with adjusted values from winners
+                concated1 = (pd.merge(left=concated1, right=winners,
+                                        on=["strHUC12RNG", "year"],
+                                        how="left")
+                               .filter(['strHUC12RNG', 'year', 'season',
+                                      'status_adjusted', 'weight_adjusted'], 
+                                     axis=1))
+
+                # Get data from concated1 into df.  Some records will be new
+                # to df and others will need to update the adjusted columns.
+                df = (pd.merge(left=df, right=concated1,
+                               on=["strHUC12RNG", "year", "season"],
+                               how="outer", suffixes=(None, "_y")))
+
+                # Set status_adjusted and weight_adjusted to status_adjusted_y and
+                # weight_adjusted_y where status_adjusted_y is not null
+                df["status_adjusted"] = df["status_adjusted_y"].where(
+                    df["status_adjusted_y"].notnull(), df["status_adjusted"])
+                df["weight_adjusted"] = df["weight_adjusted_y"].where(
+                    df["weight_adjusted_y"].notnull(), df["weight_adjusted"])
+                
+                # Drop columns that are not needed
+                df = df.drop(['status_adjusted_y', 'weight_adjusted_y'], 
+                             axis=1)
+
+                # 2) PRESENCE IS ABSENT & NO RANGE RECORD ---------------------
+                # Records with presence-absent
+                PA = presence[presence["status"] == 'absent'].copy()
+
+                # Presence-absent records without a spatial_unit-year range 
+                # record (i.e., no range)
+                RNull = (pd.merge(left=PA, right=range1, suffixes=(None, "_y"),
+                                  on=["strHUC12RNG", "year"], how="left")
+                         .fillna(pd.NA)
+                         [lambda x: x["status_y"].isna() == True]
+                         .filter(PA.columns, axis=1)
+                         )
+
+                # Recode to be records for the range(season)
+                RNull["season"] = season
+                RNull["status_adjusted"] = RNull["status"]
+                RNull["weight_adjusted"] = RNull["weight"]
+                RNull["status"] = pd.NA
+                RNull["weight"] = pd.NA
+
+                # Add the values in the main dataframe.
+                df = pd.concat([df, RNull])
+
+                # 3) RANGE IS PRESENT & NO PRESENCE RECORD --------------------
+                # Records with range-present
+                RP = range1[range1["status"] == 'present'].copy()
+
+                # range-present records without a spatial_unit-year presence 
+                # record (i.e., no presence)
+                PNull = (pd.merge(left=RP, right=presence, 
+                                  suffixes=(None, "_y"),
+                                  on=["strHUC12RNG", "year"], how="left")
+                         .fillna(pd.NA)
+                         [lambda x: x["status_y"].isna() == True]
+                         .filter(RP.columns, axis=1)
+                         )
+                
+                # Recode to be records for presence
+                PNull["season"] = 'presence'
+                PNull["status_adjusted"] = PNull["status"]
+                PNull["weight_adjusted"] = PNull["weight"]
+                PNull["status"] = pd.NA
+                PNull["weight"] = pd.NA
+
+                # Add the values in the main dataframe.
+                df = pd.concat([df, PNull])
+                
+                # 4) RANGE IS ABSENT & PRESENCE IS ABSENT ---------------------
+                # The weight of range-absent records does not imply anything 
+                # about the weight of presence-absent status.  However, for
+                # spatio-temporal units with "absent" for the range and presence
+                # we want to adjust the weight to the higher weight of the two.
+
+                # Records with range-absent
+                range_absent = range1[range1["status"] == 'absent'].copy()
+
+                # Records with presence-absent
+                presence_absent = presence[presence["status"] == 'absent'].copy()
+
+                # Concatenate the dataframes to be able to compare weights of records
+                concated = pd.concat([range_absent, presence_absent])
+
+                # Find winning records (highest weight) among range-absent, 
+                # presence-absent records
+                winners = (concated.sort_values(by=["weight"], ascending=False)
+                            .groupby(['strHUC12RNG', 'year'])
+                            .first()
+                            .reset_index()
+                            .filter(['strHUC12RNG', 'year', 'status', 'weight'])
+                            .fillna(pd.NA)
+                            )
+                
+                # Prep column names for join back with concated so that 
+                # status_adjusted and weight_adjusted can be updated.
+                winners["status_adjusted"] = winners["status"]
+                winners["weight_adjusted"] = winners["weight"]
+                winners["season"] = season
+
+                # Drop columns that are not needed
+                winners = winners.drop(['weight', 'status'], axis=1)
+                concated = concated.drop(['status_adjusted', 'weight_adjusted'],
+                                            axis=1)
+                
+                # Update concated with adjusted weight and status from winners.
+                concated = (pd.merge(left=concated, right=winners,
+                                        on=["strHUC12RNG", "year", "season"],
+                                        how="left")
+                             .filter(['strHUC12RNG', 'year', 'season', 
+                                      'status_adjusted', 'weight_adjusted'], 
+                                     axis=1))
+
+                # Get data from concated into df.  No new records will be added.
+                # Only the adjusted columns will be updated.
+                df = (pd.merge(left=df, right=concated,
+                               on=["strHUC12RNG", "year", "season"],
+                               how="outer", suffixes=(None, "_y")))
+
+                # Set status_adjusted and weight_adjusted to status_adjusted_y and
+                # weight_adjusted_y where status_adjusted_y is not null
+                df["status_adjusted"] = df["status_adjusted_y"].where(
+                    df["status_adjusted_y"].notnull(), df["status_adjusted"])
+                df["weight_adjusted"] = df["weight_adjusted_y"].where(
+                    df["weight_adjusted_y"].notnull(), df["weight_adjusted"])
+                
+                # Drop columns that are not needed
+                df = df.drop(['status_adjusted_y', 'weight_adjusted_y'],
+                                axis=1)
+                
+                # WHERE NO ADJUSTMENT IS WARRANTED ----------------------------
+                # Fill out the adjusted columns with the original values, where
+                # the adjusted columns are null.
+                df["status_adjusted"] = df["status_adjusted"].fillna(df["status"])
+                df["weight_adjusted"] = df["weight_adjusted"].fillna(df["weight"])
+
+                # WRITE RESULTS -----------------------------------------------
+                df.to_sql(name="opinions", con=connection, if_exists="replace")
+                connection.commit()
+                print(f"Adjusted {season} opinions: {str(datetime.now() - timestamp)}")
+            except Exception as e:
+                print("!!! Failed to adjust opinions - {0}".format(season))
+                print(e)
+                adjusted = False
+        return adjusted
+
+        #else:
+            #print("Presence was not included in seasons - opinions were not adjusted.")
+
+    # ------------------------------------------------------- Retrieve the data
+    # Convert years and months value to integer for an SQL statement.
+    years = tuple([int(x) for x in years])
+
+    # Create placeholder variables for concat logic below
+    dfP2 = None
+    dfS2 = None
+    dfW2 = None
+    dfY2 = None
+    
+    # Retrieve the opinions for the specified species and years
+    try:
+        dfP2 = get_opinions("presence", species, years)
+        dfS2 = get_opinions("summer", species, years)
+        dfW2 = get_opinions("winter", species, years)
+        dfY2 = get_opinions("year_round", species, years)
+
+        # Concatenate season and presence opinion tables
+        df5 = pd.concat([x for x in [dfP2, dfS2, dfW2, dfY2] if x is not None])
+
+    except Exception as e:
+        print(e)
+        return False
+
+    # Write to opinions table
+    try:
+        connection = sqlite3.connect(task_db, timeout=600)
+        cursor = connection.cursor()
+        df5.to_sql("tmp_opinions", connection, if_exists='replace')
+
+        sql = """
+        /* Put opinions into a table with a primary key */
+        BEGIN TRANSACTION;
+
+        CREATE TABLE opinions (strHUC12RNG TEXT NOT NULL,
+                               year INTEGER NOT NULL,
+                               species_code TEXT,
+                               expert TEXT,
+                               status TEXT,
+                               expert_rank INTEGER,
+                               confidence INTEGER,
+                               justification TEXT,
+                               entry_time TEXT,
+                               season TEXT,
+                               type TEXT,
+                               PRIMARY KEY (strHUC12RNG, year, season)
+                               );
+
+        INSERT INTO opinions
+        SELECT strHUC12RNG, year, species_code, expert, status, expert_rank,
+            confidence, justification, entry_time, season, type
+        FROM tmp_opinions;
+
+        DROP TABLE tmp_opinions;
+
+        CREATE INDEX idx_opinions ON opinions (strHUC12RNG, year, season);
+
+        COMMIT TRANSACTION;
+
+        PRAGMA foreign_keys=on;
+        """
+        cursor.executescript(sql)
+        connection.commit()
+    except Exception as e:
+        print(e)
+        return False
+
+    # Add a weight column
+    try:
+        connection = sqlite3.connect(task_db, timeout=600)
+        cursor = connection.cursor()
+        sql = """
+        /* Add weight column */
+        ALTER TABLE opinions ADD COLUMN weight REAL;
+
+        UPDATE opinions
+        SET weight = expert_rank * confidence/10.0;
+        """
+        cursor.executescript(sql)
+        connection.commit()
+    except Exception as e:
+        print(e)
+        return False
+
+    # Adjust status and weights 
+    try:
+        return adjust_opinions(seasons, task_db)
+    except Exception as e:
+        print(e)
+        return False
+
+def make_references_table(species, task_db, ww_output, use_observations,
+                          use_opinions):
+    """
+    Makes a reference table with references from opinions/GAP and occurrence
+    records databases.
+    
+    PARAMETERS
+    ----------
+    species : GAP species code
+    task_db : path to the range database
+    ww_output : tuple of paths to the occurrence record databases
+    use_observations : boolean indicating whether occurrence records are used
+    use_opinions : boolean indicating whether expert opinions are used
+
+    RETURNS
+    -------
+    complete : boolean, False if any references couldn't be added
+    """
+    # Create a table for references in task_db with columns GAP_code and 
+    #   reference_text.
+    import sqlite3
+    import pandas as pd
+    import datetime
+
+    time0 = datetime.datetime.now()
+    complete = True
+
+    # Connect to the task database
+    connection_task = sqlite3.connect(task_db, timeout=600)
+
+    # ----------------------------------------------- Add literature references
+    if use_opinions:
+        try:
+            # Connect to the opinions database
+            connection = sqlite3.connect(opinion_db)
+
+            # Build a set of reference codes from all opinion tables
+            reference_codes = []
+            for season in ['presence', 'summer', 'winter', 'year_round']:
+                sql = f"""
+                SELECT citations FROM {season} WHERE species_code = '{species}';
+                """
+                df = pd.read_sql(sql, con=connection)
+
+                # Prep citation code list for an SQL statement
+                citation_list = df['citations'].unique()
+                if len(citation_list) > 0:
+                    for x in citation_list:
+                        y = x.split(',')
+                        for z in y:
+                            reference_codes.append(z.strip())
+            connection.close()
+            
+            # From the GAP database, get the reference text for the reference codes
+            from gapproduction import database
+            GAPcursor, GAPconnection = database.ConnectDB('GapVert_48_2016')
+
+            # Build a string of reference codes for the SQL statement, each item
+            # needs to be a string and the whole thing needs to be in parentheses
+            if len(reference_codes) > 1:
+                reference_codes = str(tuple(reference_codes))
+            else:
+                reference_codes = str(tuple(reference_codes)).replace(",", "")
+            sql = f"""
+            SELECT strRefCode, memCitation FROM dbo.tblCitations
+            WHERE strRefCode IN {reference_codes}; 
+            """
+
+            df = pd.read_sql(sql, con=GAPconnection)
+            df.rename(columns={'strRefCode': 'GAP_code', 
+                            'memCitation': 'reference_text'}, inplace=True)
+            GAPconnection.close()
+            
+            # Write the references df to the references table.
+            df.to_sql("references", connection_task, if_exists='append',
+                      index=False)
+
+        except Exception as e:
+            print("Failed to add opinion references.")
+            print(e)
+            complete = False
+    
+    # ------------------------------------------------ Add observation datasets
+    if use_observations:
+        try:
+            for db in ww_output:
+                # Connect to an occurrence records database
+                connection_ww = sqlite3.connect(db)
+
+                # Get string of citation string from GBIF_download_info table
+                sql = """
+                SELECT citations FROM GBIF_download_info;
+                """
+                cursor = connection_ww.cursor()
+                cursor.execute(sql)
+                citation_string = cursor.fetchone()[0]
+                connection_ww.close()
+
+                # Parse out the individual citations. Citations start after "rights.txt:" and are each on a separate line.
+                citations = citation_string.split("rights.txt:")[1].split("\n")
+                citations = [x.strip() for x in citations if x]
+
+                # Make a dataframe of the citations with GAP_code and reference_text columns, GAP_code will be the db name for each record.
+                df = pd.DataFrame(citations, columns=['reference_text'])
+                df['GAP_code'] = db.split("/")[-1].replace(".sqlite", "")
+                
+                # Write the references df to the references table.
+                df.to_sql("references", connection_task, if_exists='append',
+                           index=False)
+
+        except Exception as e:
+            print("Failed to add observation references.")
+            print(e)
+            complete = False
+
+    connection_task.close()
+    print("Created references table: " + str(datetime.datetime.now() - time0))
+    return complete
+
+#  -------------------------------------------------- Insert occurrence records
+def records_table(table, cursor):
+    '''
+    Creates a table for occurrence records with the columns that
+    wrangler_records() gets.  Doesn't commit.
+
+    PARAMETERS
+    ----------
+    table : name of the table, e.g. "occurrence_records" or "temp.incoming_records"
+    cursor : cursor of the task database
+    '''
+    cursor.execute("""CREATE TABLE {0} (taxon_id TEXT,
+                                        record_id TEXT PRIMARY KEY,
+                                        eventDate TEXT,
+                                        weight INTEGER,
+                                        weight_notes TEXT,
+                                        source_db TEXT,
+                                        footprint_area REAL,
+                                        x REAL,
+                                        y REAL,
+                                        radius REAL,
+                                        geometry POLYGON);""".format(table))
+
+def insert_records(years, months, task_db, ww_output, wrangler_path,
+                   chunk_size=50000):
+    '''
+    Loads the occurrence records from the wildlife wrangler databases into
+    the range db.  Records from the first database take precedence if
+    duplicates arise.  Also, filters out records from unwanted years and
+    months.
+
+    Records are inserted in chunks, each in its own short transaction, so
+    that stages writing to the task database at the same time (e.g.,
+    insert_opinions() and make_references_table()) aren't locked out for the
+    whole load.  If loading fails, the partly loaded table is dropped.
+
+    PARAMETERS
+    ----------
+    years : tuple of years to keep
+    months : tuple of months to keep
+    task_db : path to the task database
+    ww_output : tuple of paths to the occurrence record databases, in order
+        of precedence
+    wrangler_path : path to the directory with wrangler_functions
+    chunk_size : number of records to insert in each transaction
+
+    RETURNS
+    -------
+    loaded : boolean, False if the records weren't loaded
+    '''
+    from datetime import datetime
+
+    # Get the records before taking the write lock on the task database
+    try:
+        records = [wrangler_records(db, wrangler_path) for db in ww_output]
+    except Exception as e:
+        print("!! FAILED to get occurrence records")
+        print(e)
+        return False
+
+    cursor, conn = spatialite(task_db)
+    try:
+        timestamp = datetime.now()
+        records_table("occurrence_records", cursor)
+        conn.commit()
+        for rows in records:
+            for start in range(0, len(rows), chunk_size):
+                cursor.execute("BEGIN;")
+                cursor.executemany("""INSERT OR IGNORE INTO occurrence_records
+                                      VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?,
+                                              GeomFromWKB(?, 5070));""",
+                                   rows[start:start + chunk_size])
+                conn.commit()
+
+        # Drop records with unwanted years and months
+        years = tuple([int(x) for x in years])
+        months = tuple([int(x) for x in months])
+        cursor.execute("BEGIN;")
+        cursor.execute("""DELETE FROM occurrence_records
+                          WHERE CAST(STRFTIME('%Y', eventDate) AS INTEGER) NOT IN {0}
+                          OR CAST(STRFTIME('%m', eventDate) AS INTEGER) NOT IN {1};
+                       """.format(years, months))
+
+        # Index and register the geometry column
+        cursor.execute("CREATE INDEX idx_eo_date ON occurrence_records (eventDate);")
+        cursor.execute("""SELECT RecoverGeometryColumn('occurrence_records', 'geometry',
+                          5070, 'POLYGON', 'XY');""")
+        conn.commit()
+        print("Loaded the occurrence records: ", str(datetime.now() - timestamp))
+    except Exception as e:
+        conn.rollback()
+        print("!! FAILED to load the occurrence records")
+        print(e)
+        try:
+            cursor.execute("DROP TABLE IF EXISTS occurrence_records;")
+            conn.commit()
+        except Exception as e:
+            print(e)
+        conn.close()
+        return False
+
+    # Close db
+    conn.close()
+    return True
+
+#  ---------------------------------------------- Insert new occurrence records
+def insert_new_records(years, months, task_db, ww_output, wrangler_path):
+    '''
+    Adds occurrence records whose record_id isn't in the task database yet
+    from the wildlife wrangler databases, filtering out records from
+    unwanted years and months as insert_records() does.  The IDs of the
+    added records are kept in a new_records table.
+
+    Task databases that were made from shapefiles are brought up to date
+    first: weight_not is renamed weight_notes and the footprint_area, x, y,
+    and radius columns are added and described as wrangler_records() does.
+
+    PARAMETERS
+    ----------
+    years : tuple of years to keep
+    months : tuple of months to keep
+    task_db : path to the task database
+    ww_output : tuple of paths to the occurrence record databases, in order
+        of precedence
+    wrangler_path : path to the directory with wrangler_functions
+
+    RETURNS
+    -------
+    n_new : number of records added
+    '''
+    from datetime import datetime
+    timestamp = datetime.now()
+
+    # Get the records before taking the write lock on the task database
+    records = [wrangler_records(db, wrangler_path) for db in ww_output]
+
+    cursor, conn = spatialite(task_db)
+    years = tuple([int(x) for x in years])
+    months = tuple([int(x) for x in months])
+    try:
+        cursor.execute("BEGIN;")
+
+        # Task databases made from shapefiles have a truncated column name
+        # and no description of the footprints
+        columns = [x[1] for x in cursor.execute("PRAGMA table_info(occurrence_records);")]
+        if "weight_not" in columns:
+            cursor.execute("""ALTER TABLE occurrence_records
+                              RENAME COLUMN weight_not TO weight_notes;""")
+        missing = [x for x in ("footprint_area", "x", "y", "radius")
+                   if x not in columns]
+        if missing:
+            for column in missing:
+                cursor.execute("""ALTER TABLE occurrence_records
+                                  ADD COLUMN {0} REAL;""".format(column))
+            cursor.execute("""
+                UPDATE occurrence_records
+                SET footprint_area = ST_Area(geometry),
+                    x = X(ST_Centroid(geometry)),
+                    y = Y(ST_Centroid(geometry)),
+                    radius = (MbrMaxX(geometry) - MbrMinX(geometry)) / 2;""")
+            cursor.execute("""
+                UPDATE occurrence_records SET radius = NULL
+                WHERE ABS((MbrMaxY(geometry) - MbrMinY(geometry)) / 2 - radius) > 0.01 * radius
+                OR footprint_area < 0.98 * 3.141592653589793 * radius * radius
+                OR footprint_area > 1.02 * 3.141592653589793 * radius * radius;""")
+            print("Described the footprints of {0} occurrence records".format(
+                cursor.execute("SELECT COUNT(*) FROM occurrence_records;").fetchone()[0]))
+
+        cursor.execute("DROP TABLE IF EXISTS new_records;")
+        cursor.execute("CREATE TABLE new_records (record_id TEXT PRIMARY KEY);")
+        records_table("temp.incoming_records", cursor)
+        for rows in records:
+            cursor.executemany("""INSERT OR IGNORE INTO incoming_records
+                                  VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?,
+                                          GeomFromWKB(?, 5070));""", rows)
+        cursor.execute("""
+            INSERT INTO new_records
+                SELECT record_id FROM incoming_records
+                WHERE record_id NOT IN (SELECT record_id FROM occurrence_records)
+                AND CAST(STRFTIME('%Y', eventDate) AS INTEGER) IN {0}
+                AND CAST(STRFTIME('%m', eventDate) AS INTEGER) IN {1};
+            """.format(years, months))
+        cursor.execute("""
+            INSERT INTO occurrence_records (taxon_id, record_id, eventDate,
+                                            weight, weight_notes, source_db,
+                                            footprint_area, x, y, radius,
+                                            geometry)
+                SELECT * FROM incoming_records
+                WHERE record_id IN (SELECT record_id FROM new_records);
+            """)
+        cursor.execute("DROP TABLE temp.incoming_records;")
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        print("!! FAILED to insert new occurrence records")
+        print(e)
+        conn.close()
+        return 0
+
+    n_new = cursor.execute("SELECT COUNT(*) FROM new_records;").fetchone()[0]
+    print("Inserted {0} new occurrence records: ".format(n_new) + str(datetime.now() - timestamp))
+    conn.close()
+    return n_new
+
+#  ---------------------------------------- Reject footprints that are too big
+def reject_large_footprints(task_id, gap_id, task_db, parameters_db, grid_db,
+                            cache_db):
+    """
+    Tags occurrence records whose footprint is too large to ever be attributed
+    to a subregion so that they are left out of spatial joins.  A record can
+    only be attributed if at least 100 - error_tolerance percent of its
+    footprint falls in one subregion, so footprints larger than the largest
+    subregion's area / (1 - error_tolerance/100) never qualify.  Subregion
+    areas are computed once and kept in the overlap cache database.
+
+    PARAMETERS
+    ----------
+    task_id : string
+        The task ID from the parameters database
+    gap_id : string
+        The GAP code of the species
+    task_db : string
+        Path to the task database
+    parameters_db : string
+        Path to the parameters database
+    grid_db : string
+        Path to the grid sqlite database
+    cache_db : string
+        Path to the overlap cache database, created if it doesn't exist
+
+    RETURNS
+    -------
+    tagged : boolean, False if tagging failed
+
+    OUTPUT
+    ------
+    too_large : column in occurrence_records that is 1 for rejected records
+    """
+    from datetime import datetime
+    time1 = datetime.now()
+
+    cursor, conn = spatialite(task_db)
+
+    # Add the column first, so that records can still be selected with it
+    # if the areas can't be computed.  The column is already there when
+    # records are added to a task database (see add_new_records()).
+    try:
+        columns = [x[1] for x in cursor.execute("PRAGMA table_info(occurrence_records);")]
+        if "too_large" not in columns:
+            cursor.execute("ALTER TABLE occurrence_records ADD COLUMN too_large INT;")
+            conn.commit()
+    except Exception as e:
+        print("!!! FAILED to add the too_large column")
+        print(e)
+        conn.close()
+        return False
+
+    try:
+        cursor.executescript("""ATTACH DATABASE '{0}' AS params;
+                                ATTACH DATABASE '{1}' AS shucs;
+                                ATTACH DATABASE '{2}' AS cache;
+
+                                CREATE TABLE IF NOT EXISTS cache.huc_areas (
+                                                HUC12RNG TEXT PRIMARY KEY,
+                                                area REAL);
+                             """.format(parameters_db, grid_db, cache_db))
+
+        # Compute subregion areas if this is the first time the grid is used.
+        # Other compilations sharing the cache may be computing them too.
+        if cursor.execute("SELECT COUNT(*) FROM cache.huc_areas;").fetchone()[0] == 0:
+            cursor.execute("""INSERT OR IGNORE INTO cache.huc_areas
+                              SELECT HUC12RNG, ST_Area(geom_5070)
+                              FROM shucs.huc12rng_gap_polygon;""")
+            conn.commit()
+            print("Calculated subregion areas: " + str(datetime.now() - time1))
+
+        max_area = cursor.execute("SELECT MAX(area) FROM cache.huc_areas;").fetchone()[0]
+        error_tolerance = get_error_tolerance(task_id, gap_id, cursor)
+
+        # Nothing can be rejected if any overlap is enough
+        if error_tolerance < 100:
+            area_limit = max_area / (1 - error_tolerance/100)
+            cursor.execute("""UPDATE occurrence_records SET too_large = 1
+                              WHERE footprint_area > ?;""", (area_limit,))
+        conn.commit()
+
+        # Report rejections for each wrangler database
+        counts = cursor.execute("""SELECT source_db, COUNT(*), SUM(too_large)
+                                   FROM occurrence_records
+                                   GROUP BY source_db;""").fetchall()
+        for source, total, rejected in counts:
+            print("Rejected {0} of {1} records from {2} with footprints too large to attribute".format(rejected or 0, total, source))
+        print("Tagged footprints that are too large: " + str(datetime.now() - time1))
+    except Exception as e:
+        print("!!! FAILED to tag footprints that are too large")
+        print(e)
+        conn.close()
+        return False
+
+    conn.close()
+    return True
+
+#  ------------------------------------------ Conditions for selecting records
+def record_conditions(start_year, end_year, era, season):
+    """
+    Builds the SQL conditions that select records for an era and a season.
+    The first is appended to "WHERE eventDate" and the second to that, so
+    the table queried needs eventDate and month columns.
+
+    PARAMETERS
+    ----------
+    start_year : integer
+    end_year : integer
+    era : string
+        'recent' or 'historical'
+    season : string like "summer", "winter" or "year_round"
+
+    RETURNS
+    -------
+    condition : era condition on eventDate
+    condition2 : season condition on month, or an empty string
+    """
+    # Build an era condition
+    if era == 'recent':
+        condition = '> ' + str(start_year) + " AND eventDate < " + str(int(end_year) + 1)
+    else:
+        condition = '< ' + str(start_year)
+    
+    # Build a season condition                                                 # Develop spatial-unit specific season dates somehere around here.
+    condition2 = ''
+    if season == "summer":
+        condition2 = "AND month in ('05', '06', '07')"
+    if season == "winter":
+        condition2 = "AND month in ('12', '01', '02')"        
+
+    return condition, condition2
+
+# -------------------------------------------------- Intersect records and grid
+def intersect(era, end_year, conn, cursor, materialize=False):
+    """
+    Intersects occurrence records and the grid and computes the percent of
+    each record's footprint that falls within each subregion it intersects.
+    Footprint areas come from the footprint_area column that insert_records()
+    adds, so they are not recomputed for every subregion.
+
+    PARAMETERS
+    ----------
+    era : string
+        'recent' or 'historical'
+    end_year: integer
+        used for print statement only
+    materialize : boolean
+        If True, the intersection fragments are also kept in a geom_5070
+        column of intersected_[era].  Only the proportions are needed, so by
+        default the fragments are not stored.
+    """
+    from datetime import datetime
+    time1 = datetime.now()
+
+    geom_column = ""
+    if materialize:
+        geom_column = ",\n                                  geom_5070"
+
+    sql="""
+    CREATE TABLE intersected_{0} (HUC12RNG TEXT,
+                                  record_id TEXT,
+                                  eventDate TEXT,
+                                  weight TEXT,
+                                  proportion_circle REAL{1});
+        """.format(era, geom_column)
+    try:
+        cursor.executescript(sql)
+        conn.commit()
+    except Exception as e:
+        print("!! FAILED to create intersected_{0}-{1} table: ".format(era, end_year) + str(datetime.now()-time1))
+        print(e)
+
+    if materialize:
+        sql="""
+        INSERT INTO intersected_{0} SELECT HUC12RNG, record_id, eventDate, weight,
+                                           100 * (ST_Area(geom_5070) / footprint_area)
+                                               AS proportion_circle,
+                                           geom_5070
+                                    FROM (SELECT hp.HUC12RNG AS HUC12RNG,
+                                          eo.record_id AS record_id,
+                                          eo.eventDate AS eventDate,
+                                          eo.weight AS weight,
+                                          eo.footprint_area AS footprint_area,
+                                          CastToMultiPolygon(Intersection(hp.geom_5070,
+                                                             eo.geometry)) AS geom_5070
+                                    FROM huc12rng_gap_polygon as hp, {0}_records AS eo
+                                    WHERE ST_Intersects(hp.geom_5070, eo.geometry) = 1
+                                    AND hp.ROWID IN (
+                                           SELECT ROWID
+                                           FROM SpatialIndex
+                                           WHERE f_table_name = 'DB=shucs.huc12rng_gap_polygon'
+                                           AND f_geometry_column = 'geom_5070'
+                                           AND search_frame = eo.geometry
+                                                     ));
+            """.format(era)
+    else:
+        sql="""
+        INSERT INTO intersected_{0} SELECT hp.HUC12RNG AS HUC12RNG,
+                                       eo.record_id AS record_id,
+                                       eo.eventDate AS eventDate,
+                                       eo.weight AS weight,
+                                       100 * (ST_Area(Intersection(hp.geom_5070,
+                                                                   eo.geometry))
+                                              / eo.footprint_area)
+                                           AS proportion_circle
+                                    FROM huc12rng_gap_polygon as hp, {0}_records AS eo
+                                    WHERE ST_Intersects(hp.geom_5070, eo.geometry) = 1
+                                    AND hp.ROWID IN (
+                                           SELECT ROWID
+                                           FROM SpatialIndex
+                                           WHERE f_table_name = 'DB=shucs.huc12rng_gap_polygon'
+                                           AND f_geometry_column = 'geom_5070'
+                                           AND search_frame = eo.geometry
+                                                     );
+            """.format(era)
+    try:
+        cursor.executescript(sql)
+        conn.commit()
+        print("Found and inserted subregions that intersect a {0}-{1} occurrence: ".format(end_year, era) + str(datetime.now()-time1))
+    except Exception as e:
+        print("!! FAILED to find hucs that intersect a {0}-{1} occurrence: ".format(end_year, era) + str(datetime.now()-time1))
+        print(e)
+
+    sql="""
+    CREATE INDEX idx_intersect_{0}s ON intersected_{0} (HUC12RNG, record_id, eventDate, weight);
+    """.format(era)
+    if materialize:
+        sql = """
+        /* Choice of 'MULTIPOLYGON' here is important. */
+        SELECT RecoverGeometryColumn('intersected_{0}', 'geom_5070', 5070,
+                                     'MULTIPOLYGON', 'XY');
+        """.format(era) + sql
+    try:
+        cursor.executescript(sql)
+        conn.commit()
+        print("Created index for {0}-{1} subregion intersections: ".format(end_year, era) + str(datetime.now()-time1))
+    except Exception as e:
+        print("!! FAILED to create geometry and/or index for {0}-{1}: ".format(end_year, era) + str(datetime.now()-time1))
+        print(e)
+
+# ----------------------------- Intersect records and grid in parallel chunks
+def batch_size(era, cursor, max_memory_mb):
+    """
+    Estimates how many records of [era]_records can be intersected at once
+    within a memory ceiling.  Footprints are held as WKB, as geometries, and
+    as intersection fragments, so each record is assumed to need four times
+    the mean size of its footprint's WKB, plus 1 KB.
+
+    PARAMETERS
+    ----------
+    era : string
+        Name of the records table to use, e.g. 'stale'
+    cursor : cursor of a connection with the task database attached as eval
+    max_memory_mb : number
+        Memory ceiling, in megabytes
+
+    RETURNS
+    -------
+    n : integer
+        Number of records per batch
+    """
+    wkb_bytes = cursor.execute("""SELECT AVG(LENGTH(geometry))
+                                  FROM eval.occurrence_records
+                                  WHERE record_id IN (SELECT record_id
+                                                      FROM {0}_records);
+                               """.format(era)).fetchone()[0] or 0
+    return max(1, int(max_memory_mb * 2**20 / (4 * wkb_bytes + 1024)))
+
+def _intersect_chunk(args):
+    """
+    Intersects one chunk of records with the grid in a new in-memory database
+    with intersect().  The chunk's record_ids are read from the ordered table
+    that intersect_parallel() made in its database and footprints are read
+    from the task database, so only a range of positions is passed to the
+    worker.  Runs in a worker process of intersect_parallel().
+
+    PARAMETERS
+    ----------
+    args : tuple of the grid database path, the task database path, the
+        spatial metadata template path, the path of the database with the
+        ordered record_ids, the name of that table, and the first and last
+        positions of the chunk in it
+
+    RETURNS
+    -------
+    rows : list of (HUC12RNG, record_id, proportion_circle) tuples
+    """
+    grid_db, task_db, template_db, order_db, order_table, first, last = args
+    cursor, conn = spatialite(template=template_db)
+    cursor.executescript("""ATTACH DATABASE '{0}' AS shucs;
+                            ATTACH DATABASE '{1}' AS eval;
+                            ATTACH DATABASE '{2}' AS work;
+
+                            CREATE TABLE chunk_ids (record_id TEXT PRIMARY KEY);
+                         """.format(grid_db, task_db, order_db))
+    cursor.execute("""INSERT INTO chunk_ids
+                      SELECT record_id FROM work.{0}
+                      WHERE position BETWEEN ? AND ?;""".format(order_table),
+                   (first, last))
+    cursor.executescript("""
+        CREATE TABLE chunk_records AS
+            SELECT o.record_id, o.eventDate, o.weight, o.footprint_area,
+                   o.geometry
+            FROM eval.occurrence_records AS o
+                 JOIN chunk_ids ON o.record_id = chunk_ids.record_id;
+
+        SELECT RecoverGeometryColumn('chunk_records', 'geometry', 5070,
+                                     'POLYGON', 'XY');
+        """)
+    conn.commit()
+    intersect(era="chunk", end_year="chunk", conn=conn, cursor=cursor)
+    rows = cursor.execute("""SELECT HUC12RNG, record_id, proportion_circle
+                             FROM intersected_chunk;""").fetchall()
+    conn.close()
+    return rows
+
+def intersect_parallel(era, end_year, conn, cursor, grid_db, task_db,
+                       template_db, n_workers, max_memory_mb=512,
+                       tile_size=100000):
+    """
+    Does the same as intersect(), but splits the records into chunks that
+    are intersected by a pool of worker processes, then merges the results
+    into intersected_[era].  Records are ordered by the tile (tile_size x
+    tile_size meters) that their centroid is in before they are chunked, so
+    each chunk covers a compact area of the grid and chunks take similar
+    amounts of time.
+
+    The order is saved as a table, so neither the record_ids nor the results
+    are held in this process: workers are handed a range of positions, read
+    their record_ids from that table and the footprints from the task
+    database, and each chunk's results are written to chunk_intersections as
+    it comes back.  conn therefore needs to be a database file (see
+    attribute_records()) that the workers can read.  Chunks are sized with
+    batch_size() so that each worker's memory use stays under max_memory_mb
+    however many records there are.
+
+    PARAMETERS
+    ----------
+    era : string
+        Name of the records table to use, e.g. 'unique'.  It needs record_id,
+        eventDate, weight, x, and y columns, footprints are not used.
+    end_year: integer
+        used for print statement only
+    conn : spatialite enabled sqlite connection to a database file, with the
+        task database attached as eval
+    cursor : connection cursor
+    grid_db : string
+        Path to the grid sqlite database
+    task_db : string
+        Path to the task database
+    template_db : string
+        Path to the spatial metadata template (see spatial_template())
+    n_workers : integer
+        Number of worker processes
+    max_memory_mb : number
+        Approximate ceiling on the memory each worker uses for records, in
+        megabytes
+    tile_size : number
+        Width of the square tiles used to order records spatially, in meters
+    """
+    import multiprocessing as mp
+    from datetime import datetime
+    time1 = datetime.now()
+
+    try:
+        work_db = [x[2] for x in cursor.execute("PRAGMA database_list;")
+                   if x[1] == "main"][0]
+        cursor.executescript("""
+            CREATE TABLE {0}_order (position INTEGER PRIMARY KEY,
+                                    record_id TEXT);
+
+            INSERT INTO {0}_order (record_id)
+                SELECT record_id
+                FROM {0}_records
+                ORDER BY CAST(y / {1} AS INTEGER),
+                         CAST(x / {1} AS INTEGER),
+                         y, x;
+
+            CREATE TABLE chunk_intersections (HUC12RNG TEXT,
+                                              record_id TEXT,
+                                              proportion_circle REAL);
+            """.format(era, tile_size))
+        conn.commit()
+        n_records = cursor.execute("SELECT COUNT(*) FROM {0}_order;".format(era)).fetchone()[0]
+        chunk_size = batch_size(era, cursor, max_memory_mb)
+        chunks = [(grid_db, task_db, template_db, work_db, era + "_order",
+                   i + 1, i + chunk_size)
+                  for i in range(0, n_records, chunk_size)]
+        # Spawned, since this runs in a stage thread while other stages hold
+        # connections (see run_stages()) and forking a threaded process can
+        # deadlock
+        spawn = mp.get_context("spawn")
+        with spawn.Pool(processes=min(n_workers, max(len(chunks), 1))) as pool:
+            for rows in pool.imap_unordered(_intersect_chunk, chunks):
+                cursor.executemany("""INSERT INTO chunk_intersections
+                                      VALUES (?, ?, ?);""", rows)
+                conn.commit()
+
+        cursor.executescript("""
+            CREATE TABLE intersected_{0} AS
+                SELECT ci.HUC12RNG AS HUC12RNG, ci.record_id AS record_id,
+                       eo.eventDate AS eventDate, eo.weight AS weight,
+                       ci.proportion_circle AS proportion_circle
+                FROM chunk_intersections AS ci
+                     JOIN {0}_records AS eo ON ci.record_id = eo.record_id;
+
+            DROP TABLE chunk_intersections;
+            DROP TABLE {0}_order;
+
+            CREATE INDEX idx_intersect_{0}s ON intersected_{0} (HUC12RNG, record_id, eventDate, weight);
+            """.format(era))
+        conn.commit()
+        print("Intersected {0} {1}-{2} records in {3} chunks of up to {4} with {5} workers: ".format(n_records, end_year, era, len(chunks), chunk_size, n_workers) + str(datetime.now() - time1))
+    except Exception as e:
+        print("!! FAILED to intersect {0}-{1} records in parallel: ".format(end_year, era) + str(datetime.now() - time1))
+        print(e)
+
+# --------------------------------------------- Circle and polygon overlap area
+def circle_overlap_areas(x, y, radius, polygons):
+    """
+    Computes the exact area of overlap between circles and polygons.  Each
+    ring's overlap is the sum, over its edges, of the signed area of overlap
+    between the circle and the triangle formed by the circle's center and
+    the edge.  That area is a triangle for parts of the edge inside the
+    circle and a circular sector for parts outside of it.  Holes are
+    subtracted.
+
+    PARAMETERS
+    ----------
+    x : array of circle center x coordinates
+    y : array of circle center y coordinates
+    radius : array of circle radii
+    polygons : shapely array of polygons or multipolygons, one for each
+        circle
+
+    RETURNS
+    -------
+    areas : array of overlap areas
+    """
+    import numpy as np
+    import shapely
+
+    # Vertices of every ring, with the ring and pair they belong to
+    parts, part_pair = shapely.get_parts(polygons, return_index=True)
+    rings, ring_part = shapely.get_rings(parts, return_index=True)
+    coords, vertex_ring = shapely.get_coordinates(rings, return_index=True)
+    ring_pair = part_pair[ring_part]
+
+    # The first ring of each part is its exterior, others are holes
+    ring_sign = np.full(len(rings), -1.0)
+    ring_sign[np.unique(ring_part, return_index=True)[1]] = 1.0
+
+    # Edges, relative to the circle's center
+    same_ring = vertex_ring[:-1] == vertex_ring[1:]
+    edge_ring = vertex_ring[:-1][same_ring]
+    edge_pair = ring_pair[edge_ring]
+    cx = np.asarray(x, dtype="float64")[edge_pair]
+    cy = np.asarray(y, dtype="float64")[edge_pair]
+    r = np.asarray(radius, dtype="float64")[edge_pair]
+    ax = coords[:-1, 0][same_ring] - cx
+    ay = coords[:-1, 1][same_ring] - cy
+    bx = coords[1:, 0][same_ring] - cx
+    by = coords[1:, 1][same_ring] - cy
+
+    # Where the edge crosses the circle, as fractions of the edge's length
+    dx, dy = bx - ax, by - ay
+    a = dx * dx + dy * dy
+    b = 2 * (ax * dx + ay * dy)
+    c = ax * ax + ay * ay - r * r
+    disc = b * b - 4 * a * c
+    crosses = (disc > 0) & (a > 0)
+    root = np.sqrt(np.where(crosses, disc, 0))
+    denom = np.where(a > 0, 2 * a, 1)
+    t1 = np.where(crosses, np.clip((-b - root) / denom, 0, 1), 1)
+    t2 = np.where(crosses, np.clip((-b + root) / denom, 0, 1), 1)
+    p1x, p1y = ax + t1 * dx, ay + t1 * dy
+    p2x, p2y = ax + t2 * dx, ay + t2 * dy
+
+    def sector(px, py, qx, qy):
+        return 0.5 * r * r * np.arctan2(px * qy - py * qx, px * qx + py * qy)
+
+    # Outside from A to P1, inside from P1 to P2, outside from P2 to B
+    edge_areas = (sector(ax, ay, p1x, p1y)
+                  + 0.5 * (p1x * p2y - p1y * p2x)
+                  + sector(p2x, p2y, bx, by))
+
+    ring_areas = np.bincount(edge_ring, weights=edge_areas,
+                             minlength=len(rings))
+    return np.bincount(ring_pair, weights=ring_sign * np.abs(ring_areas),
+                       minlength=len(polygons))
+
+# ------------------------------------------------- Load grid for STRtree use
+_grid_cache = {}
+
+def load_grid(grid_db, cursor):
+    """
+    Loads the grid polygons as a shapely geometry array with an STRtree.
+    Grids are kept in memory, so the work is only done once per process.
+
+    PARAMETERS
+    ----------
+    grid_db : string
+        Path to the grid sqlite database, used as the key for the cache
+    cursor : cursor of a spatialite enabled connection with the grid
+        attached as shucs
+
+    RETURNS
+    -------
+    grid : dictionary with arrays of HUC12RNG codes ("hucs"), polygons
+        ("geoms"), polygon boundaries ("boundaries"), polygon areas
+        ("areas"), and an STRtree of the polygons ("tree").
+    """
+    import numpy as np
+    import shapely
+    from datetime import datetime
+
+    if grid_db not in _grid_cache:
+        time1 = datetime.now()
+        rows = cursor.execute("""SELECT HUC12RNG, ST_AsBinary(geom_5070)
+                                 FROM shucs.huc12rng_gap_polygon;""").fetchall()
+        hucs = np.array([x[0] for x in rows], dtype=object)
+        geoms = shapely.from_wkb([x[1] for x in rows])
+        shapely.prepare(geoms)
+        boundaries = shapely.boundary(geoms)
+        shapely.prepare(boundaries)
+        _grid_cache[grid_db] = {"hucs": hucs,
+                                "geoms": geoms,
+                                "boundaries": boundaries,
+                                "areas": shapely.area(geoms),
+                                "tree": shapely.STRtree(geoms)}
+        print("Loaded the grid for STRtree intersections: " + str(datetime.now() - time1))
+    return _grid_cache[grid_db]
+
+# ----------------------------------- Intersect records and grid with STRtree
+def intersect_strtree(era, end_year, conn, cursor, grid_db, min_proportion=0,
+                      n_threads=None, chunk_size=50000, circle_chunk_size=1000,
+                      max_memory_mb=512, tile_size=100000):
+    """
+    Finds the proportion of each record's footprint that falls in each
+    subregion with a bulk STRtree query and vectorized shapely calls, then
+    saves them to the overlap cache.  This is an alternative to running
+    intersect() and cache_overlaps(), which do the same thing row by row with
+    spatialite, and it fills the cache with the same rows.
+
+    Records often share a footprint (e.g., repeat observations at a
+    locality), so each unique footprint (geom_hash) is intersected once and
+    its overlaps are saved for every record that has it.  The unique
+    footprints are ordered by the tile their centroid is in in a table, and
+    they are read from eval.occurrence_records in batches from it, along with
+    the records that have them.  Each batch's overlaps are saved before the
+    next one is read, so memory use does not grow with the number of records.
+
+    Records with a radius (circular footprints, see insert_records()) are
+    handled as (x, y, radius) and their overlaps are computed exactly with
+    circle_overlap_areas(), so their footprint polygons are never used.
+    Other records are intersected as polygons.
+
+    Footprints that lie entirely inside the subregion containing their
+    centroid are resolved first, in bulk, as a 100% overlap without
+    computing any intersections.  Only the remaining, boundary-straddling,
+    records are intersected.
+
+    When min_proportion is 50 or more, only one subregion can hold enough of
+    a footprint, so the subregion containing the footprint's centroid is
+    tested first and the others are only tested if it comes up short.  Most
+    records then need one point-in-polygon test and one area calculation.
+
+    PARAMETERS
+    ----------
+    era : string
+        Name of the records table to use, e.g. 'stale'
+    end_year: integer
+        used for print statement only
+    conn : spatialite enabled sqlite connection with the grid attached as
+        shucs, the task database as eval, and the overlap cache as cache
+    cursor : connection cursor
+    grid_db : string
+        Path to the grid sqlite database
+    min_proportion : number
+        Smallest overlap (percent of the footprint) that needs to be cached.
+        Use 0 to cache every overlap.
+    n_threads : integer
+        Number of threads to compute intersections with.  Shapely releases
+        the GIL, so these run on separate cores.  Defaults to the CPU count.
+    chunk_size : integer
+        Number of record-subregion pairs to compute in each vectorized call
+        for polygon footprints
+    circle_chunk_size : integer
+        Number of record-subregion pairs to compute in each vectorized call
+        for circular footprints.  Every vertex of the subregions is held in
+        memory for these, so chunks are smaller.
+    max_memory_mb : number
+        Approximate ceiling on the memory used for each batch of footprints,
+        in megabytes (see batch_size())
+    tile_size : number
+        Width of the square tiles used to order footprints spatially, in
+        meters
+    """
+    import os
+    import numpy as np
+    import shapely
+    from concurrent.futures import ThreadPoolExecutor
+    from datetime import datetime
+    time1 = datetime.now()
+
+    if n_threads is None:
+        n_threads = os.cpu_count()
+
+    try:
+        grid = load_grid(grid_db, cursor)
+
+        # Unique footprints in spatial order, to be read in batches
+        cursor.executescript("""
+            CREATE INDEX IF NOT EXISTS idx_{0}_hash ON {0}_records (geom_hash);
+
+            CREATE TABLE {0}_footprint_order (position INTEGER PRIMARY KEY,
+                                              geom_hash TEXT);
+
+            INSERT INTO {0}_footprint_order (geom_hash)
+                SELECT geom_hash FROM {0}_records
+                GROUP BY geom_hash
+                ORDER BY CAST(MIN(y) / {1} AS INTEGER),
+                         CAST(MIN(x) / {1} AS INTEGER);
+            """.format(era, tile_size))
+        n_records = cursor.execute("SELECT COUNT(*) FROM {0}_records;".format(era)).fetchone()[0]
+        n_unique = cursor.execute("SELECT COUNT(*) FROM {0}_footprint_order;".format(era)).fetchone()[0]
+        n_batch = batch_size(era, cursor, max_memory_mb)
+        print("{0} records have {1} unique footprints, reading {2} at a time".format(n_records, n_unique, n_batch))
+
+        # Record-subregion pairs that intersect for the records in idx
+        def query_pairs(idx):
+            circles = idx[is_circle[idx]]
+            polygons = idx[~is_circle[idx]]
+            c_rec, c_huc = grid["tree"].query(centers[circles],
+                                              predicate="dwithin",
+                                              distance=radius[circles])
+            p_rec, p_huc = grid["tree"].query(footprints[polygons],
+                                              predicate="intersects")
+            return (np.concatenate([circles[c_rec], polygons[p_rec]]),
+                    np.concatenate([c_huc, p_huc]))
+
+        # Percent overlap of record-subregion pairs, computed in chunks on
+        # several threads
+        def pair_proportions(rec_idx, huc_idx):
+            def polygon_areas(start):
+                stop = start + chunk_size
+                return shapely.area(shapely.intersection(footprints[p_rec[start:stop]],
+                                                         grid["geoms"][p_huc[start:stop]]))
+
+            def circle_areas(start):
+                stop = start + circle_chunk_size
+                return circle_overlap_areas(x_c[start:stop], y_c[start:stop],
+                                            radius[c_rec[start:stop]],
+                                            grid["geoms"][c_huc[start:stop]])
+
+            circles = is_circle[rec_idx]
+            p_rec, p_huc = rec_idx[~circles], huc_idx[~circles]
+            c_rec, c_huc = rec_idx[circles], huc_idx[circles]
+            x_c, y_c = shapely.get_x(centers[c_rec]), shapely.get_y(centers[c_rec])
+
+            areas = np.zeros(len(rec_idx))
+            with ThreadPoolExecutor(max_workers=n_threads) as executor:
+                chunks = list(executor.map(polygon_areas,
+                                           range(0, len(p_rec), chunk_size)))
+                if chunks:
+                    areas[~circles] = np.concatenate(chunks)
+                chunks = list(executor.map(circle_areas,
+                                           range(0, len(c_rec), circle_chunk_size)))
+                if chunks:
+                    areas[circles] = np.concatenate(chunks)
+            return 100 * (areas / record_areas[rec_idx])
+
+        cursor.execute("""DELETE FROM cache.overlaps
+                          WHERE record_id IN (SELECT record_id FROM {0}_records);
+                       """.format(era))
+        cursor.execute("""CREATE TEMP TABLE batch_hashes (geom_hash TEXT PRIMARY KEY);""")
+
+        n_fast, n_won, n_circles = 0, 0, 0
+        for start in range(0, n_unique, n_batch):
+            # This batch's footprints as arrays, polygons are only needed for
+            # non-circles
+            cursor.execute("DELETE FROM batch_hashes;")
+            cursor.execute("""INSERT INTO batch_hashes
+                              SELECT geom_hash FROM {0}_footprint_order
+                              WHERE position BETWEEN ? AND ?;""".format(era),
+                           (start + 1, start + n_batch))
+            rows = cursor.execute("""SELECT eo.geom_hash, eo.footprint_area,
+                                            eo.x, eo.y, eo.radius,
+                                            CASE WHEN eo.radius IS NULL
+                                                 THEN ST_AsBinary(o.geometry) END
+                                     FROM {0}_records AS eo
+                                          JOIN eval.occurrence_records AS o
+                                          ON eo.record_id = o.record_id
+                                     WHERE eo.geom_hash IN (SELECT geom_hash
+                                                            FROM batch_hashes)
+                                     GROUP BY eo.geom_hash;""".format(era)).fetchall()
+            batch_hashes = [x[0] for x in rows]
+            footprint_areas = np.array([x[1] for x in rows], dtype="float64")
+            centers = shapely.points(np.array([x[2:4] for x in rows],
+                                              dtype="float64").reshape(-1, 2))
+            radius = np.array([x[4] for x in rows], dtype="float64")
+            footprints = shapely.from_wkb([x[5] for x in rows])
+            n_footprints = len(rows)
+            is_circle = ~np.isnan(radius)
+            record_areas = np.where(is_circle, np.pi * radius**2, footprint_areas)
+            n_circles += is_circle.sum()
+
+            # Records that have this batch's footprints
+            rows = cursor.execute("""SELECT record_id, geom_hash
+                                     FROM {0}_records
+                                     WHERE geom_hash IN (SELECT geom_hash
+                                                         FROM batch_hashes);
+                                  """.format(era)).fetchall()
+            record_ids = np.array([x[0] for x in rows], dtype=object)
+            hashes = np.array([x[1] for x in rows], dtype=object)
+            members = {}
+            for i, h in enumerate(hashes):
+                members.setdefault(h, []).append(i)
+
+            # Subregion that contains each footprint's centroid
+            pt_idx, cand_idx = grid["tree"].query(centers, predicate="intersects")
+            pt_idx, first = np.unique(pt_idx, return_index=True)
+            cand_idx = cand_idx[first]
+
+            # Fast path: footprints entirely inside that subregion overlap it
+            # by 100%.  Circles are inside when the distance from the center
+            # to the subregion's boundary is at least the radius.
+            inside = np.zeros(len(pt_idx), dtype=bool)
+            circles = is_circle[pt_idx]
+            inside[circles] = (shapely.distance(centers[pt_idx[circles]],
+                                                grid["boundaries"][cand_idx[circles]])
+                               >= radius[pt_idx[circles]])
+            inside[~circles] = shapely.contains_properly(grid["geoms"][cand_idx[~circles]],
+                                                         footprints[pt_idx[~circles]])
+            fast_idx, fast_huc_idx = pt_idx[inside], cand_idx[inside]
+            pt_idx, cand_idx = pt_idx[~inside], cand_idx[~inside]
+            todo = np.setdiff1d(np.arange(n_footprints), fast_idx)
+            n_fast += len(fast_idx)
+
+            if min_proportion >= 50:
+                # Test the subregion that contains each footprint's centroid
+                cand_proportions = pair_proportions(pt_idx, cand_idx)
+                won = cand_proportions > 50
+
+                # Footprints that straddle a boundary or whose centroid is off
+                # the grid are tested against every subregion they touch.
+                rest = np.setdiff1d(todo, pt_idx[won])
+                rest_idx, rest_huc_idx = query_pairs(rest)
+                rest_proportions = pair_proportions(rest_idx, rest_huc_idx)
+
+                rec_idx = np.concatenate([pt_idx[won], rest_idx])
+                huc_idx = np.concatenate([cand_idx[won], rest_huc_idx])
+                proportions = np.concatenate([cand_proportions[won],
+                                              rest_proportions])
+                n_won += won.sum()
+            else:
+                # Bulk query for record-subregion pairs that intersect
+                rec_idx, huc_idx = query_pairs(todo)
+                proportions = pair_proportions(rec_idx, huc_idx)
+
+            rec_idx = np.concatenate([fast_idx, rec_idx])
+            huc_idx = np.concatenate([fast_huc_idx, huc_idx])
+            proportions = np.concatenate([np.full(len(fast_idx), 100.0),
+                                          proportions])
+
+            # Every overlap is known for footprints on the fast path
+            footprint_min = np.full(n_footprints, float(min_proportion))
+            footprint_min[fast_idx] = 0
+
+            # Drop pairs that only touch, spatialite returns NULL for those,
+            # and those too small to ever be needed.
+            keep = (proportions > 0) & (proportions >= min_proportion)
+            rec_idx, huc_idx = rec_idx[keep], huc_idx[keep]
+            proportions = proportions[keep]
+
+            # Fan the overlaps of each footprint out to the records that have
+            # it
+            order = np.array([i for h in batch_hashes for i in members[h]],
+                             dtype="int64")
+            counts = np.array([len(members[h]) for h in batch_hashes],
+                              dtype="int64")
+            record_footprint = np.repeat(np.arange(n_footprints), counts)
+            starts = np.cumsum(counts) - counts
+            pair_counts = counts[rec_idx]
+            pair_starts = np.repeat(starts[rec_idx], pair_counts)
+            offsets = (np.arange(pair_counts.sum())
+                       - np.repeat(np.cumsum(pair_counts) - pair_counts, pair_counts))
+            missed = np.isin(record_footprint, rec_idx, invert=True)
+            huc_idx = np.repeat(huc_idx, pair_counts)
+            proportions = np.repeat(proportions, pair_counts)
+            rec_min = np.repeat(footprint_min[rec_idx], pair_counts)
+            rec_idx = order[pair_starts + offsets]
+
+            # Save to the overlap cache
+            cursor.executemany("""INSERT INTO cache.overlaps VALUES (?, ?, ?, ?, ?);""",
+                               zip(record_ids[rec_idx], hashes[rec_idx],
+                                   grid["hucs"][huc_idx], proportions.tolist(),
+                                   rec_min.tolist()))
+            cursor.executemany("""INSERT INTO cache.overlaps (record_id, geom_hash,
+                                                              min_proportion)
+                                  VALUES (?, ?, ?);""",
+                               zip(record_ids[order[missed]], hashes[order[missed]],
+                                   footprint_min[record_footprint[missed]].tolist()))
+            conn.commit()
+
+        cursor.execute("DROP TABLE batch_hashes;")
+        cursor.execute("DROP TABLE {0}_footprint_order;".format(era))
+        print("Resolved {0} of {1} footprints ({2:.1f}%) as entirely inside one subregion".format(n_fast, n_unique, 100 * n_fast / max(n_unique, 1)))
+        if min_proportion >= 50:
+            print("Attributed {0} of {1} footprints with a single candidate".format(n_won, n_unique))
+        print("Intersected and cached {0}-{1} records with STRtree ({2} circles): ".format(end_year, era, n_circles) + str(datetime.now() - time1))
+    except Exception as e:
+        print("!! FAILED to intersect {0}-{1} records with STRtree: ".format(end_year, era) + str(datetime.now() - time1))
+        print(e)
+
+# ------------------------------------------ Cache overlaps of new footprints
+def cache_overlaps(era, end_year, conn, cursor, footprints=None):
+    """
+    Saves the proportion of each record's footprint that falls within each
+    subregion it intersects to the overlap cache.  Records that do not
+    intersect any subregion get one row with a NULL HUC12RNG so that they
+    are not intersected again.  Rows for older footprints of the records are
+    replaced.  Every overlap is saved, so min_proportion is 0 for all rows.
+
+    PARAMETERS
+    ----------
+    era : string
+        Name of the records table and intersection to use, e.g. 'stale'
+    end_year: integer
+        used for print statement only
+    conn : spatialite enabled sqlite connection with the cache attached
+    cursor : connection cursor
+    footprints : string
+        Name of the records table and intersection that hold one record per
+        unique footprint (geom_hash), e.g. 'unique'.  Their overlaps are saved
+        for every record in the era's table with the same footprint.  If None,
+        the era's intersection is used.
+    """
+    from datetime import datetime
+    time1 = datetime.now()
+
+    if footprints is None:
+        footprints = era
+
+    sql="""
+    DELETE FROM cache.overlaps
+    WHERE record_id IN (SELECT record_id FROM {0}_records);
+
+    CREATE TEMP TABLE footprint_overlaps AS
+        SELECT fp.geom_hash AS geom_hash,
+               intersected_{1}.HUC12RNG AS HUC12RNG,
+               intersected_{1}.proportion_circle AS proportion_circle
+        FROM intersected_{1}
+             JOIN {1}_records AS fp
+             ON intersected_{1}.record_id = fp.record_id
+        GROUP BY fp.geom_hash, intersected_{1}.HUC12RNG;
+
+    INSERT INTO cache.overlaps SELECT eo.record_id, eo.geom_hash,
+                                      fo.HUC12RNG,
+                                      fo.proportion_circle,
+                                      0 AS min_proportion
+                               FROM footprint_overlaps AS fo
+                                    JOIN {0}_records AS eo
+                                    ON fo.geom_hash = eo.geom_hash;
+
+    INSERT INTO cache.overlaps (record_id, geom_hash, min_proportion)
+        SELECT record_id, geom_hash, 0 FROM {0}_records
+        WHERE geom_hash NOT IN (SELECT geom_hash FROM footprint_overlaps);
+
+    DROP TABLE footprint_overlaps;
+    """.format(era, footprints)
+    try:
+        cursor.executescript(sql)
+        conn.commit()
+        print("Cached overlaps for {0}-{1} records: ".format(end_year, era) + str(datetime.now() - time1))
+    except Exception as e:
+        print("!! FAILED to cache overlaps for {0}-{1} records: ".format(end_year, era) + str(datetime.now() - time1))
+        print(e)
+
+# ------------------------------------------------------- Get error tolerance
+def get_error_tolerance(task_id, gap_id, cursor):
+    """
+    Looks up the error tolerance for the task from the parameters database.
+
+    PARAMETERS
+    ----------
+    task_id : string
+        The task ID from the parameters database
+    gap_id : string
+        The GAP code of the species
+    cursor : cursor of a connection with the parameters database attached as
+        params
+
+    RETURNS
+    -------
+    error_tolerance : float
+    """
+    error_tolerance = cursor.execute("""SELECT error_tolerance
+                                        FROM params.tasks
+                                        WHERE task_id = ?
+                                        AND species_id = ?;""",
+                                     (task_id, gap_id)).fetchone()[0]
+    return float(error_tolerance)
+
+# -------------------------------- Filter out small fragments from intersection
+def filter_small(era, end_year, task_id, gap_id, conn, cursor):
+    """
+    Use the error tolerance for the species to select those occurrences that
+    can be attributed to a HUC.  Overlap proportions are read from the overlap
+    cache, which must have entries for every record in the era's table (see
+    cache_overlaps()).  Weights come from the records table, so changing
+    weights never requires new intersections.
+
+    PARAMETERS
+    ----------
+    task_id : string
+        The name of the range database
+    gap_id : string
+        The GAP code of the species
+    era : string
+        "historical" or "recent"
+
+    RETURNS
+    -------
+    filtered : boolean, False if the error tolerance couldn't be looked up
+        or the table couldn't be made
+
+    OUTPUT
+    ------
+    big_nuff_[recent or historical] : table
+        Records from table [era]_records that have enough overlap to
+        attribute to a huc.
+    """
+    import sqlite3
+    from datetime import datetime
+    time1 = datetime.now()
+
+    # Look up the error tolerance once instead of in the WHERE clause
+    try:
+        error_tolerance = get_error_tolerance(task_id, gap_id, cursor)
+    except Exception as e:
+        print("!!! FAILED to get the error tolerance")
+        print(e)
+        return False
+
+    sql="""
+    CREATE TABLE big_nuff_{1} (HUC12RNG TEXT,
+                               record_id TEXT,
+                               eventDate TEXT,
+                               weight INTEGER,
+                               proportion_circle);
+
+    INSERT INTO big_nuff_{1} SELECT o.HUC12RNG,
+                                    eo.record_id,
+                                    eo.eventDate,
+                                    eo.weight,
+                                    o.proportion_circle
+                             FROM {1}_records AS eo
+                                  JOIN cache.overlaps AS o
+                                  ON eo.record_id = o.record_id
+                                  AND eo.geom_hash = o.geom_hash
+                             WHERE o.proportion_circle BETWEEN {0} AND 100
+                             ORDER BY proportion_circle ASC;
+
+      CREATE INDEX idx_bn_{1} ON big_nuff_{1} (HUC12RNG, record_id);
+    """.format(100 - error_tolerance, era)
+    try:
+        cursor.executescript(sql)
+        conn.commit()
+        print('Determined which records overlap enough ({0}-{1}): '.format(end_year, era) + str(datetime.now() - time1))
+    except Exception as e:
+        print(e)
+        ("!!!!",era, end_year)
+        return False
+    return True
+
+# ------------------------------------------- Attribute records to subregions
+def attribute_records(task_id, gap_id, task_db, parameters_db, grid_db,
+                      cache_db, template_db, engine="spatialite",
+                      n_workers=1, max_memory_mb=512, only_new=False):
+    """
+    Intersects every occurrence record with the grid once and saves the
+    subregions that each record can be attributed to in the task database.
+    Selections for periods, eras, and seasons are made afterwards from the
+    record_attributions table with get_attributions(), so no further spatial
+    joins are needed during compilation.
+
+    Overlaps are kept in a cache database keyed by record_id and a hash of
+    the record's footprint.  Only records that are new to the cache or whose
+    footprint changed are intersected with the grid.  Each cache row also
+    notes the smallest overlap that was saved for the record
+    (min_proportion), so entries made for a low error tolerance are redone
+    when a higher one needs smaller overlaps.
+
+    With the strtree engine, circular footprints are handled as (x, y,
+    radius) and their overlaps are computed exactly.  With an error tolerance
+    below 50, at most one subregion can hold enough of a footprint, so only
+    that candidate is tested for most records (see intersect_strtree()).
+
+    The records, the overlaps, and the attributions are worked on in a
+    scratch database next to the task database ([task]_attributions.sqlite)
+    rather than in memory, and it is deleted when done.  Along with the
+    batching in intersect_parallel() and intersect_strtree(), this keeps
+    memory use flat as the number of records grows; sqlite pages the tables
+    to disk instead.
+
+    PARAMETERS
+    ----------
+    task_id : string
+        The task ID from the parameters database
+    gap_id : string
+        The GAP code of the species
+    task_db : string
+        Path to the task database
+    parameters_db : string
+        Path to the parameters database
+    grid_db : string
+        Path to the grid sqlite database
+    cache_db : string
+        Path to the overlap cache database, created if it doesn't exist
+    template_db : string
+        Path to the spatial metadata template (see spatial_template())
+    engine : string
+        "spatialite" to intersect with intersect() or "strtree" to use
+        intersect_strtree()
+    n_workers : integer
+        Number of worker processes that intersect chunks of records with the
+        spatialite engine (see intersect_parallel()), or threads with the
+        strtree engine
+    max_memory_mb : number
+        Approximate ceiling on the memory used for footprints by each worker
+        (spatialite) or each batch (strtree), in megabytes.  Footprints are
+        streamed from the task database in batches that fit.
+    only_new : boolean
+        Whether to only attribute the records in the new_records table (see
+        insert_new_records()) and add them to record_attributions.
+
+    RETURNS
+    -------
+    complete : boolean, False if any step failed or a record has no overlaps
+        in the cache
+
+    OUTPUT
+    ------
+    record_attributions : table in task_db
+        One row for each record and subregion combination that has enough
+        overlap to attribute the record to the subregion.
+    """
+    import os
+    from datetime import datetime
+    time0 = datetime.now()
+
+    # Scratch database for the working tables
+    work_db = os.path.splitext(task_db)[0] + "_attributions.sqlite"
+    for path in (work_db, work_db + "-wal", work_db + "-shm"):
+        if os.path.exists(path):
+            os.remove(path)
+    cursor, conn = spatialite(work_db, template=template_db)
+
+    cursor.executescript("""/*Attach databases*/
+                            ATTACH DATABASE '{0}' AS params;
+                            ATTACH DATABASE '{1}' AS shucs;
+                            ATTACH DATABASE '{2}' AS eval;
+                            ATTACH DATABASE '{3}' AS cache;
+
+                            CREATE TABLE IF NOT EXISTS cache.overlaps (
+                                                record_id TEXT,
+                                                geom_hash TEXT,
+                                                HUC12RNG TEXT,
+                                                proportion_circle REAL,
+                                                min_proportion REAL DEFAULT 0);
+
+                            CREATE INDEX IF NOT EXISTS cache.idx_overlaps
+                                ON overlaps (record_id, geom_hash);
+                         """.format(parameters_db, grid_db, task_db, cache_db))
+
+    # Caches made before min_proportion was added hold every overlap
+    columns = [x[1] for x in cursor.execute("PRAGMA cache.table_info(overlaps);")]
+    if "min_proportion" not in columns:
+        cursor.execute("""ALTER TABLE cache.overlaps
+                          ADD COLUMN min_proportion REAL DEFAULT 0;""")
+        conn.commit()
+
+    error_tolerance = get_error_tolerance(task_id, gap_id, cursor)
+
+    # Get all of the records --------------------------------------------------
+    time1 = datetime.now()
+    sql="""
+    CREATE TABLE all_records (taxon_id TEXT,
+                              record_id PRIMARY KEY,
+                              eventDate TEXT,
+                              weight TEXT,
+                              weight_notes TEXT,
+                              footprint_area REAL,
+                              x REAL,
+                              y REAL,
+                              radius REAL,
+                              geom_hash TEXT);
+
+    INSERT INTO all_records SELECT taxon_id, record_id, eventDate, weight,
+                                   weight_notes, footprint_area,
+                                   x, y, radius,
+                                   MD5Checksum(geometry) AS geom_hash
+                            FROM occurrence_records
+                            WHERE too_large IS NULL {0};
+
+    CREATE INDEX idx_allss ON all_records (eventDate);
+    """.format("AND record_id IN (SELECT record_id FROM new_records)" if only_new else "")
+    complete = True
+    try:
+        cursor.executescript(sql)
+        conn.commit()
+        print("Created a table of all records: " + str(datetime.now()-time1))
+    except Exception as e:
+        print("!!! FAILED to create a table of all records: {0}".format(str(datetime.now()-time1)))
+        print(e)
+        complete = False
+
+    # Find records without cached overlaps ------------------------------------
+    time1 = datetime.now()
+    sql="""
+    CREATE TABLE stale_records AS
+        SELECT * FROM all_records AS eo
+        WHERE NOT EXISTS (SELECT 1 FROM cache.overlaps AS o
+                          WHERE o.record_id = eo.record_id
+                          AND o.geom_hash = eo.geom_hash
+                          AND o.min_proportion <= {0});
+    """.format(100 - error_tolerance)
+    try:
+        cursor.executescript(sql)
+        conn.commit()
+        n_stale = cursor.execute("SELECT COUNT(*) FROM stale_records;").fetchone()[0]
+        n_all = cursor.execute("SELECT COUNT(*) FROM all_records;").fetchone()[0]
+        print("{0} of {1} records need to be intersected: ".format(n_stale, n_all) + str(datetime.now()-time1))
+    except Exception as e:
+        print("!!! FAILED to find records without cached overlaps")
+        print(e)
+        complete = False
+
+    # Intersect new or changed records with the grid and cache the overlaps ---
+    if engine == "strtree":
+        # Only overlaps of 50% or more are needed when the tolerance is < 50
+        if error_tolerance < 50:
+            min_proportion = 50
+        else:
+            min_proportion = 0
+        intersect_strtree(era="stale", end_year=time0.year, conn=conn,
+                          cursor=cursor, grid_db=grid_db,
+                          min_proportion=min_proportion, n_threads=n_workers,
+                          max_memory_mb=max_memory_mb)
+    else:
+        # Intersect each unique footprint once
+        sql="""
+        CREATE TABLE unique_records AS
+            SELECT * FROM stale_records GROUP BY geom_hash;
+        """
+        try:
+            cursor.executescript(sql)
+            conn.commit()
+        except Exception as e:
+            print("!!! FAILED to find unique footprints")
+            print(e)
+            complete = False
+        intersect_parallel(era="unique", end_year=time0.year, conn=conn,
+                           cursor=cursor, grid_db=grid_db, task_db=task_db,
+                           template_db=template_db, n_workers=n_workers,
+                           max_memory_mb=max_memory_mb)
+        cache_overlaps(era="stale", end_year=time0.year, conn=conn,
+                       cursor=cursor, footprints="unique")
+
+    # Errors while intersecting are only printed, so make sure that every
+    # record has overlaps in the cache now
+    try:
+        n_missed = cursor.execute("""
+            SELECT COUNT(*) FROM all_records AS eo
+            WHERE NOT EXISTS (SELECT 1 FROM cache.overlaps AS o
+                              WHERE o.record_id = eo.record_id
+                              AND o.geom_hash = eo.geom_hash
+                              AND o.min_proportion <= ?);""",
+            (100 - error_tolerance,)).fetchone()[0]
+    except Exception as e:
+        print(e)
+        n_missed = None
+    if n_missed != 0:
+        print("!!! FAILED to intersect {0} records".format(n_missed if n_missed is not None else "some"))
+        complete = False
+
+    # Filter out small fragments ----------------------------------------------
+    filter_small(era="all", end_year=time0.year, task_id=task_id,
+                 gap_id=gap_id, conn=conn, cursor=cursor)
+
+    # Save the attributions in the task database ------------------------------
+    sql="""
+    CREATE TABLE IF NOT EXISTS eval.record_attributions (HUC12RNG TEXT,
+                                                         record_id TEXT,
+                                                         eventDate TEXT,
+                                                         month TEXT,
+                                                         weight INTEGER,
+                                                         proportion_circle REAL);
+
+    INSERT INTO eval.record_attributions
+        SELECT HUC12RNG, record_id, eventDate,
+               STRFTIME('%m', eventDate) AS month,
+               weight, proportion_circle
+        FROM big_nuff_all;
+
+    CREATE INDEX IF NOT EXISTS eval.idx_ra_date ON record_attributions (eventDate, month);
+    """
+    try:
+        cursor.executescript(sql)
+        conn.commit()
+        print("Saved record attributions: " + str(datetime.now() - time0))
+    except Exception as e:
+        print("!!! FAILED to save record attributions")
+        print(e)
+        complete = False
+
+    conn.close()
+    for path in (work_db, work_db + "-wal", work_db + "-shm"):
+        if os.path.exists(path):
+            os.remove(path)
+    return complete
+
+# ------------------------------------------- Get attributions for a time frame
+def get_attributions(start_year, end_year, conn, cursor, era, season,
+                     only_new=False):
+    """
+    Selects the record attributions to use for a time frame and season from
+    the record_attributions table made by attribute_records().  The result
+    is the big_nuff table that intersect() and filter_small() used to make
+    for each period and era.
+
+    PARAMETERS
+    ----------
+    start_year : integer
+    end_year : integer
+    conn : spatialite enabled sqlite connection with the task db attached
+    cursor : connection cursor
+    era : string
+        'recent' or 'historical'
+    season : string like "summer", "winter" or "year_round"
+    only_new : boolean
+        Whether to only select the records in the new_records table (see
+        insert_new_records())
+
+    OUTPUT
+    ------
+    big_nuff_[recent or historical] : table
+        Records that have enough overlap to attribute to a huc.
+    """
+    from datetime import datetime
+    time1 = datetime.now()
+
+    # Build era and season conditions
+    condition, condition2 = record_conditions(start_year, end_year, era, season)
+
+    sql="""
+    CREATE TABLE big_nuff_{0} (HUC12RNG TEXT,
+                               record_id TEXT,
+                               eventDate TEXT,
+                               weight INTEGER,
+                               proportion_circle);
+
+    INSERT INTO big_nuff_{0} SELECT HUC12RNG, record_id, eventDate, weight,
+                                    proportion_circle
+                             FROM record_attributions
+                             WHERE eventDate {1} {2} {3};
+
+    CREATE INDEX idx_bn_{0} ON big_nuff_{0} (HUC12RNG, record_id);
+    """.format(era, condition, condition2,
+               "AND record_id IN (SELECT record_id FROM new_records)" if only_new else "")
+    try:
+        cursor.executescript(sql)
+        conn.commit()
+        print("Selected attributions of {0}-{1} records: ".format(end_year, era) + str(datetime.now()-time1))
+    except Exception as e:
+        print("!!! FAILED to select attributions of {0}-{1} records: ".format(end_year, era) + str(datetime.now()-time1))
+        print(e)
+
+# ------------------------------------------------ Calculate weight of evidence
+def calculate_weight(era, end_year, cursor):
+    """
+    Sums the weight of the records attributed to each huc.
+
+    PARAMETERS
+    ----------
+    era : string
+        'recent' or 'historical'
+    end_year : integer
+    cursor : cursor of a connection with big_nuff_[era] (see
+        get_attributions())
+
+    RETURNS
+    -------
+    weights : list of (HUC12RNG, summed weight) tuples
+    """
+    from datetime import datetime
+
+    time1 = datetime.now()
+    try:
+        weights = cursor.execute("""SELECT HUC12RNG, SUM(weight)
+                                    FROM big_nuff_{0}
+                                    GROUP BY HUC12RNG;""".format(era)).fetchall()
+        print('Calculated total weight of evidence for each subregion ({0}-{1}): '.format(end_year, era) + str(datetime.now() - time1))
+        return weights
+    except Exception as e:
+        print(e)
+        print("!!!!!!", era, end_year)
+        return []
+
+# -------------------------------------------------- Save weight of evidence
+def save_weights(season, era, start_year, end_year, weights, cursor):
+    """
+    Adds a column with the summed weight of evidence for each huc to the
+    season's table and saves the weights in the long huc_weights table.
+    Runs on the task database writer (see write_results()) and doesn't
+    commit.
+
+    PARAMETERS
+    ----------
+    season : string like "presence", "summer", "winter" or "year_round"
+    era : string
+        'recent' or 'historical'
+    start_year : integer
+    end_year : integer
+    weights : list of (HUC12RNG, summed weight) tuples from
+        calculate_weight()
+    cursor : cursor of the task database
+    """
+    cursor.execute("""ALTER TABLE {2} ADD COLUMN {1}_weight_{0} INT;
+                   """.format(str(end_year), era, season))
+    cursor.execute("""CREATE TEMP TABLE IF NOT EXISTS new_weights
+                          (HUC12RNG TEXT PRIMARY KEY, weight INT);""")
+    cursor.execute("DELETE FROM new_weights;")
+    cursor.executemany("INSERT INTO new_weights VALUES (?, ?);", weights)
+    cursor.execute("""UPDATE {2}
+                      SET {1}_weight_{0} = (SELECT weight
+                                            FROM new_weights
+                                            WHERE HUC12RNG = {2}.strHUC12RNG);
+                   """.format(str(end_year), era, season))
+    cursor.execute("""DELETE FROM huc_weights
+                      WHERE season = ? AND era = ? AND end_year = ?;""",
+                   (season, era, int(end_year)))
+    cursor.execute("""INSERT INTO huc_weights
+                      SELECT ?, ?, ?, ?, HUC12RNG, weight FROM new_weights;""",
+                   (season, era, int(start_year), int(end_year)))
+
+# ---------------------------------------------- Add to the weight of evidence
+def add_weights(season, era, start_year, end_year, weights, cursor):
+    """
+    Adds the summed weight of newly added records to the stored weights of
+    a season (see save_weights()) and marks hucs that now have enough
+    evidence as documented.  Doesn't commit.
+
+    PARAMETERS
+    ----------
+    season : string like "presence", "summer", "winter" or "year_round"
+    era : string
+        'recent' or 'historical'
+    start_year : integer
+    end_year : integer
+    weights : list of (HUC12RNG, summed weight) tuples for the new records,
+        from calculate_weight()
+    cursor : cursor of the task database
+    """
+    new_subregions(season, [x[0] for x in weights], cursor)
+    cursor.execute("""CREATE TEMP TABLE IF NOT EXISTS new_weights
+                          (HUC12RNG TEXT PRIMARY KEY, weight INT);""")
+    cursor.execute("DELETE FROM new_weights;")
+    cursor.executemany("INSERT INTO new_weights VALUES (?, ?);", weights)
+    cursor.execute("""UPDATE {2}
+                      SET {1}_weight_{0} = IFNULL({1}_weight_{0}, 0) +
+                                           (SELECT weight
+                                            FROM new_weights
+                                            WHERE HUC12RNG = {2}.strHUC12RNG)
+                      WHERE strHUC12RNG IN (SELECT HUC12RNG FROM new_weights);
+                   """.format(str(end_year), era, season))
+    cursor.execute("""UPDATE huc_weights
+                      SET weight = weight + (SELECT weight
+                                             FROM new_weights
+                                             WHERE HUC12RNG = huc_weights.HUC12RNG)
+                      WHERE season = ? AND era = ? AND end_year = ?
+                      AND HUC12RNG IN (SELECT HUC12RNG FROM new_weights);""",
+                   (season, era, int(end_year)))
+    cursor.execute("""INSERT INTO huc_weights
+                      SELECT ?, ?, ?, ?, HUC12RNG, weight FROM new_weights
+                      WHERE HUC12RNG NOT IN (SELECT HUC12RNG FROM huc_weights
+                                             WHERE season = ? AND era = ?
+                                             AND end_year = ?);""",
+                   (season, era, int(start_year), int(end_year),
+                    season, era, int(end_year)))
+
+    # Document sufficient evidence
+    if era == 'recent':
+        cursor.execute("""UPDATE {1} SET documented_{0} = 1
+                          WHERE recent_weight_{0} >= 10
+                          AND strHUC12RNG IN (SELECT HUC12RNG FROM new_weights);
+                       """.format(str(end_year), season))
+    if era == 'historical':
+        cursor.execute("""UPDATE {2} SET documented_pre{1} = 1
+                          WHERE historical_weight_{0} >= 10
+                          AND strHUC12RNG IN (SELECT HUC12RNG FROM new_weights);
+                       """.format(str(end_year), str(start_year), season))
+
+# ---------------------------------------------- Find newly occupied subregions
+def new_subregions(season, hucs, cursor):
+    """
+    Find hucs that contained occurrences or opinions, but were not in GAP
+    range and insert them into the season's table as new records.  Runs on
+    the task database writer (see write_results()) and doesn't commit.
+
+    PARAMETERS
+    ----------
+    season : string like "presence", "summer", "winter" or "year_round"
+    hucs : list of HUC12RNG codes
+    cursor : cursor of the task database
+    """
+    cursor.executemany("""INSERT INTO {0} (strHUC12RNG)
+                          SELECT ?
+                          WHERE NOT EXISTS (SELECT 1 FROM {0}
+                                            WHERE strHUC12RNG = ?);
+                       """.format(season), [(x, x) for x in hucs])
+
+# --------------------------------------------------------- Clear a season
+def clear_season(season, cursor):
+    """
+    Returns a season's table to how make_range_db() made it by dropping the
+    columns and rows that an earlier, interrupted compilation added, and
+    removes the season's summed weights.  Does nothing to a table that
+    hasn't been compiled.  Runs on the task database writer (see
+    write_results()) and doesn't commit.
+
+    PARAMETERS
+    ----------
+    season : string like "presence", "summer", "winter" or "year_round"
+    cursor : cursor of the task database
+    """
+    base = ["strHUC12RNG", season + "_2001v1", "geom_5070"]
+    columns = [x[1] for x in cursor.execute("PRAGMA table_info({0});".format(season)).fetchall()]
+    added = [x for x in columns if x not in base]
+    for column in added:
+        cursor.execute("ALTER TABLE {0} DROP COLUMN {1};".format(season, column))
+    if added:
+        cursor.execute("DELETE FROM {0} WHERE {0}_2001v1 IS NULL;".format(season))
+    cursor.execute("DELETE FROM huc_weights WHERE season = ?;", (season,))
+
+# ----------------------------------------------- Add documented present column
+def set_documented(season, era, cursor, end_year, start_year,
+                   use_observations):
+    """
+    Mark records/subregions that have sufficient evidence of presence.  Runs
+    on the task database writer (see write_results()) and doesn't commit.
+
+    PARAMETERS
+    ----------
+    era : string
+        'recent' : 'historical'
+    end_year : integer
+    """
+    if era == 'recent':
+        cursor.execute("""ALTER TABLE {1} ADD COLUMN documented_{0} INT;
+                       """.format(str(end_year), season))
+        if use_observations:
+            cursor.execute("""UPDATE {1} SET documented_{0} = 1
+                              WHERE recent_weight_{0} >= 10;
+                           """.format(str(end_year), season))
+
+    if era == 'historical':
+        cursor.execute("""ALTER TABLE {1} ADD COLUMN documented_pre{0} INT;
+                       """.format(str(start_year), season))
+        if use_observations:
+            cursor.execute("""UPDATE {2} SET documented_pre{1} = 1
+                              WHERE historical_weight_{0} >= 10;
+                           """.format(str(end_year), str(start_year), season))
+
+'''
+# ----------------------------------------------------- Fill out presence codes DELET THIS???????????
+def presence_code(period, periods, conn, cursor, version):
+    """
+    Fills out values in the presence column
+
+    PARAMETERS
+    ----------
+    period : tuple
+        The time period
+    version : string
+        Range version being created
+    """
+    from datetime import datetime
+    #start_year = str(period[0])
+    end_year = str(period[1])
+
+    # Identify previous presence column
+    if periods.index(period) > 0:
+        previous_season = str(periods[periods.index(period) - 1][1]) + version
+    else:
+        previous_season = "2001v1"
+
+    # Fill out new presence column
+    time1 = datetime.now()
+
+    # ----------------------  PASS 1  --------------------------
+    # NOTE: The order of these statements matters and reflects their rank
+    if period == periods[0]:
+        sql = """
+        /* Add columns */
+        ALTER TABLE presence ADD COLUMN presence_{0} INT;
+
+        /* --------------------------- 2001v1 -----------------------------------*/
+        /* If a 2001v1 code exists, use that as a start */
+        UPDATE presence SET presence_{0} = presence_2001v1;
+
+        /* Old legend values 1,2,3 become new legend value 3 */
+        UPDATE presence SET presence_{0} = 3 WHERE presence_{0} in (1,2,3);
+
+        /* Old legend values 4,5 become new legend value 4 */
+        UPDATE presence SET presence_{0} = 4 WHERE presence_{0} in (4,5);
+        """.format(str(end_year) + version)
+    
+    else:
+        sql = """
+        /* Add columns */
+        ALTER TABLE presence ADD COLUMN presence_{0} INT;
+
+        /* -------------------- Previous Period Code ----------------------------*/
+        /* If coded as documented present in previous time step, code as 3 */
+        UPDATE presence SET presence_{0} = 3 WHERE presence_{1} = 1;
+
+        /* If coded as likely present in previous time step, code as 2 */
+        UPDATE presence SET presence_{0} = 2 WHERE presence_{1} = 2;
+
+        /* If coded as suspected present in previous time step, code as 3 */
+        UPDATE presence SET presence_{0} = 3 WHERE presence_{1} = 3;
+
+        /* If coded as suspected absent in previous time step, code as 4 */
+        UPDATE presence SET presence_{0} = 4 WHERE presence_{1} = 4;
+
+        /* If coded as likely absent in previous time step, code as 5 */
+        UPDATE presence SET presence_{0} = 5 WHERE presence_{1} = 5;
+        """.format(str(end_year) + version, previous_season)
+    try:
+        cursor.executescript(sql)
+        conn.commit()
+        print('Added presence column for {0}: '.format(str(end_year) + version) + str(datetime.now() - time1))
+    except Exception as e:
+        print(e)
+
+    sql="""   
+    /* --------------------------- Opinion ----------------------------------*/
+    /* If opinion with any score exists, but all else in null base the presence
+       on it.*/
+    /*Suspected present*/
+    UPDATE presence SET presence_{0} = 3 WHERE opinion_{0} = 1
+                                         AND presence_2001v1 IS NULL
+                                         AND presence_{1} IS NULL
+                                         AND documented_{0} IS NULL;
+
+    /*Suspected absent*/
+    UPDATE presence SET presence_{0} = 4 WHERE opinion_{0} = 0
+                                         AND presence_2001v1 IS NULL
+                                         AND presence_{1} IS NULL
+                                         AND documented_{0} IS NULL;
+
+    /* If opinion with a high enough score exists, use it to overwrite null
+       values and codes from previous periods (including 2001v1)*/
+    /*Suspected present*/
+    UPDATE presence 
+    SET presence_{0} = 3 WHERE opinion_{0} = 1 AND opinion_{0}_weight > 2.0;
+
+    /*Suspected absent*/
+    UPDATE presence 
+    SET presence_{0} = 4 WHERE opinion_{0} = 0 AND opinion_{0}_weight > 2.0;
+
+    /*Likely present*/
+    UPDATE presence 
+    SET presence_{0} = 2 WHERE opinion_{0} = 1 AND opinion_{0}_weight > 8.0;
+
+    /*Likely absent*/
+    UPDATE presence 
+    SET presence_{0} = 5 WHERE opinion_{0} = 0 AND opinion_{0}_weight > 8.0;
+
+    /* ----------------------- Occurrence Records ---------------------------*/
+    /* If documented in a previous time period, code as 3 */
+    UPDATE presence SET presence_{0} = 1 WHERE documented_{0}=1;
+
+    """.format(str(end_year) + version, previous_season)
+    try:
+        cursor.executescript(sql)
+        conn.commit()
+        print('Determined {0} range presence value : '.format(str(end_year) + version) + str(datetime.now() - time1))
+    except Exception as e:
+        print(e)
+'''
+# ------------------------------------------------------- Fill out season codes
+def assign_code(season, period, periods, conn, cursor):
+    """
+    Fills out values in the presence or season column
+
+    PARAMETERS
+    ----------
+    period : tuple
+        The time period
+    """
+    from datetime import datetime
+    start_year = str(period[0])
+    end_year = str(period[1])
+
+    season_dict = {"Y": "year_round", "S": "summer", "W": "winter",
+                   "P": "presence", "presence": "presence"}
+    season = season_dict[season]
+
+    # Identify previous season column
+    if periods.index(period) > 0:
+        previous_season = str(periods[periods.index(period) - 1][1])
+    else:
+        previous_season = "2001v1"
+
+    # Fill out new presence column
+    time1 = datetime.now()
+
+    # ----------------------  PASS 1  --------------------------
+    # NOTE: The order of these statements matters and reflects their rank
+    if period == periods[0]:
+        if season == "presence":
+            sql = """
+            /* Add columns */
+            ALTER TABLE presence ADD COLUMN presence_{0} INT;
+
+            /* --------------------------- 2001v1 ---------------------------*/
+            /* If a 2001v1 code exists, use that as a start */
+            UPDATE presence SET presence_{0} = presence_2001v1;
+
+            /* Old legend values 1,2,3 become new legend value 3 */
+            UPDATE presence SET presence_{0} = 3 WHERE presence_{0} in (1,2,3);
+
+            /* Old legend values 4,5 become new legend value 4 */
+            UPDATE presence SET presence_{0} = 4 WHERE presence_{0} in (4,5);
+            """.format(str(end_year))
+        
+        # Year-round  
+        if season == "year_round":
+            sql = """
+            /* Add column */
+            ALTER TABLE year_round ADD COLUMN year_round_{0} INT;
+
+            /* If a 2001v1 code exists, use that as a start */
+            UPDATE year_round SET year_round_{0} = year_round_2001v1;
+
+            /* ----------------------- 2001v1 ---------------------------*/
+            /* Old legend value 1 become new legend value 3 */
+            UPDATE year_round SET year_round_{0} = 3 
+                WHERE year_round_2001v1 = 1;
+            """.format(str(end_year))
+        
+        # Summer  
+        if season == "summer":
+            sql = """
+            /* Add column */
+            ALTER TABLE summer ADD COLUMN summer_{0} INT;
+
+            /* If a 2001v1 code exists, use that as a start */
+            UPDATE summer SET summer_{0} = summer_2001v1;
+
+            /* ----------------------- 2001v1 ---------------------------*/
+            /* Old legend value 1 or 4 become new legend value 3 */
+            UPDATE summer SET summer_{0} = 3 
+                WHERE summer_2001v1 = 1 
+                OR summer_2001v1 = 4;
+            """.format(str(end_year))
+
+        # Winter  
+        if season == "winter":
+            sql = """
+            /* Add column */
+            ALTER TABLE winter ADD COLUMN winter_{0} INT;
+
+            /* If a 2001v1 code exists, use that as a start */
+            UPDATE winter SET winter_{0} = winter_2001v1;
+
+            /* ----------------------- 2001v1 ---------------------------*/
+            /* Old legend value 3 or 1 become new legend value 3 */
+            UPDATE winter SET winter_{0} = 3 
+                WHERE winter_2001v1 = 1 
+                OR winter_2001v1 = 3;
+            """.format(str(end_year))
+
+        try:
+            cursor.executescript(sql)
+            conn.commit()
+            print('Added {1} column for {0}: '.format(str(end_year), season) + str(datetime.now() - time1))
+        except Exception as e:
+            print(e)
+             
+    if period != periods[0]:
+        sql = """
+        /* Add columns */
+        ALTER TABLE {2} ADD COLUMN {2}_{0} INT;
+
+        /* -------------------- Previous Period Code ------------------------*/
+        /* If coded as documented in previous time step, code as 3 */
+        UPDATE {2} SET {2}_{0} = 3 WHERE {2}_{1} = 1;
+
+        /* If coded as likely present or range in previous time step, code as 2 */
+        UPDATE {2} SET {2}_{0} = 2 WHERE {2}_{1} = 2;
+
+        /* If coded as suspected present or range in previous time step, code as 3 */
+        UPDATE {2} SET {2}_{0} = 3 WHERE {2}_{1} = 3;
+
+        /* If coded as suspected absent or non-range in previous time step, code as 4 */
+        UPDATE {2} SET {2}_{0} = 4 WHERE {2}_{1} = 4;
+
+        /* If coded as likely absent or non-range in previous time step, code as 5 */
+        UPDATE {2} SET {2}_{0} = 5 WHERE {2}_{1} = 5;
+        """.format(str(end_year), previous_season, season)
+        try:
+            cursor.executescript(sql)
+            conn.commit()
+            print('Added {1} column for {0}: '.format(str(end_year), season) + str(datetime.now() - time1))
+        except Exception as e:
+            print(e)
+
+    sql="""   
+    /* --------------------------- Opinion ----------------------------------*/
+    /* If opinion with any score exists, but all else in null base the presence
+       on it.*/
+    /*Suspected present*/
+    UPDATE {2} SET {2}_{0} = 3 WHERE opinion_{0} = 1
+                                         AND {2}_2001v1 IS NULL
+                                         AND {2}_{1} IS NULL
+                                         AND documented_{0} IS NULL;
+
+    /*Suspected absent*/
+    UPDATE {2} SET {2}_{0} = 4 WHERE opinion_{0} = 0
+                                         AND {2}_2001v1 IS NULL
+                                         AND {2}_{1} IS NULL
+                                         AND documented_{0} IS NULL;
+
+    /* If opinion with a high enough score exists, use it to overwrite null
+       values and codes from previous periods (including 2001v1)*/
+    /*Suspected present*/
+    UPDATE {2}
+    SET {2}_{0} = 3 WHERE opinion_{0} = 1 AND opinion_{0}_weight > 2.0;
+
+    /*Suspected absent*/
+    UPDATE {2}
+    SET {2}_{0} = 4 WHERE opinion_{0} = 0 AND opinion_{0}_weight > 2.0;
+
+    /*Likely present*/
+    UPDATE {2}
+    SET {2}_{0} = 2 WHERE opinion_{0} = 1 AND opinion_{0}_weight > 8.0;
+
+    /*Likely absent*/
+    UPDATE {2}
+    SET {2}_{0} = 5 WHERE opinion_{0} = 0 AND opinion_{0}_weight > 8.0;
+
+    /* ----------------------- Occurrence Records ---------------------------*/
+    /* If documented, code as 1 */
+    UPDATE {2} SET {2}_{0} = 1 WHERE documented_{0}=1;
+
+    """.format(str(end_year), previous_season, season)
+    try:
+        cursor.executescript(sql)
+        conn.commit()
+        print('Determined {0} range value : '.format(str(end_year)) + str(datetime.now() - time1))
+    except Exception as e:
+        print(e)
+
+# ---------------------------------------------------------- Flag extralimitals
+def flag_extralimitals(season, period, conn, cursor, limit_distance=40000):
+    """
+    Finds and flags spatial units with documented presence due to occurrence
+    records of extralimital individuals.
+
+    Identifies spatial units with documented presence that likely came from 
+    extralimital individuals, such as vagrants.  Identifies such units in a 
+    column. Extralimitals are defined by only being documented in one time 
+    period AND being located more than a set distance from another unit that 
+    is coded within the time period being assessed.  This assessment is done on
+    a per-period basis because range limits can change over time periods.
+
+    The general strategy for this task is to create 3 geodataframes.  One is 
+    all the records with a present code for the time period.  The others are 
+    subsets of that one. gdf2 is only records from the first that also don't 
+    have documented in any other presence-time period column.  gdf3 is records
+    from the first geodataframe that aren't in the gdf2.  The extralimitals are
+    a subset of gdf2 that also don't have any "nearby" neighbors. Potential 
+    neighbors are units from gdf3, so nearest neighbors from gdf3 for each 
+    record in gdf2 is computed with a cKDTree.  Polygons are treated as points 
+    for this so it is all approximate. 
+
+    PARAMETERS
+    ----------
+    period : tuple
+        The time period
+    conn : conn 
+        Sqlite connections with spatialite enabled
+    cursor : cursor object
+    limit_distance : integer
+        Maximum distance (m) that a unit can be from another non-documented
+        presence unit before it gets classified as extralimital.
+    """
+    import geopandas as gpd
+    import numpy as np
+    from scipy.spatial import cKDTree
+    import pandas as pd
+    from datetime import datetime
+    
+    time1 = datetime.now()
+    year = str(period[1])
+
+    season_dict = {"Y": "year_round", "S": "summer", "W": "winter",
+                   "P": "presence", "presence": "presence"}
+    season = season_dict[season]
+
+    try:
+        # Geodataframe of present (values 1,2,or3) in the time period ---------
+        # Use the centroids of polygons
+        sql = """SELECT strHUC12RNG, 
+                        ST_AsBinary(ST_Centroid(geom_5070)) AS geometry  
+                FROM {1}
+                WHERE {1}_{0} in (1,2,3);
+                """.format(year, season)
+        gdf1 = gpd.GeoDataFrame.from_postgis(sql, conn, geom_col='geometry', 
+                                             crs=5070, index_col='strHUC12RNG')
+        conn.commit()
+
+        # Geodataframe of hucs with only one period as documented -------------
+        dfD = pd.read_sql("""SELECT * 
+                            FROM {1}
+                            WHERE {1}_{0} = 1;""".format(year, season),
+                            conn)
+        
+        # Drop excess columns 
+        doc_cols = [x for x in list(dfD.columns) if "documented_2" in x] + ["strHUC12RNG"]
+        dfD2 = dfD[doc_cols].set_index("strHUC12RNG")
+        
+        # Select rows with only one documented period
+        dfD3 = dfD2.sum(axis=1)
+        df_doc1 = pd.DataFrame(dfD3[(dfD3 < 2) & (dfD3 > 0)])
+        
+        # Merge back with first geodatabase to make a geodataframe
+        gdf2 = gdf1.merge(df_doc1, how='inner', left_index=True, 
+                          right_index=True).drop([0], axis=1)
+        
+        # Presence geodataframe, but without single-period documented records -----
+        gdf3 = gdf1[~gdf1.index.isin(list(gdf2.index))]
+        
+        # Calculate distance between documented and nearest presence neighbor -----
+        # Rename for ease of interpretation, and set index
+        gdA = gdf2.reset_index() # potential vagrant
+        gdB = gdf3.reset_index() # all presence
+
+        # Point geometries as arrays
+        nA = np.array(list(gdA.geometry.apply(lambda x: (x.x, x.y))),
+                      dtype="float64")
+        nB = np.array(list(gdB.geometry.apply(lambda x: (x.x, x.y))),
+                      dtype="float64")
+        
+        # Build a cKDTree for fast lookup/indexing
+        if len(nB) > 1 and len(nA) > 1:
+            btree = cKDTree(nB)
+            
+            # Make geodataframe with nearest neighbor distances for gdf2 
+            dist, idx = btree.query(nA, k=1)
+            
+            gdB_nearest = gdB.iloc[idx].drop(columns="geometry").reset_index(drop=True)
+            gdB_nearest.rename({"strHUC12RNG": "nearest_neighbor"}, 
+                                axis=1, inplace=True)
+            gdf = pd.concat(
+                [
+                    gdA.reset_index(drop=True),
+                    gdB_nearest,
+                    pd.Series(dist, name='dist')
+                ],
+                axis=1)
+            
+            # Select records with distance above the cutoff
+            outdf = gdf[gdf["dist"] > limit_distance]
+            change_units = str(tuple(outdf['strHUC12RNG']))
+        
+        else:
+            outdf = pd.DataFrame()
+
+        # Set extralimital column values ------------------------------------------
+        # Add columns
+        try:
+            sql = """ALTER TABLE {1} ADD COLUMN extralimital_{0} INT;
+                  """.format(year, season)
+            cursor.execute(sql)
+        except Exception as e:
+            print(e)
+        
+        if len(outdf) == 1:
+            sql = """UPDATE {2}
+                     SET extralimital_{0} = 1
+                     WHERE strHUC12RNG = '{1}';
+                     """.format(year, outdf.iloc[0]['strHUC12RNG'], season)
+            cursor.executescript(sql)
+        
+        elif len(outdf) > 1:
+            cursor.executescript("""                          
+                            UPDATE {2}
+                            SET extralimital_{0} = 1
+                            WHERE strHUC12RNG IN {1};""".format(year,
+                                                                change_units,
+                                                                season))
+        
+        else:
+            pass
+
+        conn.commit()
+
+        print('Flagged {0} extralimitals : '.format(year)  + str(datetime.now() - time1))
+
+    except Exception as e:
+        print(e)
+
+# ------------------------------------------------------------ Code adjustments
+def adjust_code(season, periods, period, conn, cursor):
+    """
+    Adjusts the code of spatial units according to logical rules.  
+    Refines/corrects codes assigned by assign_code().
+
+    - Value is changed to suspected absent for extralimital spatial units
+        in the period after documented present.
+
+    PARAMETERS
+    ----------
+    period : tuple
+        The time period
+    conn : conn 
+        Sqlite connections with spatialite enabled
+    cursor : cursor object
+    """
+    from datetime import datetime
+    time1 = datetime.now()
+
+    season_dict = {"Y": "year_round", "S": "summer", "W": "winter",
+                   "P": "presence", "presence": "presence"}
+    season = season_dict[season]
+
+    # Determine previous and subsequent years ---------------------------------
+    year = period[1]
+    if period != periods[0]:
+        previous_year = periods[periods.index(period) - 1][1]
+    else:
+        previous_year = None
+    
+    if period != periods[-1]:
+        subsequent_year = periods[periods.index(period) + 1][1]
+    else:
+        subsequent_year = None
+
+    # Cases where code should be set to suspected present ---------------------
+    # Surrounded by documented periods -> set to likely present
+    if period != periods[0] and period != periods[-1]:
+        try:
+            sql="""
+            UPDATE {3} SET {3}_{0} = 2
+            WHERE {3}_{1} = 1
+            AND {3}_{2} = 1
+            AND opinion_{0}_weight > 2.0;
+            """.format(year, previous_year, subsequent_year, season)
+            cursor.executescript(sql)
+            conn.commit()
+        except Exception as e:
+            print(e)
+
+    # Cases where code should be set to suspected absent ----------------------
+    # Is flagged extralimital & was documented last period -> suspected absent
+    try:
+        # Build text for and condition with all period-extralimital columns
+        and_clause = "(extralimital_{0} = 1".format(str(periods[0][1]))
+        for period in periods[1:]:
+            year_ = period[1]
+            and_clause = and_clause + " OR extralimital_{0} = 1".format(year_)
+        and_clause = and_clause + ")"
+
+        sql="""
+        UPDATE {2} SET {2}_{0} = 4
+        WHERE {2}_{0} != 1
+        AND opinion_{0}_weight IS NULL
+        AND {1};
+        """.format(year, and_clause, season)
+
+        cursor.executescript(sql)
+        conn.commit()
+    except Exception as e:
+        print(e)
+
+    # Extralimitals and range -------------------------------------------------
+    # Is flagged extralimital -> suspected absent if not the presence map/season
+    if season != "presence":
+        try:
+            sql=f"""
+            UPDATE {season} SET {season}_{year} = 4
+            WHERE {season}_{year} = 1
+            AND extralimital_{year} = 1;
+            """
+            cursor.executescript(sql)
+            conn.commit()
+            print('Adjusted {0} range value : '.format(year) + str(datetime.now() - time1))
+        except Exception as e:
+            print(e)
+
+# -------------------------------------------------------- Years since a record
+def last_record(task_id, gap_id, task_db, parameters_db, workDir, codeDir,
+                grid_db):
+    """
+    Calculate weeks since a record for each spatial unit, as well as the
+        weight of the last record.  Uses the record_attributions table made
+        by attribute_records().  Returns False if the last_record table
+        couldn't be filled out.
+    """
+    import sqlite3
+    from datetime import datetime
+    time0 = datetime.now()
+
+    cursor, conn = spatialite()
+
+    cursor.executescript("""/*Attach databases*/
+                            ATTACH DATABASE '{0}' AS params;
+                            ATTACH DATABASE '{1}' AS shucs;
+                            ATTACH DATABASE '{2}' AS eval;
+                         """.format(parameters_db, grid_db, task_db))
+
+    # Get the attributions of all records ------------------------------------
+    time1 = datetime.now()
+    sql="""
+    CREATE TABLE big_nuff_all AS SELECT HUC12RNG, record_id, eventDate,
+                                        weight, proportion_circle
+                                 FROM record_attributions;
+    """
+    try:
+        cursor.executescript(sql)
+        conn.commit()
+        print("Selected attributions of all records: " + str(datetime.now()-time1))
+    except Exception as e:
+        print("!!! FAILED to select attributions of all records: {0}".format(str(datetime.now()-time1)))
+        print(e)
+        conn.close()
+        return False
+
+    sql="""
+    /* Add columns */
+    ALTER TABLE big_nuff_all ADD COLUMN age_in_weeks INT;
+    ALTER TABLE big_nuff_all ADD COLUMN date_assessed INT;
+
+    /* Fill out the days date */
+    UPDATE big_nuff_all SET date_assessed = strftime('%Y-%m-%d','now');
+
+    /* Calculate weeks since record */
+    UPDATE big_nuff_all
+    SET age_in_weeks = (JULIANDAY(date_assessed) - JULIANDAY(eventDate) + 1)/7;
+    """
+    try:
+        cursor.executescript(sql)
+        conn.commit()
+        print('Added date assessed and age of records : ' + str(datetime.now() - time0))
+    except Exception as e:
+        print(e)
+        conn.close()
+        return False
+
+    sql="""
+    /* Choose first in a group by HUC12RNG */
+    INSERT INTO eval.last_record SELECT p.strHUC12RNG, bna.record_id,
+                                        bna.eventDate, bna.weight,
+                                        bna.proportion_circle as proportion_overlap,
+                                        MIN(bna.age_in_weeks) as age_in_weeks,
+                                        bna.date_assessed, p.geom_5070
+                                 FROM big_nuff_all as bna
+                                 LEFT JOIN presence as p
+                                     ON p.strHUC12RNG = bna.HUC12RNG
+        				         GROUP BY p.strHUC12RNG;
+    """
+    try:
+        cursor.executescript(sql)
+        conn.commit()
+        conn.close()
+        del cursor
+        print('Filled out last_record table : ' + str(datetime.now() - time0))
+    except Exception as e:
+        print(e)
+        conn.close()
+        return False
+
+    sql = """
+    SELECT RecoverGeometryColumn('last_record', 'geom_5070', 5070, 'POLYGON', 'XY');
+
+    SELECT CreateSpatialIndex('last_record', 'geom_5070');
+
+    /* Update layer statistics or else not all columns will show up in QGIS */
+    SELECT UpdateLayerStatistics('last_record');
+    """
+    try:
+        cursor, conn = spatialite(task_db)
+        cursor.executescript(sql)
+        conn.commit()
+        conn.close()
+        del cursor
+        print('Reinstate last_record geometry : ' + str(datetime.now() - time0))
+    except Exception as e:
+        print(e)
+
+# -------------------------------------------------- Get opinions for a period
+def period_opinions(season, start_year, end_year, cursor):
+    """
+    Gets the most recent opinion for each huc during a period.
+
+    PARAMETERS
+    ----------
+    season : string like "presence", "summer", "winter" or "year_round"
+    start_year : integer
+    end_year : integer
+    cursor : cursor of a connection with the task database attached
+
+    RETURNS
+    -------
+    opinions : list of (strHUC12RNG, status, weight) tuples for the period
+    hucs : list of every huc with an opinion for the season, in any year
+    """
+    from datetime import datetime
+
+    time1 = datetime.now()
+    try:
+        opinions = cursor.execute("""
+            SELECT strHUC12RNG, status, weight
+            FROM (SELECT MAX(ROWID), strHUC12RNG, status_adjusted AS status,
+                         weight_adjusted AS weight
+                  FROM opinions
+                  WHERE year BETWEEN {0} AND {1}
+                  AND season = '{2}'
+                  GROUP BY strHUC12RNG);
+            """.format(str(start_year), str(end_year), season)).fetchall()
+        hucs = [x[0] for x in cursor.execute("""
+                    SELECT DISTINCT strHUC12RNG FROM opinions
+                    WHERE season = '{0}';""".format(season)).fetchall()]
+        print('Got most recent opinions between ({0}-{1}): '.format(str(start_year), str(end_year)) + str(datetime.now() - time1))
+        return opinions, hucs
+    except Exception as e:
+        print(e)
+        print("!!!period_opinions!!!", end_year)
+        return [], []
+
+# --------------------------------------------------- Put opinion into a column
+def opinion_column(season, end_year, opinions, cursor, hucs=None):
+    """
+    Adds columns for the most recent opinion in a period and its weight.
+    Runs on the task database writer (see write_results()) and doesn't
+    commit.
+
+    PARAMETERS
+    ----------
+    season : string like "presence", "summer", "winter" or "year_round"
+    end_year : integer
+    opinions : list of (strHUC12RNG, status, weight) tuples from
+        period_opinions(), or None to add empty columns
+    cursor : cursor of the task database
+    hucs : list of HUC12RNG codes.  If given, the columns already exist and
+        only the opinions of these hucs are filled in again (see
+        recompile_hucs()).
+    """
+    if hucs is None:
+        cursor.execute("""ALTER TABLE {1} ADD COLUMN opinion_{0} TEXT;
+                       """.format(str(end_year), season))
+        cursor.execute("""ALTER TABLE {1} ADD COLUMN opinion_{0}_weight REAL;
+                       """.format(str(end_year), season))
+    else:
+        cursor.executemany("""UPDATE {1}
+                              SET opinion_{0} = NULL, opinion_{0}_weight = NULL
+                              WHERE strHUC12RNG = ?;
+                           """.format(str(end_year), season),
+                           [(x,) for x in hucs])
+        if opinions is not None:
+            selected = set(hucs)
+            opinions = [x for x in opinions if x[0] in selected]
+    if opinions is None:
+        return
+
+    cursor.executemany("""UPDATE {1}
+                          SET opinion_{0} = ?, opinion_{0}_weight = ?
+                          WHERE strHUC12RNG = ?;
+                       """.format(str(end_year), season),
+                       [(status, weight, huc) for huc, status, weight in opinions])
+    cursor.execute("""UPDATE {1} SET opinion_{0} = 0
+                      WHERE opinion_{0} = "absent";
+                   """.format(str(end_year), season))
+    cursor.execute("""UPDATE {1} SET opinion_{0} = 1
+                      WHERE opinion_{0} = "present";
+                   """.format(str(end_year), season))
+
+# ------------------------------------------------------------- Fill geometries
+def fill_new_geometries(season, conn, cursor, grid_db):
+    """
+    Fill in geometries for newly added subregions
+
+    PARAMETERS
+    ----------
+    grid_db : string
+        Path to the grid sqlite database
+    """
+    
+    season_dict = {"Y": "year_round", "S": "summer", "W": "winter",
+                   "P": "presence", "presence": "presence"}
+    season = season_dict[season]
+    
+    # The grid may already be attached to a connection that is reused
+    attached = [x[1] for x in cursor.execute("PRAGMA database_list;").fetchall()]
+    if "shucs" not in attached:
+        cursor.execute("ATTACH DATABASE '{0}' AS shucs;".format(grid_db))
+
+    sql = """
+    UPDATE {1}
+    SET geom_5070 = (SELECT geom_5070 FROM huc12rng_gap_polygon
+                     WHERE strHUC12RNG = huc12rng_gap_polygon.HUC12RNG)
+    WHERE geom_5070 IS NULL;
+
+    /*SELECT RecoverGeometryColumn('{1}', 'geom_5070', 5070, 'POLYGON', 'XY');*/
+
+    /*UPDATE {1}
+    SET geom_4326 = Transform(geom_5070, 4326)
+    WHERE geom_4326 IS NULL;*/
+    """.format(grid_db, season)
+    try:
+        cursor.executescript(sql)
+        conn.commit()
+        print("Filled out empty geometry columns")
+    except Exception as e:
+        print(e)
+
+# ------------------------------------------------------- Compile worker pool
+_worker = {}
+
+def _init_worker(parameters_db, grid_db, task_db, template_db):
+    """
+    Prepares a process of the compile pool.  The in-memory database, a copy
+    of the spatial metadata template with the parameters, grid, and task
+    databases attached, is kept in _worker and reused by every task the
+    process runs.
+    """
+    cursor, conn = spatialite(template=template_db)
+    cursor.executescript("""/*Attach databases*/
+                            ATTACH DATABASE '{0}' AS params;
+                            ATTACH DATABASE '{1}' AS shucs;
+                            ATTACH DATABASE '{2}' AS eval;
+                            """.format(parameters_db, grid_db, task_db))
+    _worker.update({"cursor": cursor, "conn": conn})
+
+def compile_pool(parameters_db, grid_db, task_db, template_db, n_workers):
+    """
+    Starts a pool of worker processes that is used for presence and every
+    season.  Each process sets up its database connection once (see
+    _init_worker()), so tasks like compile_presence() and compile() start
+    without loading spatialite or attaching databases.  Workers only read
+    from the task database, their results are written by the task database
+    writer (see task_db_writer()).
+
+    PARAMETERS
+    ----------
+    parameters_db : string
+        Path to the parameters database
+    grid_db : string
+        Path to the grid sqlite database
+    task_db : string
+        Path to the task database
+    template_db : string
+        Path to the spatial metadata template (see spatial_template())
+    n_workers : integer
+        Number of worker processes
+
+    RETURNS
+    -------
+    pool : multiprocessing Pool
+    """
+    import multiprocessing as mp
+    # Spawned, since this runs in a stage thread (see run_stages())
+    spawn = mp.get_context("spawn")
+    return spawn.Pool(processes=n_workers, initializer=_init_worker,
+                      initargs=(parameters_db, grid_db, task_db, template_db))
+
+# ------------------------------------------------------- Task database writer
+_writer = {}
+
+def _init_writer(task_db):
+    """
+    Prepares the task database writer process.  Its connection to the task
+    database is kept in _writer and used by every task it runs.
+    """
+    cursor, conn = spatialite(task_db)
+    cursor.execute("""CREATE TABLE IF NOT EXISTS huc_weights (season TEXT,
+                                                             era TEXT,
+                                                             start_year INTEGER,
+                                                             end_year INTEGER,
+                                                             HUC12RNG TEXT,
+                                                             weight INTEGER);""")
+    conn.commit()
+    _writer.update({"cursor": cursor, "conn": conn})
+
+def task_db_writer(task_db):
+    """
+    Starts a single process that makes every change to the task database
+    during compilation of presence and seasons.  Tasks sent to it with
+    apply() run one at a time, so writes never wait on each other, and the
+    results of each season are written in one transaction (see
+    write_results()).
+
+    PARAMETERS
+    ----------
+    task_db : string
+        Path to the task database
+
+    RETURNS
+    -------
+    writer : multiprocessing Pool with one process
+    """
+    import multiprocessing as mp
+    # Spawned, since this runs in a stage thread (see run_stages())
+    spawn = mp.get_context("spawn")
+    return spawn.Pool(processes=1, initializer=_init_writer, initargs=(task_db,))
+
+def write_results(results, use_observations):
+    """
+    Writes the results of compile_presence() or compile() for every period
+    and era of a season to the task database in one transaction: new rows
+    for hucs, summed weights, documented columns, and opinion columns.  If
+    anything fails, the whole transaction is rolled back so the season's
+    table is never left half-written.  Runs on the task database writer.
+
+    PARAMETERS
+    ----------
+    results : list of dictionaries from compile_presence() or compile()
+    use_observations : boolean
+
+    RETURNS
+    -------
+    written : boolean, False if the transaction was rolled back
+    """
+    from datetime import datetime
+    time1 = datetime.now()
+    cursor, conn = _writer["cursor"], _writer["conn"]
+
+    try:
+        cursor.execute("BEGIN;")
+
+        # Start from the table make_range_db() made, in case an interrupted
+        # run wrote to it
+        clear_season(results[0]["season"], cursor)
+        for result in results:
+            season, era = result["season"], result["era"]
+            start_year, end_year = result["period"]
+
+            # Add new range subregions and a summed weight column
+            if result["weights"] is not None:
+                new_subregions(season, [x[0] for x in result["weights"]],
+                               cursor)
+                save_weights(season, era, start_year, end_year,
+                             result["weights"], cursor)
+
+            # Document sufficient evidence
+            set_documented(season, era, cursor, end_year, start_year,
+                           use_observations)
+
+            # Add opinion columns and rows for hucs with opinions
+            if era == 'recent':
+                new_subregions(season, result["opinion_hucs"], cursor)
+                opinion_column(season, end_year, result["opinions"], cursor)
+        conn.commit()
+        print("Wrote {0} results for {1}: ".format(len(results), season) + str(datetime.now() - time1))
+        return True
+    except Exception as e:
+        conn.rollback()
+        print("!! FAILED to write results, rolled back: " + str(datetime.now() - time1))
+        print(e)
+        return False
+
+# ------------------------------------------------------------ Compile presence
+def compile_presence(period, era, use_observations, use_opinions):
+    """
+    Runs other functions to compile presence codes for a time period.  Runs
+    in a process of the compile pool (see compile_pool()) and only reads
+    from the task database.
+
+    RETURNS
+    -------
+    results : dictionary of results to write with write_results()
+    """
+    return compile("presence", period, era, use_observations, use_opinions)
+
+# ------------------------------------------------------ Compile seasonal range
+def compile(season, period, era, use_observations, use_opinions):
+    """
+    Compiles a seasonal range map.  The only difference between year round range and presence is 
+    the inclusion of extralimital presence in presence?  Runs in a process of
+    the compile pool (see compile_pool()) and only reads from the task
+    database.
+
+    PARAMETERS
+    ----------
+    season : like "S" or "W" or "Y"
+    periods : the tuple of time periods to compile for.
+
+    RETURNS
+    -------
+    results : dictionary with the season's table name ("season"), "period",
+        "era", summed weights for each huc ("weights", None without
+        observations), and opinions for the period ("opinions", None without
+        opinions) and hucs with opinions ("opinion_hucs") for the recent era.
+        Written by write_results().
+    """
+    cursor, conn = _worker["cursor"], _worker["conn"]
+
+    season_dict = {"Y": "year_round", "S": "summer", "W": "winter",
+                   "P": "presence", "presence": "presence"}
+    season = season_dict[season]
+
+    start_year = str(period[0])
+    end_year = str(period[1])
+    results = {"season": season, "period": period, "era": era,
+               "weights": None, "opinions": None, "opinion_hucs": []}
+
+    # Get the appropriate records and sum their weights -----------------------
+    if use_observations:
+        get_attributions(start_year, end_year, conn, cursor, era, season)
+        results["weights"] = calculate_weight(era, end_year, cursor)
+
+    # Get opinions ------------------------------------------------------------
+    if era == 'recent' and use_opinions:
+        opinions, opinion_hucs = period_opinions(season, start_year, end_year,
+                                                 cursor)
+        results["opinions"], results["opinion_hucs"] = opinions, opinion_hucs
+
+    # Clear the worker database for the next task
+    cursor.execute("DROP TABLE IF EXISTS big_nuff_{0};".format(era))
+    conn.commit()
+    return results
+
+# ------------------------------------------------ Finish codes for a season
+def finish_season(season, periods, grid_db, extralimital_m):
+    """
+    Assigns codes for each period, fills in new geometries, flags
+    extralimitals, and adjusts codes for presence or a season once all of its
+    periods and eras have been written.  Runs in a process of the compile
+    pool (see compile_pool()) on a copy of the season's table in the
+    worker's in-memory database, so that seasons are derived at the same
+    time.  Only the finished columns are written to the task database, by
+    write_codes() on the task database writer.
+
+    PARAMETERS
+    ----------
+    season : string
+        "presence" or a season code like "S", "W", or "Y"
+    periods : the tuple of time periods to compile for.
+    grid_db : string
+        Path to the grid sqlite database
+    extralimital_m : number
+        Limit distance for flag_extralimitals(), in meters
+
+    RETURNS
+    -------
+    codes : dictionary with the season's table name ("season"), its code and
+        extralimital columns ("columns"), and a (strHUC12RNG, column values)
+        row for each huc ("rows"), or None if a column is missing
+    """
+    cursor, conn = _worker["cursor"], _worker["conn"]
+    table = {"Y": "year_round", "S": "summer", "W": "winter",
+             "P": "presence", "presence": "presence"}[season]
+
+    # The copy shadows the task database's table for the functions below
+    cursor.executescript("""DROP TABLE IF EXISTS main.{0};
+                            CREATE TABLE main.{0} AS SELECT * FROM eval.{0};
+                         """.format(table))
+    conn.commit()
+
+    # Assess values and determine presence code for the period
+    for period in periods:
+        assign_code(season, period, periods, conn, cursor)
+
+    # Fill in new geometries
+    fill_new_geometries(season, conn, cursor, grid_db)
+
+    # Flag spatial units that are likely beyond the range limit
+    for period in periods:
+        flag_extralimitals(season, period, conn, cursor,
+                           limit_distance=extralimital_m)
+
+    # Adjust each presence code in light of extralimitals, proximity etc.
+    for period in periods:
+        adjust_code(season, periods, period, conn, cursor)
+
+    # Errors above are only printed, so make sure every column is there
+    codes = [x for period in periods
+             for x in ("{0}_{1}".format(table, period[1]),
+                       "extralimital_{0}".format(period[1]))]
+    columns = [x[1] for x in cursor.execute("PRAGMA main.table_info({0});".format(table))]
+    missing = [x for x in codes if x not in columns]
+    rows = None
+    if missing:
+        print("!! FAILED to add {0} columns: {1}".format(table, ", ".join(missing)))
+    else:
+        # In the order they were added
+        codes = [x for x in columns if x in codes]
+        rows = cursor.execute("SELECT strHUC12RNG, {1} FROM main.{0};".format(table, ", ".join(codes))).fetchall()
+    cursor.execute("DROP TABLE main.{0};".format(table))
+    conn.commit()
+    if rows is None:
+        return None
+    return {"season": table, "columns": codes, "rows": rows}
+
+def write_codes(season, grid_db, codes):
+    """
+    Fills in the geometries of hucs that are new to a season's table, then
+    writes the codes and extralimital flags from finish_season() to it in
+    one transaction.  Runs on the task database writer.
+
+    PARAMETERS
+    ----------
+    season : string
+        "presence" or a season code like "S", "W", or "Y"
+    grid_db : string
+        Path to the grid sqlite database
+    codes : dictionary from finish_season()
+
+    RETURNS
+    -------
+    written : boolean, False if the transaction was rolled back
+    """
+    from datetime import datetime
+    time1 = datetime.now()
+    cursor, conn = _writer["cursor"], _writer["conn"]
+    table, columns = codes["season"], codes["columns"]
+
+    fill_new_geometries(season, conn, cursor, grid_db)
+    try:
+        cursor.execute("BEGIN;")
+        for column in columns:
+            cursor.execute("ALTER TABLE {0} ADD COLUMN {1} INT;".format(table, column))
+        cursor.executemany("""UPDATE {0} SET {1} WHERE strHUC12RNG = ?;
+                           """.format(table, ", ".join(x + " = ?" for x in columns)),
+                           [row[1:] + row[:1] for row in codes["rows"]])
+        conn.commit()
+        print("Wrote {0} codes: ".format(table) + str(datetime.now() - time1))
+        return True
+    except Exception as e:
+        conn.rollback()
+        print("!! FAILED to write {0} codes, rolled back: ".format(table) + str(datetime.now() - time1))
+        print(e)
+        return False
+
+# ------------------------------------------- Compile presence or a season
+def compile_season(season, periods, pool, writer, grid_db, use_observations,
+                   use_opinions, extralimital_m):
+    """
+    Compiles presence or a season: each period and era with
+    compile_presence() or compile() on the compile pool, write_results() on
+    the task database writer, codes with finish_season() on the compile
+    pool, and write_codes() on the writer.  Seasons do not depend on each
+    other or on presence, so this can be run for each of them at once from
+    separate threads.  Only the two writes of each season wait their turn
+    on the writer.
+
+    PARAMETERS
+    ----------
+    season : string
+        "presence" or a season code like "S", "W", or "Y"
+    periods : the tuple of time periods to compile for.
+    pool : multiprocessing Pool from compile_pool()
+    writer : multiprocessing Pool from task_db_writer()
+    grid_db : string
+        Path to the grid sqlite database
+    use_observations : boolean
+    use_opinions : boolean
+    extralimital_m : number
+        Limit distance for flag_extralimitals(), in meters
+    """
+    from datetime import datetime
+    time0 = datetime.now()
+
+    # Compile each period and era
+    if season == "presence":
+        results = pool.starmap(compile_presence,
+                               [(period, era, use_observations, use_opinions)
+                                for period in periods
+                                for era in ['recent', 'historical']])
+    else:
+        results = pool.starmap(compile,
+                               [(season, period, era, use_observations,
+                                 use_opinions)
+                                for period in periods
+                                for era in ['recent', 'historical']])
+
+    # Write the results, then assign and adjust codes and write them
+    if not writer.apply(write_results, (results, use_observations)):
+        raise RuntimeError("results for {0} were not written".format(season))
+    codes = pool.apply(finish_season, (season, periods, grid_db, extralimital_m))
+    if codes is None:
+        raise RuntimeError("codes for {0} were not assigned".format(season))
+    if not writer.apply(write_codes, (season, grid_db, codes)):
+        raise RuntimeError("codes for {0} were not written".format(season))
+    print("Compiled {0}: ".format(season) + str(datetime.now() - time0))
+
+# ---------------------------------------------------------- Input fingerprints
+def file_fingerprint(path):
+    """
+    Fingerprints the contents of a file, such as a wrangler or grid database,
+    for run_stages().  Reads the whole file.
+
+    PARAMETERS
+    ----------
+    path : string
+        Path to the file
+
+    RETURNS
+    -------
+    fingerprint : string, or None if the file doesn't exist
+    """
+    import hashlib
+    if not os.path.exists(path):
+        return None
+    digest = hashlib.sha1()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(2**20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def rows_fingerprint(db, sql, params=()):
+    """
+    Fingerprints the rows that a query returns, for run_stages().
+
+    PARAMETERS
+    ----------
+    db : string
+        Path to the database to query
+    sql : string
+        Query; include an ORDER BY if row order can vary
+    params : parameters for the query
+
+    RETURNS
+    -------
+    fingerprint : string, or None if the query fails
+    """
+    import hashlib
+    try:
+        conn = sqlite3.connect(db)
+        rows = conn.execute(sql, params).fetchall()
+        conn.close()
+    except Exception as e:
+        print(e)
+        return None
+    return hashlib.sha1(repr(rows).encode()).hexdigest()
+
+def opinions_fingerprint(species):
+    """
+    Fingerprints a species' rows in the opinion database's presence and
+    season tables, for run_stages().
+
+    PARAMETERS
+    ----------
+    species : GAP species code
+
+    RETURNS
+    -------
+    fingerprints : list of fingerprints, one per table
+    """
+    return [rows_fingerprint(opinion_db,
+                             """SELECT * FROM {0} WHERE species_code = ?
+                                ORDER BY rowid;""".format(season),
+                             (species,))
+            for season in ['presence', 'summer', 'winter', 'year_round']]
+
+# ------------------------------------------------------------- Stage markers
+# Markers are written from the scheduler's thread while make_range_db()
+# may be rebuilding the task database, so both hold this lock.
+_markers_lock = threading.Lock()
+
+def stage_markers(task_db):
+    """
+    Reads the completion markers of stages that finished in earlier runs
+    from the task database (see run_stages()).
+
+    PARAMETERS
+    ----------
+    task_db : string
+        Path to the task database
+
+    RETURNS
+    -------
+    markers : dictionary of stage name : (fingerprint, result), where result
+        is the JSON text of the stage's return value or None
+    """
+    if not os.path.exists(task_db):
+        return {}
+    try:
+        conn = sqlite3.connect(task_db, timeout=600)
+        markers = {x[0]: (x[1], x[2]) for x in
+                   conn.execute("""SELECT stage, fingerprint, result
+                                   FROM stage_markers;""").fetchall()}
+        conn.close()
+        return markers
+    except Exception:
+        return {}
+
+def save_marker(task_db, name, fingerprint, result):
+    """
+    Records in the task database that a stage finished with inputs that
+    have a fingerprint.  The stage's return value is kept too, as JSON, if it
+    can be.
+
+    PARAMETERS
+    ----------
+    task_db : string
+        Path to the task database
+    name : string
+        Name of the stage
+    fingerprint : string
+        Fingerprint of the stage's inputs, from run_stages()
+    result : the stage's return value
+    """
+    import json
+    try:
+        result = json.dumps(result)
+    except (TypeError, ValueError):
+        result = None
+    with _markers_lock:
+        try:
+            conn = sqlite3.connect(task_db, timeout=600)
+            conn.execute("""CREATE TABLE IF NOT EXISTS stage_markers (
+                                stage TEXT PRIMARY KEY,
+                                fingerprint TEXT,
+                                result TEXT,
+                                finished TEXT);""")
+            conn.execute("""INSERT OR REPLACE INTO stage_markers
+                            VALUES (?, ?, ?, ?);""",
+                         (name, fingerprint, result, str(datetime.now())))
+            conn.commit()
+            conn.close()
+        except Exception as e:
+            print("!! FAILED to save the marker for stage {0}".format(name))
+            print(e)
+
+def reset_stage(task_db, tables=(), columns=(), rows=()):
+    """
+    Removes what an interrupted run of a stage left in the task database, so
+    the stage can be run again on it.
+
+    PARAMETERS
+    ----------
+    task_db : string
+        Path to the task database
+    tables : list of tables the stage makes, which are dropped
+    columns : list of (table, column) that the stage adds, which are dropped
+    rows : list of tables the stage fills, which are emptied
+    """
+    try:
+        cursor, conn = spatialite(task_db)
+        for table in tables:
+            # Spatial tables have metadata and indexes to remove too
+            geometries = cursor.execute("""SELECT f_geometry_column
+                                           FROM geometry_columns
+                                           WHERE f_table_name = LOWER(?);""",
+                                        (table,)).fetchall()
+            for (geometry,) in geometries:
+                cursor.execute("SELECT DiscardGeometryColumn(?, ?);",
+                               (table, geometry))
+                cursor.execute('DROP TABLE IF EXISTS "idx_{0}_{1}";'.format(table, geometry))
+            cursor.execute('DROP TABLE IF EXISTS "{0}";'.format(table))
+        for table, column in columns:
+            existing = [x[1] for x in cursor.execute('PRAGMA table_info("{0}");'.format(table))]
+            if column in existing:
+                cursor.execute('ALTER TABLE "{0}" DROP COLUMN {1};'.format(table, column))
+        for table in rows:
+            cursor.execute('DELETE FROM "{0}";'.format(table))
+        conn.commit()
+        conn.close()
+    except Exception as e:
+        print("!! FAILED to reset {0}".format(", ".join(list(tables) + [".".join(x) for x in columns] + list(rows))))
+        print(e)
+
+# ------------------------------------------------------------ Stage scheduler
+def _run_stage(stage, timings):
+    """
+    Runs a stage for run_stages(), saving its result in stage["result"] and
+    its start and end times in timings.  A stage fails if its function
+    raises or returns False, which stage functions that catch their own
+    errors do.  Failures are printed and the stage is marked with
+    stage["failed"], so run_stages() holds back the stages that depend on it
+    and no marker is saved for it.
+    """
+    from datetime import datetime
+    start = datetime.now()
+    try:
+        stage["result"] = stage["function"]()
+        if stage["result"] is False:
+            stage["failed"] = True
+            print("!! FAILED stage {0}".format(stage["name"]))
+    except Exception as e:
+        stage["failed"] = True
+        print("!! FAILED stage {0}".format(stage["name"]))
+        print(e)
+    timings[stage["name"]] = (start, datetime.now())
+    print("Finished stage {0}: ".format(stage["name"]) + str(timings[stage["name"]][1] - start))
+
+def run_stages(stages, max_workers=None, task_db=None, resume=False):
+    """
+    Runs the stages of a compilation as a directed acyclic graph.  Each stage
+    declares the data that it reads (inputs) and makes (outputs), and it
+    starts as soon as the stages that make its inputs have finished.
+    Independent stages run at once on separate threads.  Inputs that no
+    stage makes are assumed to already exist.
+
+    When a stage finishes without failing (see _run_stage()), a marker with a fingerprint
+    of its inputs is saved in the task database.  The fingerprint covers the
+    stage's "fingerprint" value and the fingerprints of the stages it waited
+    for.  When resuming, a stage is skipped if it has a marker with the same
+    fingerprint and none of the stages it waited for ran again (a stage that
+    always runs only counts as having run again if one of the stages it
+    waited for did).  Otherwise its "reset" function is called first to
+    clear what an interrupted or earlier run left behind.  So resuming after
+    an edit to some inputs only reruns the stages that read them, and the
+    stages after those.
+
+    If a stage fails, the stages that depend on it, directly or not, are not
+    run.  The other stages still run, and the stages that failed or were held
+    back are returned.
+
+    PARAMETERS
+    ----------
+    stages : list of dictionaries with "name", "function" (called without
+        arguments), "inputs", and "outputs" keys.  The function's return
+        value is saved to the dictionary as "result", so later stages can
+        use it.  A function that returns False has failed.  Optional keys are "fingerprint" (any value with a stable
+        repr, describing the stage's inputs), "reset" (called without
+        arguments), and "checkpoint" (False for stages that always run,
+        e.g. ones that start worker pools).
+    max_workers : integer
+        Number of stages that can run at once.  Defaults to the number of
+        stages.
+    task_db : string
+        Path to the task database to keep markers in.  No markers are kept
+        if it is None.
+    resume : boolean
+        Whether to skip stages that finished in an earlier run.
+
+    RETURNS
+    -------
+    timings : dictionary of stage name : (start, end) datetimes
+    depends : dictionary of stage name : list of the stages it waited for
+    failed : list of the stages that failed or weren't run because a stage
+        they depend on failed
+    """
+    import hashlib
+    import json
+    from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+    producers = {}
+    for stage in stages:
+        for output in stage["outputs"]:
+            producers[output] = stage["name"]
+    depends = {stage["name"]: sorted({producers[x] for x in stage["inputs"]
+                                      if x in producers})
+               for stage in stages}
+    stages_by_name = {stage["name"]: stage for stage in stages}
+
+    markers = stage_markers(task_db) if resume and task_db else {}
+    fingerprints = {}
+    # Stages whose outputs may differ from the earlier run's
+    changed = set()
+
+    timings = {}
+    pending = {stage["name"]: stage for stage in stages}
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_workers or len(stages)) as executor:
+        while pending or running:
+            # Skipped stages finish right away, so look for ready stages
+            # until there are no more
+            ready = True
+            while ready:
+                ready = [(name, stage) for name, stage in pending.items()
+                         if all(x in timings and not stages_by_name[x].get("failed")
+                                for x in depends[name])]
+                for name, stage in ready:
+                    del pending[name]
+                    fingerprints[name] = hashlib.sha1(repr((name, stage.get("fingerprint"),
+                                                            [fingerprints[x] for x in depends[name]])
+                                                           ).encode()).hexdigest()
+                    reran = [x for x in depends[name] if x in changed]
+                    checkpoint = stage.get("checkpoint", True)
+                    if (checkpoint and not reran and name in markers
+                            and markers[name][0] == fingerprints[name]):
+                        if markers[name][1] is not None:
+                            stage["result"] = json.loads(markers[name][1])
+                        timings[name] = (datetime.now(), datetime.now())
+                        print("Skipped stage {0}, it finished in an earlier run".format(name))
+                        continue
+                    # Stages that always run only pass on changes
+                    if checkpoint or reran:
+                        changed.add(name)
+                    if checkpoint and resume and "reset" in stage:
+                        stage["reset"]()
+                    running[executor.submit(_run_stage, stage, timings)] = name
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                stage = stages_by_name[name]
+                if task_db and stage.get("checkpoint", True) and not stage.get("failed"):
+                    save_marker(task_db, name, fingerprints[name], stage.get("result"))
+
+    # Report the stages that failed and the ones they held back
+    failed = [name for name in timings if stages_by_name[name].get("failed")]
+    held_back = set()
+    while True:
+        more = {name for name in pending if name not in held_back
+                and any(x in failed or x in held_back for x in depends[name])}
+        if not more:
+            break
+        held_back |= more
+    if failed:
+        print("!! FAILED stages: {0}".format(", ".join(failed)))
+    if held_back:
+        print("!! Not run because a stage they depend on failed: {0}".format(", ".join(sorted(held_back))))
+    if set(pending) - held_back:
+        print("!! FAILED to schedule stages with circular inputs: {0}".format(sorted(set(pending) - held_back)))
+    return timings, depends, failed + sorted(set(pending))
+
+def critical_path(timings, depends):
+    """
+    Finds the chain of dependent stages with the longest total run time,
+    which sets the run time of the whole compilation.
+
+    PARAMETERS
+    ----------
+    timings : dictionary of stage name : (start, end) from run_stages()
+    depends : dictionary of stage name : stages it waited for, from
+        run_stages()
+
+    RETURNS
+    -------
+    path : list of stage names, in the order they ran
+    """
+    finish = {}
+    previous = {}
+    for name in sorted(timings, key=lambda x: timings[x][1]):
+        before = [x for x in depends[name] if x in finish]
+        previous[name] = max(before, key=lambda x: finish[x]) if before else None
+        seconds = (timings[name][1] - timings[name][0]).total_seconds()
+        finish[name] = seconds + (finish[previous[name]] if previous[name] else 0)
+
+    path = []
+    name = max(finish, key=lambda x: finish[x]) if finish else None
+    while name is not None:
+        path.insert(0, name)
+        name = previous[name]
+    return path
+
+def save_stage_timings(task_db, timings, depends):
+    """
+    Saves the run time of each stage, the stages it waited for, and whether
+    it is on the critical path to a stage_timings table in the task database.
+    The critical path is also printed.
+
+    PARAMETERS
+    ----------
+    task_db : string
+        Path to the task database
+    timings : dictionary of stage name : (start, end) from run_stages()
+    depends : dictionary of stage name : stages it waited for, from
+        run_stages()
+    """
+    path = critical_path(timings, depends)
+    print("Critical path: " + " -> ".join(path))
+
+    sql="""
+    DROP TABLE IF EXISTS stage_timings;
+
+    CREATE TABLE stage_timings (stage TEXT PRIMARY KEY,
+                                depends_on TEXT,
+                                start TEXT,
+                                end TEXT,
+                                seconds REAL,
+                                critical INTEGER);
+    """
+    try:
+        cursor, conn = spatialite(task_db)
+        cursor.executescript(sql)
+        cursor.executemany("""INSERT INTO stage_timings VALUES (?, ?, ?, ?, ?, ?);""",
+                           [(name, ",".join(depends[name]), str(start),
+                             str(end), (end - start).total_seconds(),
+                             int(name in path))
+                            for name, (start, end) in timings.items()])
+        conn.commit()
+        conn.close()
+    except Exception as e:
+        print("!! FAILED to save stage timings")
+        print(e)
+
+# ------------------------------------------------------------- Import costs
+# Heavy dependencies and the stages that import them.  Nothing imports them
+# when the module is imported, so runs (and worker processes) only pay for
+# the ones their stages use.
+dependencies = {"range_compiler": "always",
+                "pandas": "make_range_db, insert_opinions, make_references_table, flag_extralimitals, simplified_results",
+                "numpy": "insert_records, strtree engine, flag_extralimitals",
+                "shapely": "strtree engine",
+                "geopandas": "flag_extralimitals",
+                "scipy.spatial": "flag_extralimitals",
+                "sciencebasepy": "download_2001v1",
+                "wrangler_functions": "insert_records",
+                "gapproduction.database": "make_references_table"}
+
+def import_report(paths=(), dependencies=dependencies):
+    """
+    Measures how long each dependency takes to import.  Each one is imported
+    in a fresh interpreter, so dependencies they share (e.g., numpy) are
+    counted for each of them.
+
+    PARAMETERS
+    ----------
+    paths : list of directories to add to sys.path, e.g. the wrangler and
+        gapproduction directories
+    dependencies : dictionary of module name : stages that import it
+
+    RETURNS
+    -------
+    times : dictionary of module name : seconds, or None if the import failed
+    """
+    import subprocess
+
+    code = """import sys, time
+sys.path[0:0] = {0}
+time0 = time.perf_counter()
+import {1}
+print(time.perf_counter() - time0)"""
+    # range_compiler is imported from the directory that holds it
+    paths = [os.path.dirname(os.path.dirname(os.path.abspath(__file__)))] + list(paths)
+
+    times = {}
+    print("Import costs: -------------------")
+    for module, stages in dependencies.items():
+        process = subprocess.run([sys.executable, "-c", code.format(repr(paths), module)],
+                                 capture_output=True, text=True)
+        if process.returncode == 0:
+            times[module] = float(process.stdout.strip().split("\n")[-1])
+            print("{0:<24}{1:>8.3f} s   ({2})".format(module, times[module], stages))
+        else:
+            times[module] = None
+            print("{0:<24}{1:>10}   ({2})".format(module, "missing", stages))
+    return times
+
+# ----------------------------------------------- Recompile codes for some hucs
+def select_hucs(cursor, grid_db, hucs=None, bbox=None):
+    """
+    Lists the subregions selected by codes or by a bounding box.
+
+    PARAMETERS
+    ----------
+    cursor : cursor of a spatialite connection
+    grid_db : string
+        Path to the grid sqlite database
+    hucs : list of HUC12RNG codes
+    bbox : (xmin, ymin, xmax, ymax) in EPSG:5070 meters.  Subregions that
+        intersect it are selected.
+
+    RETURNS
+    -------
+    selected : list of HUC12RNG codes
+    """
+    selected = set(hucs or [])
+    if bbox is not None:
+        attached = [x[1] for x in cursor.execute("PRAGMA database_list;").fetchall()]
+        if "shucs" not in attached:
+            cursor.execute("ATTACH DATABASE '{0}' AS shucs;".format(grid_db))
+        selected.update(x[0] for x in cursor.execute("""
+            SELECT HUC12RNG FROM shucs.huc12rng_gap_polygon
+            WHERE MbrIntersects(geom_5070, BuildMbr(?, ?, ?, ?, 5070));""",
+            tuple(bbox)).fetchall())
+    return sorted(selected)
+
+def recompile_season_hucs(season, hucs, periods, conn, cursor, grid_db,
+                          extralimital_m, use_opinions):
+    """
+    Fills in opinions again for selected hucs and derives the codes and
+    extralimital flags of a season again for them and their neighbours,
+    in place.
+
+    A huc's extralimital flag depends on the codes of hucs within
+    extralimital_m of it, so the codes of hucs within that distance of the
+    selection can change too.  Those flags are computed from codes before
+    adjust_code(), which the task database doesn't keep, so the codes of
+    every huc within twice that distance are derived again in a temporary
+    copy of the season's table.  Only the selection and the hucs within
+    extralimital_m of it are written back.
+
+    PARAMETERS
+    ----------
+    season : string
+        "presence" or a season code like "S", "W", or "Y"
+    hucs : list of HUC12RNG codes
+    periods : the tuple of time periods
+    conn : connection to the task database
+    cursor : cursor of the task database
+    grid_db : string
+        Path to the grid sqlite database
+    extralimital_m : number
+        Limit distance for flag_extralimitals(), in meters
+    use_opinions : boolean
+
+    RETURNS
+    -------
+    changed : set of HUC12RNG codes whose codes were derived again
+    """
+    import numpy as np
+    from scipy.spatial import cKDTree
+    from datetime import datetime
+    time1 = datetime.now()
+
+    season_dict = {"Y": "year_round", "S": "summer", "W": "winter",
+                   "P": "presence", "presence": "presence"}
+    table = season_dict[season]
+
+    # Opinions of the selected hucs -------------------------------------------
+    if use_opinions:
+        try:
+            for period in periods:
+                opinions, opinion_hucs = period_opinions(table, period[0],
+                                                         period[1], cursor)
+                new_subregions(table, [x for x in opinion_hucs if x in set(hucs)],
+                               cursor)
+                opinion_column(table, period[1], opinions, cursor, hucs=hucs)
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            print("!! FAILED to fill in opinions for {0}".format(table))
+            print(e)
+            return set()
+        fill_new_geometries(season, conn, cursor, grid_db)
+
+    # Find the neighbours -----------------------------------------------------
+    rows = cursor.execute("""SELECT strHUC12RNG, X(ST_Centroid(geom_5070)),
+                                    Y(ST_Centroid(geom_5070))
+                             FROM {0} WHERE geom_5070 IS NOT NULL;
+                          """.format(table)).fetchall()
+    selected = set(hucs)
+    points = np.array([x[1:] for x in rows], dtype="float64").reshape(-1, 2)
+    is_selected = np.array([x[0] in selected for x in rows], dtype=bool)
+    if not is_selected.any():
+        print("No selected subregions in {0}".format(table))
+        return set()
+    distance, _ = cKDTree(points[is_selected]).query(points, k=1)
+    names = np.array([x[0] for x in rows])
+    changed = set(names[distance <= extralimital_m]) | (selected & set(names))
+    region = set(names[distance <= 2 * extralimital_m]) | changed
+
+    # Derive codes again in a temporary copy of the table ---------------------
+    # The copy has the table's name, so assign_code() etc. use it instead.
+    codes = ({"{0}_{1}".format(table, x[1]) for x in periods}
+             | {"extralimital_{0}".format(x[1]) for x in periods})
+    columns = [x[1] for x in cursor.execute("PRAGMA main.table_info({0});".format(table))]
+    try:
+        cursor.execute("CREATE TEMP TABLE region_hucs (HUC12RNG TEXT PRIMARY KEY);")
+        cursor.executemany("INSERT INTO region_hucs VALUES (?);", [(x,) for x in region])
+        cursor.execute("""CREATE TEMP TABLE {0} AS SELECT {1} FROM main.{0}
+                          WHERE strHUC12RNG IN (SELECT HUC12RNG FROM region_hucs);
+                       """.format(table, ", ".join(x for x in columns if x not in codes)))
+        conn.commit()
+    except Exception as e:
+        print("!! FAILED to copy {0}".format(table))
+        print(e)
+        cursor.executescript("""DROP TABLE IF EXISTS temp.region_hucs;
+                                DROP TABLE IF EXISTS temp.{0};""".format(table))
+        return set()
+
+    for period in periods:
+        assign_code(season, period, periods, conn, cursor)
+    for period in periods:
+        flag_extralimitals(season, period, conn, cursor,
+                           limit_distance=extralimital_m)
+    for period in periods:
+        adjust_code(season, periods, period, conn, cursor)
+
+    # Write the codes of the selection and its neighbours back ----------------
+    try:
+        cursor.execute("DELETE FROM region_hucs;")
+        cursor.executemany("INSERT INTO region_hucs VALUES (?);", [(x,) for x in changed])
+        updates = ", ".join("{0} = (SELECT {0} FROM temp.{1} AS t WHERE t.strHUC12RNG = {1}.strHUC12RNG)".format(x, table)
+                            for x in columns if x in codes)
+        cursor.execute("""UPDATE main.{0} SET {1}
+                          WHERE strHUC12RNG IN (SELECT HUC12RNG FROM region_hucs);
+                       """.format(table, updates))
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        print("!! FAILED to update codes for {0}".format(table))
+        print(e)
+        changed = set()
+    cursor.executescript("""DROP TABLE IF EXISTS temp.region_hucs;
+                            DROP TABLE IF EXISTS temp.{0};""".format(table))
+    print("Derived {0} codes again for {1} subregions: ".format(table, len(changed)) + str(datetime.now() - time1))
+    return changed
+
+def refresh_simplified_results(database, hucs, value_list):
+    """
+    Fills in the simplified_results table (see simplified_results()) again
+    for some hucs.
+
+    PARAMETERS
+    ----------
+    database : Path to the task database
+    hucs : list of HUC12RNG codes
+    value_list : List of values to be converted to 1.  All other values will
+        be converted to NULL.
+    """
+    conn = sqlite3.connect(database, timeout=600)
+    cur = conn.cursor()
+    try:
+        cur.execute("CREATE TEMP TABLE changed_hucs (HUC12RNG TEXT PRIMARY KEY);")
+        cur.executemany("INSERT INTO changed_hucs VALUES (?);", [(x,) for x in hucs])
+        cur.execute("""INSERT INTO simplified_results (strHUC12RNG)
+                       SELECT HUC12RNG FROM changed_hucs
+                       WHERE HUC12RNG NOT IN (SELECT strHUC12RNG
+                                              FROM simplified_results);""")
+        # Columns are named for a presence or season table and a year
+        columns = [x[1] for x in cur.execute("PRAGMA table_info(simplified_results);")][1:]
+        for column in columns:
+            table = column.rsplit("_", 1)[0]
+            cur.execute(f"""
+            UPDATE simplified_results
+            SET {column} = CASE WHEN strHUC12RNG IN (
+                                    SELECT strHUC12RNG FROM {table}
+                                    WHERE {column} IN {tuple(value_list)})
+                                THEN 1 END
+            WHERE strHUC12RNG IN (SELECT HUC12RNG FROM changed_hucs);
+            """)
+        conn.commit()
+    except Exception as e:
+        print("!! FAILED to update simplified results")
+        print(e)
+    conn.close()
+
+def recompile_hucs(config, hucs=None, bbox=None, conn=None, cursor=None):
+    """
+    Applies edited opinions to a compiled range for a few subregions, e.g.
+    after registering opinions for them in QGIS, without compiling it again.
+    Opinions are loaded again, then opinion columns, codes, extralimital
+    flags, and simplified results are updated in place for the selected
+    subregions and the neighbours whose extralimital flags depend on them
+    (see recompile_season_hucs()).
+
+    PARAMETERS
+    ----------
+    config : CompileConfig
+        Settings for the compilation, the same as when it was compiled
+    hucs : list of HUC12RNG codes
+    bbox : (xmin, ymin, xmax, ymax) in EPSG:5070 meters.  Subregions that
+        intersect it are selected.
+    conn : connection to the task database to reuse, e.g. one kept open by
+        the compile daemon (see daemon.py).  It is left open.
+    cursor : cursor of that connection
+
+    RETURNS
+    -------
+    changed : list of HUC12RNG codes that were updated
+    runtime : timedelta
+        Total runtime
+    """
+    timestamp0 = datetime.now()
+    task_db, periods = config.task_db, config.periods
+
+    years, months, error_tolerance, creator, extralimital_m, use_v1, use_observations, use_opinions = get_parameters(config.parameters_db, config.task_id, config.gap_id)
+
+    keep_open = cursor is not None
+    if not keep_open:
+        cursor, conn = spatialite(task_db)
+    selected = select_hucs(cursor, config.grid_db, hucs=hucs, bbox=bbox)
+    print("Selected {0} subregions".format(len(selected)))
+
+    # Load the opinions again
+    if use_opinions:
+        reset_stage(task_db, tables=["opinions", "tmp_opinions"])
+        insert_opinions(species=config.gap_id, seasons=config.seasons,
+                        years=years, task_db=task_db)
+
+    changed = set()
+    for season in ["presence"] + list(config.seasons or []):
+        changed |= recompile_season_hucs(season, selected, periods, conn,
+                                         cursor, config.grid_db,
+                                         extralimital_m, use_opinions)
+    if not keep_open:
+        conn.close()
+
+    refresh_simplified_results(task_db, sorted(changed), [1,2,3])
+
+    runtime = datetime.now() - timestamp0
+    print("Updated {0} subregions.  Total runtime: ".format(len(changed)) + str(runtime))
+    return sorted(changed), runtime
+
+# ---------------------------------------------------------- Simplified Results
+def simplified_results(database : str, value_list : list,
+                       periods : list) -> None:
+    """
+    Adds a new table to the task_db database that will hold the results of the
+    presence and range tables. Rows for spatial units and columns for presence, 
+    and each of the seasonal range maps compiled.  Values will be 1 or NULL
+    after converting a user specified range of values to 1 and all others to
+    NULL.
+
+    PARAMETERS
+    ----------
+    database : Path to the database to which the table will be added.
+    value_list : List of values to be converted to 1.  All other values will
+        be converted to NULL.
+    periods : List of years that delineate time periods used in the compilation.
+
+    RETURNS
+    -------
+    None
+    """
+    import sqlite3
+    import pandas as pd
+    seasons = ["summer", "winter", "year_round"]
+    years = [x[1] for x in periods]
+
+    # Connect to the database
+    conn = sqlite3.connect(database, timeout=600)
+    cur = conn.cursor()
+
+    # Determine which seasons have tables in the database, and revise seasons
+    # list accordingly
+    sql = """SELECT name FROM sqlite_master WHERE type='table';"""
+    df = pd.read_sql(sql, conn)
+    seasons = [season for season in seasons if season in df.name.values]
+    print(seasons)
+
+    # Create a results table with strHUC12RNG as the primary key and that has
+    # strHUC12RNG values in it that are in presence or any season tables that
+    # exist in the database
+    sql = """CREATE TABLE simplified_results (strHUC12RNG TEXT PRIMARY KEY);"""
+    cur.execute(sql)
+    conn.commit()
+
+    # Add strHUC12RNG values to the simplified_results table
+    sql = f"""
+    INSERT INTO simplified_results (strHUC12RNG)
+    SELECT strHUC12RNG FROM presence;
+    """
+    cur.executescript(sql)
+    conn.commit()
+
+    # Add any strHUC12RNG values from the season tables that are not already
+    # in the simplified_results table
+    for season in seasons:
+        sql = f"""
+        INSERT INTO simplified_results (strHUC12RNG)
+        SELECT strHUC12RNG FROM {season}
+        WHERE strHUC12RNG NOT IN (
+            SELECT strHUC12RNG FROM simplified_results
+        );
+        """
+        cur.executescript(sql)
+        conn.commit()
+
+    # Add presence values to the simplified_results table
+    for year in years:
+        sql = f"""
+        ALTER TABLE simplified_results ADD COLUMN presence_{year} INTEGER;
+
+        /* Fill out the presence column with 1 where the value in the presence
+        table is in the value_list and NULL otherwise */
+        UPDATE simplified_results
+        SET presence_{year} = 1
+        WHERE strHUC12RNG IN (
+            SELECT strHUC12RNG FROM presence
+            WHERE presence_{year} IN {tuple(value_list)}
+        );
+        """
+        cur.executescript(sql)
+        conn.commit()
+
+
+    # Add season columns to the table if a table exists for the season
+    # Loop through the seasons
+    for season in seasons:
+        # Add columns to the simplified_results table for each year
+        for year in years:
+            sql = f"""
+            ALTER TABLE simplified_results ADD COLUMN {season}_{year} INTEGER;
+            """
+            cur.execute(sql)
+            conn.commit()
+
+            # Fill out the season column with 1 where the value in the corresponding
+            # season table is in the value_list and NULL otherwise
+            def update_simplified_results(season : str, year : int) -> None:
+                sql = f"""
+                UPDATE simplified_results
+                SET {season}_{year} = 1
+                WHERE strHUC12RNG IN (
+                    SELECT strHUC12RNG FROM {season}
+                    WHERE {season}_{year} IN {tuple(value_list)}
+                );
+                """
+                cur.execute(sql)
+                conn.commit()
+            
+            update_simplified_results(season, year)
+
+
+    # Close the database connection
+    conn.close()
+
+    return None
+
+# :::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+# :::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+# :::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+def compile_range(config):
+    """
+    Compiles a range for a species and task.  Everything the compilation
+    needs comes from config, so this can be called repeatedly in one process
+    (e.g., from a notebook, batch driver, or service).  Worker pools are
+    started and closed within each call.  If a stage fails, the stages that
+    depend on it aren't run and a RuntimeError is raised once the others
+    finish.
+
+    PARAMETERS
+    ----------
+    config : CompileConfig
+        Settings for the compilation
+
+    RETURNS
+    -------
+    runtime : timedelta
+        Total runtime of the compilation
+
+    OUTPUT
+    ------
+    The task database (config.task_db) with the compiled range.
+    """
+    import warnings
+    warnings.simplefilter(action='ignore', category=FutureWarning)
+
+    print("\n**********************************************************",
+          "\n**********************************************************")
+    timestamp0 = datetime.now()
+
+    # Make the wrangler and gapproduction code importable
+    for path in (config.wrangler_path, config.gapproductionDir):
+        if path not in sys.path:
+            sys.path.append(path)
+
+    # Make a temp dir in the working directory if it doesn't already exist
+    if not os.path.exists(config.tmpDir):
+        os.makedirs(config.tmpDir)
+
+    gap_id, task_id = config.gap_id, config.task_id
+    seasons, workDir, ww_output = config.seasons, config.workDir, config.ww_output
+    codeDir, grid_db, parameters_db = config.codeDir, config.grid_db, config.parameters_db
+    task_db, tmpDir, periods = config.task_db, config.tmpDir, config.periods
+    overlap_cache_db = config.overlap_cache_db
+    spatial_template_db = config.spatial_template_db
+    intersection_engine = config.intersection_engine
+    n_workers, worker_memory_mb = config.n_workers, config.worker_memory_mb
+
+    # Start over unless resuming an earlier run
+    if not config.resume:
+        for path in (task_db, task_db + "-wal", task_db + "-shm"):
+            if os.path.exists(path):
+                os.remove(path)
+
+    # Get parameters
+    years, months, error_tolerance, creator, extralimital_m, use_v1, use_observations, use_opinions = get_parameters(parameters_db, task_id, gap_id)
+
+    # Fingerprint the inputs that stages read, so that stages that finished
+    # in an earlier run are only skipped if what they read is the same (see
+    # run_stages()).  Worker counts and memory don't change results.
+    time1 = datetime.now()
+    task_row = rows_fingerprint(parameters_db,
+                                """SELECT * FROM tasks
+                                   WHERE task_id = ? AND species_id = ?;""",
+                                (task_id, gap_id))
+    grid = file_fingerprint(grid_db)
+    wrangler = [file_fingerprint(x) for x in ww_output] if use_observations else None
+    opinions = opinions_fingerprint(gap_id) if use_opinions else None
+    print("Fingerprinted inputs: " + str(datetime.now() - time1))
+
+    # Declare each stage of the compilation with the data it reads and makes.
+    # Stages start once their inputs are ready, so independent ones run at
+    # once (see run_stages()).
+    seasons = list(seasons) if seasons is not None else []
+    season_tables = {"Y": "year_round", "S": "summer", "W": "winter",
+                     "presence": "presence"}
+    stages = []
+
+    # Get the existing GAP range data (2001v1)
+    if use_v1:
+        download = {"name": "download_2001v1",
+                    "function": lambda: download_GAP_range_CONUS2001v1(gap_id, tmpDir),
+                    "fingerprint": gap_id,
+                    "inputs": [], "outputs": ["2001v1"]}
+        stages.append(download)
+    else:
+        print("Not using 2001v1 data.")
+        download = {"result": (False, None)}
+
+    # Make the template for in-memory databases of workers
+    stages.append({"name": "spatial_template",
+                   "function": lambda: spatial_template(spatial_template_db),
+                   "inputs": [], "outputs": ["template"]})
+
+    # Make the range database for processing and results
+    stages.append({"name": "make_range_db",
+                   "function": lambda: make_range_db(task_db=task_db, gap_id=gap_id, grid_db=grid_db,
+                                                     inDir=tmpDir, workDir=workDir,
+                                                     sb_success=download["result"][0],
+                                                     seasons=seasons, parameters_db=parameters_db,
+                                                     use_v1=use_v1, use_observations=use_observations),
+                   "fingerprint": (gap_id, seasons, grid, use_v1, use_observations),
+                   "inputs": ["2001v1"], "outputs": ["task_db"]})
+
+    # Document the compilation
+    stages.append({"name": "compilation_info",
+                   "function": lambda: compilation_info(task_db=task_db, gap_id=gap_id,
+                                                        task_id=task_id,
+                                                        parameters_db=parameters_db,
+                                                        author=config.author,
+                                                        code_version=config.code_version),
+                   "fingerprint": (task_row, config.author),
+                   "inputs": ["task_db"], "outputs": ["compilation_info"]})
+
+    # Add a references table
+    stages.append({"name": "make_references_table",
+                   "function": lambda: make_references_table(species=gap_id, task_db=task_db,
+                                                             ww_output=ww_output,
+                                                             use_observations=use_observations,
+                                                             use_opinions=use_opinions),
+                   "reset": lambda: reset_stage(task_db, tables=["references"]),
+                   "fingerprint": (wrangler, opinions),
+                   "inputs": ["task_db"], "outputs": ["references"]})
+
+    # Insert occurrence records into range database
+    if use_observations:
+        stages.append({"name": "insert_records",
+                       "function": lambda: insert_records(years=years, months=months,
+                                                          task_db=task_db, ww_output=ww_output,
+                                                          wrangler_path=config.wrangler_path),
+                       "reset": lambda: reset_stage(task_db, tables=["occurrence_records"]),
+                       "fingerprint": (wrangler, years, months),
+                       "inputs": ["task_db"],
+                       "outputs": ["occurrence_records"]})
+
+        # Leave out records that could never be attributed to a subregion
+        stages.append({"name": "reject_large_footprints",
+                       "function": lambda: reject_large_footprints(task_id=task_id, gap_id=gap_id,
+                                                                   task_db=task_db,
+                                                                   parameters_db=parameters_db,
+                                                                   grid_db=grid_db,
+                                                                   cache_db=overlap_cache_db),
+                       "reset": lambda: reset_stage(task_db, columns=[("occurrence_records",
+                                                                       "too_large")]),
+                       "fingerprint": (error_tolerance, grid),
+                       "inputs": ["occurrence_records"], "outputs": ["too_large"]})
+
+    # Insert opinion records into range database
+    if use_opinions:
+        stages.append({"name": "insert_opinions",
+                       "function": lambda: insert_opinions(species=gap_id, seasons=seasons,
+                                                           years=years, task_db=task_db),
+                       "reset": lambda: reset_stage(task_db, tables=["opinions", "tmp_opinions"]),
+                       "fingerprint": (opinions, seasons, years),
+                       "inputs": ["task_db"], "outputs": ["opinions"]})
+
+    # Attribute occurrence records to subregions once for all periods/seasons
+    if use_observations:
+        stages.append({"name": "attribute_records",
+                       "function": lambda: attribute_records(task_id=task_id, gap_id=gap_id,
+                                                             task_db=task_db,
+                                                             parameters_db=parameters_db,
+                                                             grid_db=grid_db,
+                                                             cache_db=overlap_cache_db,
+                                                             template_db=spatial_template_db,
+                                                             engine=intersection_engine,
+                                                             n_workers=n_workers,
+                                                             max_memory_mb=worker_memory_mb),
+                       "reset": lambda: reset_stage(task_db, tables=["record_attributions"]),
+                       "fingerprint": (error_tolerance, grid, intersection_engine),
+                       "inputs": ["occurrence_records", "too_large", "template"],
+                       "outputs": ["record_attributions"]})
+
+    # Start one pool of workers for presence and all seasons, and one process
+    # that writes their results to the task database
+    pool_stage = {"name": "compile_pool",
+                  "function": lambda: compile_pool(parameters_db=parameters_db, grid_db=grid_db,
+                                                   task_db=task_db, template_db=spatial_template_db,
+                                                   n_workers=min(n_workers,
+                                                                 2 * len(periods) * (1 + len(seasons)))),
+                  "inputs": ["task_db", "template"], "outputs": ["pool"],
+                  "checkpoint": False}
+    stages.append(pool_stage)
+    writer_stage = {"name": "task_db_writer",
+                    "function": lambda: task_db_writer(task_db),
+                    "inputs": ["task_db"], "outputs": ["writer"],
+                    "checkpoint": False}
+    stages.append(writer_stage)
+
+    # Presence and the seasons are independent of each other, so each one is
+    # a stage that compiles on the shared pool.
+    for season in ["presence"] + seasons:
+        stages.append({"name": "compile_" + season_tables[season],
+                       "function": lambda season=season: compile_season(season, periods,
+                                                                        pool_stage["result"],
+                                                                        writer_stage["result"],
+                                                                        grid_db,
+                                                                        use_observations,
+                                                                        use_opinions,
+                                                                        extralimital_m),
+                       "fingerprint": (periods, task_row, grid, use_observations,
+                                       use_opinions),
+                       "inputs": ["pool", "writer", "record_attributions", "opinions"],
+                       "outputs": [season_tables[season]]})
+
+    # Calculate age of last record
+    if use_observations:
+        stages.append({"name": "last_record",
+                       "function": lambda: last_record(task_id, gap_id, task_db, parameters_db,
+                                                       workDir, codeDir, grid_db),
+                       "reset": lambda: reset_stage(task_db, rows=["last_record"]),
+                       "fingerprint": grid,
+                       "inputs": ["record_attributions", "presence"],
+                       "outputs": ["last_record"]})
+
+    # Make a table of simplified results with 1 and NULL values
+    stages.append({"name": "simplified_results",
+                   "function": lambda: simplified_results(task_db, [1,2,3], periods),
+                   "reset": lambda: reset_stage(task_db, tables=["simplified_results"]),
+                   "fingerprint": periods,
+                   "inputs": [season_tables[x] for x in ["presence"] + seasons] + ["last_record"],
+                   "outputs": ["simplified_results"]})
+
+    # Run the stages and save how long each one took.  Any stage may change
+    # with the code.
+    for stage in stages:
+        stage["fingerprint"] = (config.code_version, stage.get("fingerprint"))
+    timings, depends, failed = run_stages(stages, task_db=task_db, resume=config.resume)
+    for stage in (pool_stage, writer_stage):
+        if "result" in stage:
+            stage["result"].close()
+            stage["result"].join()
+    save_stage_timings(task_db, timings, depends)
+    if failed:
+        raise RuntimeError("Compilation of {0} failed, stages not finished: {1}".format(gap_id, ", ".join(failed)))
+
+    # Total runtime
+    runtime = datetime.now() - timestamp0
+    print("Total runtime: " + str(runtime))
+    return runtime
+
+def add_new_records(config):
+    """
+    Adds occurrence records that are new since a range was compiled, e.g.
+    after new downloads are appended to the wildlife-wrangler databases.
+    Only records whose record_id isn't in the task database are inserted
+    and intersected with the grid.  Their weights are added to the stored
+    sums for each huc, season, and period, and codes are derived again in
+    place for the hucs whose weights changed and the neighbours whose
+    extralimital flags depend on them (see recompile_season_hucs()).  If
+    there is no compiled task database, the range is compiled with
+    compile_range().
+
+    PARAMETERS
+    ----------
+    config : CompileConfig
+        Settings for the compilation, the same as when it was compiled
+
+    RETURNS
+    -------
+    runtime : timedelta
+        Total runtime
+
+    OUTPUT
+    ------
+    The updated task database (config.task_db) and a new_records table in it
+    with the IDs of the records that were added.
+    """
+    import warnings
+    import dataclasses
+    warnings.simplefilter(action='ignore', category=FutureWarning)
+
+    print("\n**********************************************************",
+          "\n**********************************************************")
+    timestamp0 = datetime.now()
+
+    # Make the wrangler and gapproduction code importable
+    for path in (config.wrangler_path, config.gapproductionDir):
+        if path not in sys.path:
+            sys.path.append(path)
+
+    task_db, periods = config.task_db, config.periods
+    season_tables = {"Y": "year_round", "S": "summer", "W": "winter",
+                     "presence": "presence"}
+    seasons = ["presence"] + list(config.seasons or [])
+
+    # Records can only be added to a finished compilation
+    tables = []
+    if os.path.exists(task_db):
+        conn = sqlite3.connect(task_db, timeout=600)
+        tables = [x[0] for x in conn.execute("SELECT name FROM sqlite_master;")]
+        conn.close()
+    if not {"record_attributions", "huc_weights", "simplified_results"} <= set(tables):
+        print("No compiled task database to add records to, compiling the range")
+        return compile_range(dataclasses.replace(config, resume=True))
+
+    years, months, error_tolerance, creator, extralimital_m, use_v1, use_observations, use_opinions = get_parameters(config.parameters_db, config.task_id, config.gap_id)
+    if not use_observations:
+        print("The task doesn't use occurrence records")
+        return datetime.now() - timestamp0
+
+    # Insert the new records ---------------------------------------------------
+    n_new = insert_new_records(years=years, months=months, task_db=task_db,
+                               ww_output=config.ww_output,
+                               wrangler_path=config.wrangler_path)
+    if n_new == 0:
+        runtime = datetime.now() - timestamp0
+        print("No new records.  Total runtime: " + str(runtime))
+        return runtime
+
+    # Attribute them to subregions ---------------------------------------------
+    spatial_template(config.spatial_template_db)
+    if not reject_large_footprints(task_id=config.task_id, gap_id=config.gap_id,
+                                   task_db=task_db,
+                                   parameters_db=config.parameters_db,
+                                   grid_db=config.grid_db,
+                                   cache_db=config.overlap_cache_db):
+        raise RuntimeError("footprints of the new records weren't checked")
+    if not attribute_records(task_id=config.task_id, gap_id=config.gap_id,
+                             task_db=task_db, parameters_db=config.parameters_db,
+                             grid_db=config.grid_db, cache_db=config.overlap_cache_db,
+                             template_db=config.spatial_template_db,
+                             engine=config.intersection_engine,
+                             n_workers=config.n_workers,
+                             max_memory_mb=config.worker_memory_mb, only_new=True):
+        raise RuntimeError("the new records weren't attributed to subregions")
+
+    # Add their weights and derive codes again ---------------------------------
+    cursor, conn = spatialite(task_db)
+    changed = set()
+    for season in seasons:
+        time1 = datetime.now()
+        table = season_tables[season]
+
+        # Sum the weights of the new records
+        new_weights = []
+        for period in periods:
+            for era in ['recent', 'historical']:
+                get_attributions(period[0], period[1], conn, cursor, era,
+                                 table, only_new=True)
+                weights = calculate_weight(era, period[1], cursor)
+                cursor.execute("DROP TABLE IF EXISTS big_nuff_{0};".format(era))
+                conn.commit()
+                if weights:
+                    new_weights.append((era, period, weights))
+        if not new_weights:
+            print("No new evidence for {0}".format(table))
+            continue
+
+        # Add them to the stored weights in one transaction
+        try:
+            cursor.execute("BEGIN;")
+            for era, period, weights in new_weights:
+                add_weights(table, era, period[0], period[1], weights, cursor)
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            print("!! FAILED to add weights for {0}, rolled back".format(table))
+            print(e)
+            continue
+
+        # Derive codes again where the weights changed.  Opinions didn't
+        # change, but subregions that are new to the table need geometries.
+        hucs = sorted({x[0] for era, period, weights in new_weights
+                       for x in weights})
+        fill_new_geometries(season, conn, cursor, config.grid_db)
+        changed |= recompile_season_hucs(season, hucs, periods, conn, cursor,
+                                         config.grid_db, extralimital_m, False)
+        print("Updated {0}: ".format(table) + str(datetime.now() - time1))
+    conn.close()
+
+    # Update the last records and simplified results ---------------------------
+    reset_stage(task_db, rows=["last_record"])
+    last_record(config.task_id, config.gap_id, task_db, config.parameters_db,
+                config.workDir, config.codeDir, config.grid_db)
+    refresh_simplified_results(task_db, sorted(changed), [1,2,3])
+
+    runtime = datetime.now() - timestamp0
+    print("Added {0} records.  Total runtime: ".format(n_new) + str(runtime))
+    return runtime
@@ -0,0 +1,182 @@
+"""
+A local compile service for editing ranges interactively, e.g. from the QGIS
+tools.  It runs on localhost and keeps what recompile_hucs() needs warm
+between requests: its heavy dependencies are imported once, and each task
+database stays open with the grid attached and a large page cache, so
+updating a few subregions after an opinion is registered doesn't pay for
+starting a compilation.
+
+Requests are handled one at a time, so only one of them writes to a task
+database at once.
+
+POST /recompile with a JSON object like
+    {"gap_id": "mAMMAx", "task_id": "...", "hucs": ["...", ...]}
+or with "bbox": [xmin, ymin, xmax, ymax] in EPSG:5070 instead of "hucs".
+Any other CompileConfig settings can be given too.  The seasons default to
+those that the task database has tables for.  The response lists the codes
+of the subregions that were updated:
+    {"hucs": [...], "runtime": seconds,
+     "codes": {table: {strHUC12RNG: {column: value, ...}, ...}, ...}}
+
+GET /tasks lists the task databases that are open.
+
+Start it with "python compile-daemon.py".
+"""
+import os
+import json
+import traceback
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from .compiler import CompileConfig, recompile_hucs, spatialite
+
+# Task database path : (cursor, connection) kept open between requests
+_tasks = {}
+
+# Settings that every request's CompileConfig starts from (see serve())
+_defaults = {}
+
+# ------------------------------------------------------ Open task databases
+def task_connection(config):
+    """
+    Gets the open connection to a task database, or opens it.
+
+    PARAMETERS
+    ----------
+    config : CompileConfig
+
+    RETURNS
+    -------
+    cursor, connection
+    """
+    if config.task_db not in _tasks:
+        if not os.path.exists(config.task_db):
+            raise FileNotFoundError("No compiled range at " + config.task_db)
+        cursor, conn = spatialite(config.task_db)
+        # Keep pages of the task database in memory between requests, along
+        # with the temporary tables that recompile_season_hucs() makes
+        cursor.executescript("""PRAGMA cache_size = -262144;
+                                PRAGMA temp_store = MEMORY;""")
+        cursor.execute("ATTACH DATABASE '{0}' AS shucs;".format(config.grid_db))
+        _tasks[config.task_db] = (cursor, conn)
+    return _tasks[config.task_db]
+
+def task_seasons(cursor):
+    """
+    Lists the seasons that a task database has tables for.
+
+    PARAMETERS
+    ----------
+    cursor : cursor of the task database
+
+    RETURNS
+    -------
+    seasons : list of season codes like "S", "W", or "Y"
+    """
+    tables = {x[0] for x in cursor.execute("""SELECT name FROM main.sqlite_master
+                                              WHERE type = 'table';""")}
+    return [code for code, table in (("Y", "year_round"), ("S", "summer"),
+                                     ("W", "winter"))
+            if table in tables]
+
+def huc_codes(cursor, seasons, hucs):
+    """
+    Gets the codes, extralimital flags, and opinions of some hucs.
+
+    PARAMETERS
+    ----------
+    cursor : cursor of the task database
+    seasons : list of season codes like "S", "W", or "Y"
+    hucs : list of HUC12RNG codes
+
+    RETURNS
+    -------
+    codes : dictionary of table : {strHUC12RNG : {column : value}}
+    """
+    season_dict = {"Y": "year_round", "S": "summer", "W": "winter"}
+    codes = {}
+    for table in ["presence"] + [season_dict[x] for x in seasons]:
+        columns = [x[1] for x in cursor.execute("PRAGMA main.table_info({0});".format(table))
+                   if x[1].startswith((table + "_", "extralimital_", "opinion_"))]
+        rows = cursor.execute("""SELECT strHUC12RNG, {1} FROM main.{0}
+                                 WHERE strHUC12RNG IN ({2});
+                              """.format(table, ", ".join(columns),
+                                         ", ".join("?" * len(hucs))),
+                              tuple(hucs)).fetchall() if hucs else []
+        codes[table] = {x[0]: dict(zip(columns, x[1:])) for x in rows}
+    return codes
+
+# ----------------------------------------------------------------- Requests
+class _Handler(BaseHTTPRequestHandler):
+    def _respond(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path != "/tasks":
+            self._respond(404, {"error": "Unknown path " + self.path})
+            return
+        self._respond(200, {"tasks": sorted(_tasks)})
+
+    def do_POST(self):
+        if self.path != "/recompile":
+            self._respond(404, {"error": "Unknown path " + self.path})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            hucs, bbox = request.pop("hucs", None), request.pop("bbox", None)
+            settings = dict(_defaults, task_name=request.get("gap_id"), seasons=None)
+            settings.update(request)
+            config = CompileConfig(**settings)
+        except Exception as e:
+            self._respond(400, {"error": str(e)})
+            return
+        try:
+            cursor, conn = task_connection(config)
+            if config.seasons is None:
+                config.seasons = task_seasons(cursor)
+            changed, runtime = recompile_hucs(config, hucs=hucs, bbox=bbox,
+                                              conn=conn, cursor=cursor)
+            self._respond(200, {"hucs": changed,
+                                "runtime": runtime.total_seconds(),
+                                "codes": huc_codes(cursor, config.seasons, changed)})
+        except Exception as e:
+            traceback.print_exc()
+            self._respond(500, {"error": str(e)})
+
+# -------------------------------------------------------------------- Serve
+def serve(defaults, port=8765):
+    """
+    Runs the compile daemon on localhost until it is interrupted.
+
+    PARAMETERS
+    ----------
+    defaults : dictionary of CompileConfig settings for every request, e.g.
+        author, workDir, grid_db, and paths that compile_range() would use
+    port : integer
+        Port to listen on
+    """
+    import importlib
+    from datetime import datetime
+    time1 = datetime.now()
+    _defaults.update(defaults)
+    _defaults.setdefault("ww_output", ())
+
+    # Import what recompile_hucs() uses now rather than in the first request
+    for module in ("pandas", "numpy", "scipy.spatial", "geopandas"):
+        importlib.import_module(module)
+    print("Imported dependencies: " + str(datetime.now() - time1))
+
+    server = HTTPServer(("localhost", port), _Handler)
+    print("Compile daemon listening on http://localhost:{0}".format(port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        for cursor, conn in _tasks.values():
+            conn.close()
+        _tasks.clear()
@@ -0,0 +1,125 @@
+"""
+Recompiling a few subregions in place (recompile_season_hucs()) should give
+the same codes as deriving the whole season again.
+
+Needs mod_spatialite, pandas, geopandas, and scipy, and is skipped without
+them.  Run with "python -m pytest" from the repository root.
+"""
+import pytest
+
+pytest.importorskip("pandas")
+pytest.importorskip("geopandas")
+pytest.importorskip("scipy")
+
+from range_compiler import compiler
+
+# A row of 12 subregions, 10 km wide, along the x axis
+HUCS = ["{0:012d}".format(i) for i in range(12)]
+PERIODS = ((2001, 2005), (2006, 2010))
+EXTRALIMITAL_M = 25000
+
+
+def connect(path):
+    try:
+        return compiler.spatialite(str(path))
+    except Exception as e:
+        pytest.skip("spatialite is not available: {0}".format(e))
+
+
+def make_parameters(path):
+    cursor, conn = connect(path)
+    cursor.executescript("""
+        CREATE TABLE tasks (task_id TEXT, species_id TEXT, months TEXT,
+                            years TEXT, error_tolerance INT, creator TEXT,
+                            extralimital_cutoff_m INT, use_GAPv1 TEXT,
+                            use_opinion TEXT, use_observations TEXT);
+        INSERT INTO tasks VALUES ('test', 'mTESTx', '1,2,3,4,5,6,7,8,9,10,11,12',
+                                  '1980,2025', 10, 'tester', {0}, 'yes', 'no',
+                                  'yes');
+        """.format(EXTRALIMITAL_M))
+    conn.commit()
+    conn.close()
+
+
+def make_task(path, documented):
+    """
+    A presence table over the grid.  Subregions 0-6 were range in GAP v1,
+    and those in documented have a record in the first period.
+    """
+    cursor, conn = connect(path)
+    cursor.execute("SELECT InitSpatialMetaData(1);")
+    cursor.executescript("""
+        CREATE TABLE presence (strHUC12RNG TEXT PRIMARY KEY,
+                               presence_2001v1 INT,
+                               documented_2005 INT, documented_2010 INT,
+                               opinion_2005 INT, opinion_2005_weight REAL,
+                               opinion_2010 INT, opinion_2010_weight REAL);
+        SELECT AddGeometryColumn('presence', 'geom_5070', 5070, 'POLYGON', 'XY');
+        """)
+    for i, huc in enumerate(HUCS):
+        x0, x1 = i * 10000, (i + 1) * 10000
+        cursor.execute("""INSERT INTO presence (strHUC12RNG, presence_2001v1,
+                                                documented_2005, geom_5070)
+                          VALUES (?, ?, ?, GeomFromText(?, 5070));""",
+                       (huc, 1 if i <= 6 else None,
+                        1 if i in documented else None,
+                        "POLYGON(({0} 0, {1} 0, {1} 10000, {0} 10000, {0} 0))".format(x0, x1)))
+    conn.commit()
+    return cursor, conn
+
+
+def derive(cursor, conn):
+    # The order that finish_season() uses
+    for period in PERIODS:
+        compiler.assign_code("presence", period, PERIODS, conn, cursor)
+    for period in PERIODS:
+        compiler.flag_extralimitals("presence", period, conn, cursor,
+                                    limit_distance=EXTRALIMITAL_M)
+    for period in PERIODS:
+        compiler.adjust_code("presence", PERIODS, period, conn, cursor)
+
+
+def codes(cursor):
+    return cursor.execute("""SELECT strHUC12RNG, presence_2005, presence_2010,
+                                    extralimital_2005, extralimital_2010
+                             FROM presence ORDER BY strHUC12RNG;""").fetchall()
+
+
+def test_get_parameters_extralimital_distance(tmp_path):
+    make_parameters(tmp_path / "parameters.sqlite")
+    parameters = compiler.get_parameters(str(tmp_path / "parameters.sqlite"),
+                                         "test", "mTESTx")
+    assert parameters[4] == EXTRALIMITAL_M
+
+
+def test_recompile_season_hucs_matches_full_derivation(tmp_path):
+    make_parameters(tmp_path / "parameters.sqlite")
+    extralimital_m = compiler.get_parameters(str(tmp_path / "parameters.sqlite"),
+                                             "test", "mTESTx")[4]
+
+    # Compiled with a record in subregion 7, then a record in subregion 10
+    # comes in and only that subregion is recompiled
+    cursor, conn = make_task(tmp_path / "subset.sqlite", documented={7})
+    derive(cursor, conn)
+    cursor.execute("UPDATE presence SET documented_2005 = 1 WHERE strHUC12RNG = ?;",
+                   (HUCS[10],))
+    conn.commit()
+    changed = compiler.recompile_season_hucs("presence", [HUCS[10]], PERIODS,
+                                             conn, cursor, None,
+                                             extralimital_m, False)
+    subset = codes(cursor)
+    conn.close()
+
+    # Subregions within the extralimital distance of the selection
+    assert changed == set(HUCS[8:12])
+
+    # Compiled with both records from the start
+    cursor, conn = make_task(tmp_path / "full.sqlite", documented={7, 10})
+    derive(cursor, conn)
+    full = codes(cursor)
+    conn.close()
+
+    assert subset == full
+    # Subregion 10 is 40 km from range, so its record is an extralimital
+    huc10 = dict((x[0], x[1:]) for x in full)[HUCS[10]]
+    assert huc10 == (1, 4, 1, None)